@@ -35,6 +35,97 @@ function createTopHitsTable(selector, data) {
     });
 }
 
+function formatDuration(seconds) {
+    if (seconds === null) {
+        return 'unknown';
+    }
+    const minutes = Math.floor(seconds / 60);
+    return minutes ? `${minutes} min ${Math.round(seconds % 60)} s` : `${Math.round(seconds)} s`;
+}
+
+function showProgress(selector, steps, currentStep = '') {
+    // FIXME: Manually constructed HTML; change
+    const rows = steps.map(step => {
+        const status = step.done ? 'done' : `about ${formatDuration(step.eta_seconds)} remaining`;
+        return `<li><b>${step.step}</b>: ${step.rows.toLocaleString()} rows
+            (${Math.round(step.rows_per_second).toLocaleString()} rows/s), ${status}</li>`;
+    });
+    const heading = currentStep ? `<p>${currentStep}</p>` : '';
+    document.querySelector(selector).innerHTML = heading + (rows.length ? `<ul>${rows.join('')}</ul>` : '');
+}
+
+function pollProgress(url, selector, interval = 3000) {
+    // Show live progress while the file is processed, and reload the page when the results are ready
+    fetch(url, { credentials: 'same-origin' })
+        .then(resp => {
+            if (!resp.ok) {
+                throw Error('Could not fetch ingest progress');
+            }
+            return resp.json();
+        })
+        .then(data => {
+            if (data.status !== 'pending') {
+                window.location.reload();
+                return;
+            }
+            showProgress(selector, data.steps);
+            window.setTimeout(() => pollProgress(url, selector, interval), interval);
+        }).catch(err => console.error(err));
+}
+
+
+function watchProgress(url, progressUrl, selector) {
+    // Receive progress as it happens, and reload the page when the results are ready
+    const steps = new Map();
+    let currentStep = '';
+    const source = new EventSource(url);
+    const show = () => showProgress(selector, Array.from(steps.values()), currentStep);
+    const finish = status => {
+        if (status !== 'pending') {
+            source.close();
+            window.location.reload();
+        }
+    };
+
+    source.addEventListener('snapshot', event => {
+        const data = JSON.parse(event.data);
+        steps.clear();
+        data.steps.forEach(step => steps.set(step.step, step));
+        show();
+        finish(data.status);
+    });
+    source.addEventListener('progress', event => {
+        const step = JSON.parse(event.data);
+        steps.set(step.step, step);
+        show();
+    });
+    source.addEventListener('step', event => {
+        const data = JSON.parse(event.data);
+        currentStep = `${data.label}: ${data.state}`;
+        show();
+    });
+    source.addEventListener('status', event => finish(JSON.parse(event.data).status));
+    source.addEventListener('end', event => {
+        // There is nothing more to wait for, so don't reconnect. (If the file has been processed, the snapshot has
+        //  already reloaded the page.)
+        source.close();
+        if (JSON.parse(event.data).status === 'pending') {
+            // Live updates are not available; check now and then instead
+            pollProgress(progressUrl, selector);
+        }
+    });
+}
+
+
+if (window.template_args.ingest_status === 0) {
+    window.addEventListener('load', () => {
+        if (window.EventSource) {
+            watchProgress(window.template_args.events_url, window.template_args.progress_url, '#ingest-progress');
+        } else {
+            pollProgress(window.template_args.progress_url, '#ingest-progress');
+        }
+    });
+}
 
 if (window.template_args.ingest_status === 2) {
     // If the file has been processed, show processed results
@@ -10,7 +10,12 @@ import pako from 'pako';
 import App from '../../vue/gwas_upload.vue';
 
 const PREVIEW_BYTES = 5000;  // enough for 50-100 lines
-const MAX_UPLOAD_SIZE = 1048576 * 500; // 500 MiB
+const MAX_UPLOAD_SIZE = window.template_args.max_upload_size; // Set by the server (LZ_MAX_UPLOAD_SIZE)
+
+// Files are sent in parts, so that a dropped connection only means sending the current part again
+const UPLOAD_URL = '/api/v1/uploads/';
+const CHUNK_SIZE = 1048576 * 8; // 8 MiB
+const MAX_RETRIES = 5;
 
 
 class BaseReader {
@@ -94,6 +99,69 @@ function makeReader(filename, blob) {
     }
 }
 
+// 2. Resumable uploads (using the tus protocol: https://tus.io/protocols/resumable-upload.html)
+function tusRequest(url, method, headers = {}, body = null) {
+    return fetch(url, {
+        method,
+        body,
+        credentials: 'same-origin',
+        headers: Object.assign({
+            'Tus-Resumable': '1.0.0',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value,
+        }, headers),
+    }).then(resp => {
+        if (resp.ok) {
+            return resp;
+        }
+        // The server refused the request (eg, the file can't be read with the chosen options)
+        return resp.json().catch(() => ({})).then(data => {
+            const detail = data.errors ? data.errors[0].detail : data.detail;
+            const error = new Error(detail || `Upload failed (${resp.status})`);
+            error.status = resp.status;
+            throw error;
+        });
+    });
+}
+
+function getOffset(resp) {
+    return parseInt(resp.headers.get('Upload-Offset'), 10);
+}
+
+function createUpload(file, parserOptions) {
+    const encode = value => btoa(unescape(encodeURIComponent(value)));
+    const metadata = `filename ${encode(file.name)},parser_options ${encode(parserOptions)}`;
+    return tusRequest(UPLOAD_URL, 'POST', { 'Upload-Length': file.size, 'Upload-Metadata': metadata })
+        .then(resp => resp.headers.get('Location'));
+}
+
+function sendChunk(url, file, offset, retries = 0) {
+    // Send one part of the file, and return the new offset. If the connection drops, ask the server how much it
+    //  received, and resume from there.
+    const chunk = file.slice(offset, offset + CHUNK_SIZE);
+    const headers = { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': offset };
+    return tusRequest(url, 'PATCH', headers, chunk)
+        .then(getOffset)
+        .catch(err => {
+            if ((err.status && err.status !== 409) || retries >= MAX_RETRIES) {
+                throw err;
+            }
+            return new Promise(resolve => window.setTimeout(resolve, 1000 * 2 ** retries))
+                .then(() => tusRequest(url, 'HEAD'))
+                .then(getOffset, () => offset)
+                .then(resumeAt => sendChunk(url, file, resumeAt, retries + 1));
+        });
+}
+
+function sendFile(url, file, onProgress, offset = 0) {
+    if (offset >= file.size) {
+        return Promise.resolve(url);
+    }
+    return sendChunk(url, file, offset).then(next => {
+        onProgress(next / file.size);
+        return sendFile(url, file, onProgress, next);
+    });
+}
+
 // Mount interactive functionality
 const modal = new Vue({
     data() {
@@ -112,6 +180,7 @@ const modal = new Vue({
 
 window.modal = modal;
 const fileField = document.getElementById('id_fileset-raw_gwas_file');
+const uploadField = document.getElementById('id_fileset-upload');
 modal.$on('has_options', function (parser_options) { // Close with options selected
     document.getElementById('id_fileset-parser_options').value = JSON.stringify(parser_options);
     // Once options are received, mark form as valid
@@ -135,9 +204,10 @@ fileField.addEventListener('change', function (e) {
     const file = event.target.files[0];
     const name = file.name;
     document.getElementById('id_fileset-parser_options').value = '';
+    uploadField.value = '';
 
     if (file.size > MAX_UPLOAD_SIZE) {
-        fileField.setCustomValidity(`File exceeds the max upload size of ${MAX_UPLOAD_SIZE}`);
+        fileField.setCustomValidity(`File exceeds the max upload size of ${Math.floor(MAX_UPLOAD_SIZE / 1048576)} MiB`);
         return;
     }
 
@@ -147,3 +217,31 @@ fileField.addEventListener('change', function (e) {
     modal.file_reader = makeReader(name, file);
     modal.show_modal = true;
 });
+
+fileField.form.addEventListener('submit', function (e) {
+    // Send the file in parts before submitting the form, which then refers to the finished upload
+    const file = fileField.files[0];
+    if (!file || !file.size || uploadField.value) {
+        return;
+    }
+    e.preventDefault();
+    const form = fileField.form;
+    const button = form.querySelector('[type=submit]');
+    button.disabled = true;
+
+    createUpload(file, document.getElementById('id_fileset-parser_options').value)
+        .then(url => sendFile(url, file, fraction => {
+            button.value = `Uploading (${Math.floor(fraction * 100)}%)`;
+        }))
+        .then(url => {
+            uploadField.value = url.split('/').filter(Boolean).pop();
+            fileField.value = null;
+            form.submit();
+        })
+        .catch(err => {
+            button.disabled = false;
+            button.value = 'Submit';
+            fileField.setCustomValidity(err.message);
+            fileField.reportValidity();
+        });
+});
@@ -0,0 +1,13 @@
+"""
+Gunicorn settings for production (see `compose/production/django/start`)
+
+Workers use gevent, so that each one can hold many open (mostly idle) event streams, eg for ingest progress.
+"""
+worker_class = 'gevent'
+
+
+def post_fork(server, worker):
+    # psycopg2 waits for the database in C code, which gevent can't switch away from: without this, every database
+    #   query would block all of the other requests handled by the worker
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
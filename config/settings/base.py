@@ -254,13 +254,10 @@ CELERY_TASK_SERIALIZER = 'json'
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#std:setting-result_serializer
 CELERY_RESULT_SERIALIZER = 'json'
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#task-time-limit
-# TODO: set to whatever value is adequate in your circumstances
-# FIXME: This definitely won't be appropriate for our upload pipeline! Profile upload task to decide how much
-#  processing time is required
-CELERYD_TASK_TIME_LIMIT = 5 * 60
-# http://docs.celeryproject.org/en/latest/userguide/configuration.html#task-soft-time-limit
-# TODO: set to whatever value is adequate in your circumstances
-CELERYD_TASK_SOFT_TIME_LIMIT = 60
+# There is no global time limit: each ingest task is given limits based on the size of the upload (see `LZ_INGEST_*`)
+# http://docs.celeryproject.org/en/latest/userguide/configuration.html#worker-prefetch-multiplier
+# Ingest tasks can run for a long time; a worker should not reserve tasks that another (idle) worker could start
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
 
 #####
@@ -314,6 +311,48 @@ LZ_MAX_REGION_SIZE = 500_000
 #   your OAuth provider configuration (eg callback urls). It should be a domain, not an IP.
 LZ_OFFICIAL_DOMAIN = env('LZ_OFFICIAL_DOMAIN', default='my.locuszoom.org')
 
+# QQ plots are normally calculated exactly, which requires holding every p-value in memory. "Streaming" mode uses a
+#   fixed-resolution histogram instead: memory use is bounded, and results are very close to (but not exactly) the same.
+LZ_QQ_STREAMING = env.bool('LZ_QQ_STREAMING', default=False)
+
+# Large, uncompressed uploads can be normalized by several workers at once, by splitting the file into (at most) this
+#   many parts. The default (1) always uses a single task. Uploads that could be sorted (see `LZ_SORT_UPLOADS`) are
+#   never split.
+LZ_NORMALIZE_MAX_SHARDS = env.int('LZ_NORMALIZE_MAX_SHARDS', default=1)
+# Number of threads that each ingest task may use for BGZF compression and decompression
+LZ_INGEST_THREADS = env.int('LZ_INGEST_THREADS', default=1)
+# Uploads with rows out of order are normally rejected. If enabled, they are sorted first (see `util.ingest.sorting`),
+#   using about this much memory (in bytes), and temporary files in the scratch folder (default: the system temp folder)
+LZ_SORT_UPLOADS = env.bool('LZ_SORT_UPLOADS', default=False)
+LZ_SORT_MEMORY_BUDGET = env.int('LZ_SORT_MEMORY_BUDGET', default=256 * 2 ** 20)
+LZ_SORT_SCRATCH_DIR = env('LZ_SORT_SCRATCH_DIR', default=None)
+# The largest GWAS file (in bytes) that can be uploaded. Large files are sent in parts (see `gwas.chunked_upload`).
+LZ_MAX_UPLOAD_SIZE = env.int('LZ_MAX_UPLOAD_SIZE', default=20 * 2 ** 30)
+# Before the full pipeline runs, a sample of each upload is parsed (see `util.ingest.preflight`). Uploads are rejected
+#   if more than this fraction of the sampled rows can't be read (usually because the column options are wrong).
+LZ_PREFLIGHT_MAX_ERROR_RATE = env.float('LZ_PREFLIGHT_MAX_ERROR_RATE', default=0.1)
+# Ingest tasks for uploads larger than this (in bytes) run on a separate queue, so that small uploads are not stuck
+#   behind large ones. Workers must consume both queues (see `compose/*/django/celery/worker/start`).
+LZ_INGEST_FAST_QUEUE = env('LZ_INGEST_FAST_QUEUE', default='ingest')
+LZ_INGEST_HEAVY_QUEUE = env('LZ_INGEST_HEAVY_QUEUE', default='ingest-heavy')
+LZ_INGEST_HEAVY_THRESHOLD = env.int('LZ_INGEST_HEAVY_THRESHOLD', default=256 * 2 ** 20)
+# Time limits (in seconds) for each ingest task grow with the size of the upload, but are never less than the minimum.
+#   The hard limit is a little later than the soft one, so that an interrupted task can clean up.
+#   See `manage.py ingest_telemetry` for the time used by real uploads.
+LZ_INGEST_SECONDS_PER_GB = env.int('LZ_INGEST_SECONDS_PER_GB', default=30 * 60)
+LZ_INGEST_MIN_TIME_LIMIT = env.int('LZ_INGEST_MIN_TIME_LIMIT', default=5 * 60)
+LZ_INGEST_TIME_LIMIT_GRACE = env.int('LZ_INGEST_TIME_LIMIT_GRACE', default=60)
+# Fair share: each user may have at most this many uploads processed at once (0 for no limit). Later uploads wait,
+#   and are checked again after each interval (in seconds). Uploads that have been pending for longer than
+#   `LZ_INGEST_STALE_AFTER` seconds (eg, because a worker was lost) do not count.
+LZ_INGEST_MAX_ACTIVE_PER_USER = env.int('LZ_INGEST_MAX_ACTIVE_PER_USER', default=2)
+LZ_INGEST_WAIT_INTERVAL = env.int('LZ_INGEST_WAIT_INTERVAL', default=60)
+LZ_INGEST_STALE_AFTER = env.int('LZ_INGEST_STALE_AFTER', default=24 * 60 * 60)
+# Ingest steps report their progress (rows processed, estimated time remaining) to Redis, at most once per interval
+#   (in seconds). Progress is not tracked if no Redis server is configured.
+LZ_PROGRESS_REDIS_URL = env('REDIS_URL', default=None)
+LZ_PROGRESS_INTERVAL = env.float('LZ_PROGRESS_INTERVAL', default=2.0)
+
 # This is used to find the interactive parts of pages, which are written and built using Vue.js + Webpack
 WEBPACK_LOADER = {
     'DEFAULT': {
@@ -14,7 +14,9 @@ ALLOWED_HOSTS = env.list('DJANGO_ALLOWED_HOSTS', default=['my.locuszoom.org'])
 # ------------------------------------------------------------------------------
 DATABASES['default'] = env.db('DATABASE_URL')  # noqa F405
 DATABASES['default']['ATOMIC_REQUESTS'] = True  # noqa F405
-DATABASES['default']['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=60)  # noqa F405
+# Each request runs in its own greenlet (see `config/gunicorn.py`), so persistent connections would not be reused: they
+#   would pile up, one per greenlet, until Postgres runs out of connections.
+DATABASES['default']['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=0)  # noqa F405
 
 # CACHES
 # ------------------------------------------------------------------------------
@@ -1,9 +1,21 @@
+import base64
+import hashlib
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
 from locuszoom_plotting_service.gwas.tests.factories import (
     UserFactory, AnalysisInfoFactory, AnalysisFilesetFactory
 )
+from locuszoom_plotting_service.gwas import models as lz_models
+from locuszoom_plotting_service.taskapp import tasks
+from util.ingest import preview
 
 
 class TestListviewPermissions(APITestCase):
@@ -48,3 +60,197 @@ class TestListviewPermissions(APITestCase):
         self.assertEqual(response.status_code, 200)
         payload = response.json()
         self.assertEqual(len(payload['data']), 1)
+
+
+@override_settings(LZ_PROGRESS_REDIS_URL=None)
+class TestIngestProgress(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_owner = user1 = UserFactory()
+        cls.user_other = UserFactory()
+        cls.study_private = AnalysisInfoFactory(owner=user1, is_public=False)
+        cls.study_private.files.metadata = cls.study_private
+        cls.study_private.files.save()
+
+    def tearDown(self):
+        self.client.logout()
+        cache.clear()
+
+    def test_owner_can_see_progress(self):
+        self.client.force_login(self.user_owner)
+        response = self.client.get(reverse('apiv1:gwas-progress', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'pending', 'steps': []})
+
+    def test_other_user_cannot_see_private_progress(self):
+        self.client.force_login(self.user_other)
+        response = self.client.get(reverse('apiv1:gwas-progress', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_polling_does_not_query_study(self):
+        url = reverse('apiv1:gwas-progress', args=[self.study_private.slug])
+        self.client.force_login(self.user_owner)
+        self.client.get(url)
+
+        # Only the session and user are loaded, to check permissions. (Requests are wrapped in a transaction, so there
+        #   are also savepoints.)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+        self.assertFalse(any('"gwas_' in sql for sql in selects), 'Study tables are not queried')
+
+
+class TestPreflight(APITestCase):
+    def setUp(self):
+        # Each test has its own media folder, so the upload is created for each test
+        self.user_owner = UserFactory()
+        self.user_other = UserFactory()
+        self.study_private = AnalysisInfoFactory(owner=self.user_owner, is_public=False,
+                                                 files=AnalysisFilesetFactory(has_data=True))
+        self.study_private.files.metadata = self.study_private
+        self.study_private.files.save()
+
+    def tearDown(self):
+        self.client.logout()
+
+    def test_owner_can_check_upload(self):
+        self.client.force_login(self.user_owner)
+        response = self.client.get(reverse('apiv1:gwas-preflight', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 404, 'The checks have not run yet')
+
+        # The report is saved by the first step of the pipeline
+        tasks.run_preflight(self.study_private.files)
+        response = self.client.get(reverse('apiv1:gwas-preflight', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertTrue(payload['ok'])
+        self.assertEqual(payload['columns'], ['#chrom', 'pos', 'ref', 'alt', 'pvalue'])
+
+    def test_does_not_read_upload(self):
+        self.client.force_login(self.user_owner)
+        with mock.patch.object(tasks, 'run_preflight') as run_preflight:
+            self.client.get(reverse('apiv1:gwas-preflight', args=[self.study_private.slug]))
+        self.assertFalse(run_preflight.called, 'The checks only run in the pipeline')
+
+    def test_other_user_cannot_check_private_upload(self):
+        self.client.force_login(self.user_other)
+        response = self.client.get(reverse('apiv1:gwas-preflight', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 403)
+
+
+class TestPreview(APITestCase):
+    HEAD = b'#chrom\tpos\tref\talt\tpvalue\n' + b'1\t100\tA\tG\t0.5\n' * 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+
+    def tearDown(self):
+        self.client.logout()
+        cache.clear()
+
+    def test_suggests_options(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('apiv1:gwas-preview'), self.HEAD, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertTrue(payload['is_complete'])
+        self.assertEqual(payload['parser_options']['pval_col'], 5)
+
+    def test_results_are_cached(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(preview, 'preview_head', wraps=preview.preview_head) as preview_head:
+            for _ in range(2):
+                self.client.post(reverse('apiv1:gwas-preview'), self.HEAD, content_type='application/octet-stream')
+        self.assertEqual(preview_head.call_count, 1)
+
+    def test_bad_options(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('apiv1:gwas-preview') + '?parser_options=[1]', self.HEAD,
+                                    content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_login(self):
+        response = self.client.post(reverse('apiv1:gwas-preview'), self.HEAD, content_type='application/octet-stream')
+        self.assertIn(response.status_code, (401, 403))
+
+
+class TestChunkedUpload(APITestCase):
+    CONTENTS = b'#chrom\tpos\tref\talt\tpvalue\n' + b'1\t100\tA\tG\t0.5\n' * 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserFactory()
+        cls.user_other = UserFactory()
+
+    def tearDown(self):
+        self.client.logout()
+
+    def _create(self, parser_options: dict = None) -> str:
+        metadata = 'filename {}'.format(base64.b64encode(b'gwas.txt').decode())
+        if parser_options:
+            metadata += ',parser_options {}'.format(base64.b64encode(json.dumps(parser_options).encode()).decode())
+        response = self.client.post(reverse('apiv1:upload-create'), HTTP_UPLOAD_LENGTH=len(self.CONTENTS),
+                                    HTTP_UPLOAD_METADATA=metadata, HTTP_TUS_RESUMABLE='1.0.0')
+        self.assertEqual(response.status_code, 201)
+        return response['Location']
+
+    def _send(self, url: str, offset: int, data: bytes):
+        return self.client.patch(url, data, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=offset, HTTP_TUS_RESUMABLE='1.0.0')
+
+    def test_upload_in_parts(self):
+        self.client.force_login(self.user)
+        url = self._create()
+
+        response = self._send(url, 0, self.CONTENTS[:50])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '50')
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '50', 'Client can check how much was received')
+
+        response = self._send(url, 50, self.CONTENTS[50:])
+        self.assertEqual(response['Upload-Offset'], str(len(self.CONTENTS)))
+
+        upload = lz_models.ChunkedUpload.objects.get(owner=self.user)
+        self.assertIsNotNone(upload.completed)
+        self.assertEqual(bytes(upload.file_sha256), hashlib.sha256(self.CONTENTS).digest())
+        with open(upload.raw_gwas_path, 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENTS)
+
+    def test_wrong_offset(self):
+        self.client.force_login(self.user)
+        url = self._create()
+        self._send(url, 0, self.CONTENTS[:50])
+        response = self._send(url, 20, self.CONTENTS[20:])
+        self.assertEqual(response.status_code, 409, 'Parts must be sent in order')
+
+    def test_rejects_wrong_options_early(self):
+        self.client.force_login(self.user)
+        url = self._create({'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 3})
+        # The whole (small) file is sent at once, so the check happens right away
+        response = self._send(url, 0, self.CONTENTS)
+        self.assertEqual(response.status_code, 400)
+
+        upload = lz_models.ChunkedUpload.objects.get(owner=self.user)
+        self.assertTrue(upload.error, 'The reason for the rejection is saved')
+        self.assertEqual(upload.offset, len(self.CONTENTS))
+        response = self._send(url, upload.offset, b'')
+        self.assertEqual(response.status_code, 400, 'Later parts are rejected for the same reason')
+        self.assertEqual(response.data['detail'], upload.error)
+
+    def test_max_size(self):
+        self.client.force_login(self.user)
+        with self.settings(LZ_MAX_UPLOAD_SIZE=len(self.CONTENTS) - 1):
+            response = self.client.post(reverse('apiv1:upload-create'), HTTP_UPLOAD_LENGTH=len(self.CONTENTS),
+                                        HTTP_TUS_RESUMABLE='1.0.0')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response['Tus-Max-Size'], str(len(self.CONTENTS) - 1))
+        self.assertFalse(lz_models.ChunkedUpload.objects.exists())
+
+    def test_other_user_cannot_send(self):
+        self.client.force_login(self.user)
+        url = self._create()
+        self.client.force_login(self.user_other)
+        self.assertEqual(self._send(url, 0, self.CONTENTS).status_code, 404)
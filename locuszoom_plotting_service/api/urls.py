@@ -14,8 +14,13 @@ app_name = "api"
 urlpatterns = [
     path('gwas/', views.GwasListView.as_view(), name='gwas-list'),
     path('gwas/user-all/', views.GwasListViewUnprocessed.as_view(), name='gwas-user-all'),
+    path('gwas/preview/', views.GwasPreviewView.as_view(), name='gwas-preview'),
     path('gwas/<slug>/', views.GwasDetailView.as_view(), name='gwas-metadata'),
     path('gwas/<slug>/data/', views.GwasRegionView.as_view(), name='gwas-region'),
+    path('gwas/<slug>/progress/', views.GwasIngestProgressView.as_view(), name='gwas-progress'),
+    path('gwas/<slug>/preflight/', views.GwasPreflightView.as_view(), name='gwas-preflight'),
+    path('uploads/', views.UploadCreateView.as_view(), name='upload-create'),
+    path('uploads/<uuid:pk>/', views.UploadDetailView.as_view(), name='upload-detail'),
     # "Standardized" api schema; can be used to auto-create api clients.
     path('schema/', schema_view)
 ]
@@ -1,18 +1,32 @@
+import base64
+import binascii
+import hashlib
+import json
 import os
 import typing as ty
 
 from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
 from django_filters import rest_framework as filters
 from rest_framework import exceptions as drf_exceptions
 from rest_framework import permissions as drf_permissions
 from rest_framework import generics
 from rest_framework import renderers as drf_renderers
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from locuszoom_plotting_service.gwas import chunked_upload
 from locuszoom_plotting_service.gwas import models as lz_models
+from locuszoom_plotting_service.gwas import progress as lz_progress
 
 from zorp.readers import TabixReader
 from zorp.parsers import standard_gwas_parser
 
+from util.ingest import exceptions as ingest_exceptions
+from util.ingest import preview
+
 from . import (
     permissions,
     serializers
@@ -21,6 +35,12 @@ from . import (
 from locuszoom_plotting_service.gwas import models
 
 
+# How long (in seconds) to remember the preview for the head of a file
+PREVIEW_CACHE_TIMEOUT = 60 * 60
+# Version of the resumable upload protocol (https://tus.io/protocols/resumable-upload.html)
+TUS_VERSION = '1.0.0'
+
+
 class GwasFilter(filters.FilterSet):
     """Filters used for GWAS endpoints, including a special "only my studies" alias"""
     me = filters.BooleanFilter(method='filter_by_user',
@@ -140,3 +160,208 @@ class GwasRegionView(generics.RetrieveAPIView):
             raise drf_exceptions.ParseError(f'Cannot handle requested region size. Max allowed is {500_000}')
 
         return chrom, start, end
+
+
+class GwasIngestProgressView(APIView):
+    """
+    Live progress of data ingestion for one GWAS: the pipeline status, plus stats for each step (rows processed, bytes
+        read, rows per second, and estimated time remaining)
+
+    This is designed to be polled while a file is processed. Progress is read from Redis, and the study lookup (used
+        to check permissions) is cached, so that polling does not query the study tables.
+    """
+    schema = None  # Used by the summary page; hide from documentation
+    renderer_classes = [drf_renderers.JSONRenderer]
+
+    def perform_authentication(self, request):
+        # Only private studies need to know who the user is (see `get`), so don't look them up in advance
+        pass
+
+    def get(self, request, slug):
+        access = lz_progress.get_access(slug)
+        if access is None:
+            raise drf_exceptions.NotFound
+        if not access['is_public'] and not (request.user.is_authenticated and request.user.pk == access['owner_id']):
+            raise drf_exceptions.PermissionDenied
+        return Response(lz_progress.get_progress(access['fileset_id']))
+
+
+class GwasPreflightView(generics.RetrieveAPIView):
+    """
+    Quick checks on a sample of the uploaded file: the columns found, how many of the sampled rows could be read (and
+        why not), and whether the rows are in order. See `util.ingest.preflight`.
+
+    The checks are the first step of the ingest pipeline (see `taskapp.tasks.preflight_gwas`), and this returns the
+        report that they saved. Until they have run, the response is 404; the file is never read while the request
+        waits.
+    """
+    schema = None  # Used by the upload pages; hide from documentation
+    renderer_classes = [drf_renderers.JSONRenderer]
+    queryset = lz_models.AnalysisInfo.objects.all()
+    permission_classes = (permissions.GwasPermission,)
+    lookup_field = 'slug'
+
+    def retrieve(self, request, *args, **kwargs):
+        gwas = self.get_object()
+        fileset = gwas.analysisfileset_set.order_by('-created').first()
+        if fileset is None or not fileset.raw_gwas_file:
+            raise drf_exceptions.NotFound
+
+        if not os.path.isfile(fileset.preflight_path):
+            raise drf_exceptions.NotFound('The file has not been checked yet')
+        with open(fileset.preflight_path, 'r') as f:
+            return Response(json.load(f))
+
+
+class GwasPreviewView(APIView):
+    """
+    Suggest how to read a file before it is uploaded. Send the first few KB of the file (`preview.MAX_HEAD_BYTES` at
+        most; any more is ignored) as the request body. The response has suggested parser options, and a preview of the
+        rows as they would be read. To preview other options, send them (as JSON) in the `parser_options` parameter.
+
+    Results are cached by the content of the head (and the options), so the same file can be checked again cheaply.
+    """
+    schema = None  # Used by the upload page; hide from documentation
+    renderer_classes = [drf_renderers.JSONRenderer]
+    permission_classes = (drf_permissions.IsAuthenticated,)
+
+    def post(self, request):
+        data = request.body[:preview.MAX_HEAD_BYTES]
+        parser_options = request.query_params.get('parser_options')
+        try:
+            parser_options = json.loads(parser_options) if parser_options else None
+        except ValueError:
+            raise drf_exceptions.ParseError('"parser_options" must be a JSON object')
+        if parser_options is not None and not isinstance(parser_options, dict):
+            raise drf_exceptions.ParseError('"parser_options" must be a JSON object')
+
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(parser_options, sort_keys=True).encode('utf-8'))
+        key = 'lz:gwas-preview:{}'.format(digest.hexdigest())
+        result = cache.get(key)
+        if result is None:
+            try:
+                result = preview.preview_head(data, parser_options)
+            except ingest_exceptions.BaseIngestException as e:
+                raise drf_exceptions.ParseError(str(e))
+            cache.set(key, result, PREVIEW_CACHE_TIMEOUT)
+        return Response(result)
+
+
+class UploadConflict(drf_exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Data was sent for the wrong part of the file'
+
+
+def _get_int_header(request, name: str) -> int:
+    value = request.META.get('HTTP_' + name.upper().replace('-', '_'))
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise drf_exceptions.ParseError('The "{}" header must be an integer'.format(name))
+    if value < 0:
+        raise drf_exceptions.ParseError('The "{}" header must not be negative'.format(name))
+    return value
+
+
+def _parse_upload_metadata(header: str) -> dict:
+    """Read the `Upload-Metadata` header: comma-separated pairs of a key and a base64-encoded value"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in header.split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
+            raise drf_exceptions.ParseError('Invalid value for "{}" in the "Upload-Metadata" header'.format(key))
+    return metadata
+
+
+def _tus_response(upload: lz_models.ChunkedUpload, status_code: int) -> Response:
+    response = Response(status=status_code)
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Upload-Offset'] = upload.offset
+    response['Upload-Length'] = upload.length
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class UploadCreateView(APIView):
+    """
+    Start a resumable upload of a GWAS file, following the tus protocol. Send the size of the file in the
+        `Upload-Length` header. `Upload-Metadata` may include the `filename`, and the `parser_options` (as JSON), which
+        are used to check the start of the file as soon as it arrives. The response gives the location of the upload.
+
+    Once every part has been sent (see `UploadDetailView`), the upload can be used in the upload form.
+    """
+    schema = None  # Used by the upload page; hide from documentation
+    renderer_classes = [drf_renderers.JSONRenderer]
+    permission_classes = (drf_permissions.IsAuthenticated,)
+
+    def post(self, request):
+        length = _get_int_header(request, 'Upload-Length')
+        if length > settings.LZ_MAX_UPLOAD_SIZE:
+            response = Response({'detail': 'File exceeds the max upload size of {} bytes'.format(
+                settings.LZ_MAX_UPLOAD_SIZE)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            response['Tus-Resumable'] = TUS_VERSION
+            response['Tus-Max-Size'] = settings.LZ_MAX_UPLOAD_SIZE
+            return response
+        metadata = _parse_upload_metadata(request.META.get('HTTP_UPLOAD_METADATA', ''))
+        try:
+            parser_options = json.loads(metadata.get('parser_options') or '{}')
+        except ValueError:
+            raise drf_exceptions.ParseError('"parser_options" must be a JSON object')
+        if not isinstance(parser_options, dict):
+            raise drf_exceptions.ParseError('"parser_options" must be a JSON object')
+
+        upload = chunked_upload.create(request.user, metadata.get('filename') or 'upload.txt', length, parser_options)
+        response = _tus_response(upload, status.HTTP_201_CREATED)
+        response['Location'] = reverse('apiv1:upload-detail', args=[upload.pk])
+        return response
+
+
+class UploadDetailView(APIView):
+    """
+    One resumable upload. HEAD returns how much of the file has been received (`Upload-Offset`). PATCH sends the next
+        part of the file: the body is appended at `Upload-Offset`, which must match the amount received so far.
+        DELETE abandons the upload.
+    """
+    schema = None  # Used by the upload page; hide from documentation
+    renderer_classes = [drf_renderers.JSONRenderer]
+    permission_classes = (drf_permissions.IsAuthenticated,)
+
+    def get_upload(self, request, pk) -> lz_models.ChunkedUpload:
+        upload = lz_models.ChunkedUpload.objects.filter(pk=pk, owner=request.user).first()
+        if upload is None:
+            raise drf_exceptions.NotFound
+        return upload
+
+    def head(self, request, pk):
+        return _tus_response(self.get_upload(request, pk), status.HTTP_200_OK)
+
+    def patch(self, request, pk):
+        upload = self.get_upload(request, pk)
+        if request.content_type != 'application/offset+octet-stream':
+            raise drf_exceptions.UnsupportedMediaType(request.content_type)
+        offset = _get_int_header(request, 'Upload-Offset')
+        try:
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise drf_exceptions.ParseError('Invalid "Content-Length" header')
+
+        try:
+            # The body is read in blocks, as it arrives, instead of being held in memory
+            upload = chunked_upload.append(upload.pk, offset, request.stream, size)
+        except chunked_upload.OffsetMismatch as e:
+            raise UploadConflict(str(e))
+        except ingest_exceptions.BaseIngestException as e:
+            # Not raised: that would roll back the request's transaction, which saved the reason for the rejection
+            response = Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            response['Tus-Resumable'] = TUS_VERSION
+            return response
+        return _tus_response(upload, status.HTTP_204_NO_CONTENT)
+
+    def delete(self, request, pk):
+        chunked_upload.delete(self.get_upload(request, pk))
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response['Tus-Resumable'] = TUS_VERSION
+        return response
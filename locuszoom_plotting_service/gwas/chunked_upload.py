@@ -0,0 +1,164 @@
+"""
+Resumable uploads: a file is sent in parts, and each part is appended to the file as it arrives
+
+This follows the tus protocol (https://tus.io/protocols/resumable-upload.html): the client asks the server how much of
+    the file it has (the offset), and sends the rest from there. If a connection drops partway through a large file,
+    only the part that was not received needs to be sent again.
+
+Work that can be done as the file arrives is done then, instead of after the upload finishes:
+    - The SHA-256 of the file is updated with each part (see `_get_hasher`)
+    - Once the start of the file has arrived, it is checked with the parser options that the user chose, so that an
+        upload with the wrong options is rejected before the rest of the file is sent
+"""
+import collections
+import hashlib
+import os
+import threading
+import typing as ty
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from util.ingest import exceptions, preview
+
+from . import models
+
+# Size of each read (and write) while a part of the file is received
+BLOCK_SIZE = 2 ** 20
+# Uploads whose hash (so far) is remembered by each process
+MAX_HASHERS = 64
+
+
+class OffsetMismatch(Exception):
+    """A part of the file was sent for the wrong place in the file (eg, the client does not know what was received)"""
+
+
+# Each process remembers the hash of the uploads that it has seen recently, as {upload id: (offset, hasher)}. If a
+#   part of the file is received by a different process, that process catches up by reading only what it missed.
+_hashers: ty.MutableMapping = collections.OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def _get_hasher(upload: models.ChunkedUpload):
+    """A SHA-256 hasher that has been updated with everything received so far"""
+    with _hashers_lock:
+        offset, hasher = _hashers.pop(upload.pk, (0, None))
+    if hasher is None or offset > upload.offset:
+        offset, hasher = 0, hashlib.sha256()
+    if offset < upload.offset:
+        with open(upload.raw_gwas_path, 'rb') as f:
+            f.seek(offset)
+            remaining = upload.offset - offset
+            while remaining > 0:
+                block = f.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    raise ValueError('Uploaded file is shorter than expected')
+                hasher.update(block)
+                remaining -= len(block)
+    return hasher
+
+
+def _save_hasher(upload: models.ChunkedUpload, hasher):
+    with _hashers_lock:
+        _hashers[upload.pk] = (upload.offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def create(owner, filename: str, length: int, parser_options: dict = None) -> models.ChunkedUpload:
+    """Start a new upload; the file is created (empty) in the pipeline folder"""
+    upload = models.ChunkedUpload.objects.create(owner=owner, filename=os.path.basename(filename), length=length,
+                                                 parser_options=parser_options or {})
+    os.makedirs(os.path.dirname(upload.raw_gwas_path), exist_ok=True)
+    open(upload.raw_gwas_path, 'wb').close()
+    return upload
+
+
+def _check_head(upload: models.ChunkedUpload, previous_offset: int) -> str:
+    """
+    Once the start of the file has arrived, check that it can be read with the parser options (if any). Returns the
+        reason that the file was rejected, or an empty string.
+    """
+    head_size = preview.MAX_HEAD_BYTES
+    if not upload.parser_options or previous_offset >= head_size or \
+            (upload.offset < head_size and upload.completed is None):
+        return ''
+
+    with open(upload.raw_gwas_path, 'rb') as f:
+        head = f.read(head_size)
+    try:
+        result = preview.preview_head(head, upload.parser_options)
+    except exceptions.BaseIngestException as e:
+        return str(e)
+    num_rows, num_errors = result['rows_checked'], result['parse_errors']
+    if num_rows and num_errors / num_rows > settings.LZ_PREFLIGHT_MAX_ERROR_RATE:
+        return '{} of the first {} rows could not be read with these options (eg, row {}: {})'.format(
+            num_errors, num_rows, result['error_examples'][0]['row'], result['error_examples'][0]['reason'])
+    return ''
+
+
+def append(upload_id, offset: int, stream: ty.Optional[ty.BinaryIO], size: int) -> models.ChunkedUpload:
+    """
+    Add the next part of a file, read from `stream`, which should hold `size` bytes. If the stream ends early (eg,
+        because the connection dropped), whatever arrived is kept, and the client can resume from there.
+
+    :raises OffsetMismatch: If `offset` is not the amount of the file received so far
+    :raises exceptions.ValidationException: If the upload was (or is now) rejected
+    """
+    with transaction.atomic():
+        # Only one part of each file can be received at a time
+        upload = models.ChunkedUpload.objects.select_for_update().get(pk=upload_id)
+        if upload.error:
+            raise exceptions.ValidationException(upload.error)
+        if offset != upload.offset:
+            raise OffsetMismatch('Expected data for offset {}'.format(upload.offset))
+        if upload.offset + size > upload.length:
+            raise exceptions.ValidationException('More data was sent than the declared size of the file')
+
+        hasher = _get_hasher(upload)
+        previous_offset = upload.offset
+        with open(upload.raw_gwas_path, 'r+b') as f:
+            # Anything after the offset is from a part that was not recorded as received (eg, the server restarted)
+            f.seek(upload.offset)
+            f.truncate()
+            remaining = size
+            while remaining > 0 and stream is not None:
+                try:
+                    block = stream.read(min(BLOCK_SIZE, remaining))
+                except OSError:
+                    block = b''  # The connection was lost
+                if not block:
+                    break
+                f.write(block)
+                hasher.update(block)
+                remaining -= len(block)
+        upload.offset += size - remaining
+
+        if upload.offset == upload.length:
+            upload.completed = timezone.now()
+            upload.file_sha256 = hasher.digest()
+        else:
+            _save_hasher(upload, hasher)
+
+        upload.error = _check_head(upload, previous_offset)
+        if upload.error:
+            # Only once the rejection is saved: otherwise, the next part would be appended to a missing file
+            raw_gwas_path = upload.raw_gwas_path
+            transaction.on_commit(lambda: os.remove(raw_gwas_path))
+        upload.save()
+
+    if upload.error:
+        raise exceptions.ValidationException(upload.error)
+    return upload
+
+
+def delete(upload: models.ChunkedUpload):
+    """Stop an upload, and remove the partial file (unless a fileset has been created from it)"""
+    if upload.fileset_id is not None:
+        return
+    if os.path.isfile(upload.raw_gwas_path):
+        os.remove(upload.raw_gwas_path)
+    with _hashers_lock:
+        _hashers.pop(upload.pk, None)
+    upload.delete()
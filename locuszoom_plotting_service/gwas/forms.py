@@ -10,6 +10,27 @@ class AnalysisInfoForm(forms.ModelForm):
 
 
 class AnalysisFilesetForm(forms.ModelForm):
+    # A file that was sent in parts (see `chunked_upload`) can be used instead of uploading it with the form
+    upload = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = models.AnalysisFileset
         fields = ['parser_options', 'raw_gwas_file']
+
+    def __init__(self, *args, user=None, **kwargs):
+        super(AnalysisFilesetForm, self).__init__(*args, **kwargs)
+        self._user = user
+        self.fields['raw_gwas_file'].required = False
+
+    def clean(self):
+        cleaned_data = super(AnalysisFilesetForm, self).clean()
+        upload_id = cleaned_data.get('upload')
+        if upload_id:
+            upload = models.ChunkedUpload.objects.filter(pk=upload_id, owner=self._user, completed__isnull=False,
+                                                         fileset__isnull=True).first()
+            if upload is None:
+                raise forms.ValidationError('The uploaded file could not be found. Please upload it again.')
+            cleaned_data['upload'] = upload
+        elif not cleaned_data.get('raw_gwas_file'):
+            self.add_error('raw_gwas_file', forms.Field.default_error_messages['required'])
+        return cleaned_data
@@ -0,0 +1,76 @@
+"""
+Summarize the resources used by ingest tasks, relative to the size of the uploaded file
+
+Use this to size celery workers (memory) and to choose task time limits from real uploads.
+"""
+import collections
+import datetime
+import typing as ty
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import numpy as np
+
+from locuszoom_plotting_service.gwas import models
+
+# Group uploads by size (upper bounds, in bytes), so that costs can be compared for similar inputs
+SIZE_BUCKETS = [
+    (10 * 2 ** 20, '<10 MB'),
+    (100 * 2 ** 20, '10-100 MB'),
+    (2 ** 30, '100 MB-1 GB'),
+    (float('inf'), '>1 GB'),
+]
+
+
+def _get_size_bucket(size: ty.Optional[int]) -> str:
+    if size is None:
+        return 'unknown'
+    return next(label for limit, label in SIZE_BUCKETS if size < limit)
+
+
+def _percentiles(values: ty.List[float], scale: float = 1) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return '-'
+    p50, p95 = np.percentile(values, [50, 95]) / scale
+    return f'{p50:.1f} / {p95:.1f}'
+
+
+class Command(BaseCommand):
+    help = 'Report median (p50) and 95th percentile (p95) resource use of each ingest task, by upload size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Only include tasks run in the last N days')
+        parser.add_argument('--outcome', default='completed',
+                            help='Only include tasks with this outcome (completed, skipped, parallel, or failed)')
+
+    def handle(self, *args, **options):
+        queryset = models.StepTelemetry.objects.filter(outcome=options['outcome'])
+        if options['days'] is not None:
+            queryset = queryset.filter(created__gte=timezone.now() - datetime.timedelta(days=options['days']))
+
+        groups: ty.Dict[ty.Tuple[str, str, str], list] = collections.defaultdict(list)
+        for record in queryset.order_by('created').iterator():
+            groups[(record.step, record.task, _get_size_bucket(record.upload_bytes))].append(record)
+
+        if not groups:
+            self.stdout.write('No telemetry has been recorded')
+            return
+
+        self.stdout.write('Values are p50 / p95')
+        header = ('step', 'task', 'upload size', 'n', 'wall s', 'cpu s', 'peak RSS MB', 'wall s per GB', 'rows/s')
+        rows = [header]
+        for (step, task, bucket), records in sorted(groups.items()):
+            rows.append((
+                step, task, bucket, str(len(records)),
+                _percentiles([r.wall_seconds for r in records]),
+                _percentiles([r.cpu_seconds for r in records]),
+                _percentiles([r.peak_rss_bytes for r in records], scale=2 ** 20),
+                _percentiles([r.wall_seconds / r.upload_bytes * 2 ** 30
+                              for r in records if r.upload_bytes]),
+                _percentiles([r.rows / r.wall_seconds for r in records if r.rows and r.wall_seconds]),
+            ))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            self.stdout.write('  '.join(value.ljust(width) for value, width in zip(row, widths)))
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gwas', '0002_auto_20190723_1903'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisfileset',
+            name='file_sha256',
+            field=models.BinaryField(db_index=True, help_text='The hash of the original, raw uploaded file', max_length=32),
+        ),
+    ]
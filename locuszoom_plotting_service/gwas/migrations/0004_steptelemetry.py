@@ -0,0 +1,39 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gwas', '0003_analysisfileset_sha256_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StepTelemetry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('task', models.CharField(help_text='Name of the celery task', max_length=50)),
+                ('step', models.CharField(help_text='The pipeline step that this task is part of, eg "normalize"', max_length=20)),
+                ('outcome', models.CharField(help_text='completed, skipped, parallel, or failed', max_length=10)),
+                ('upload_bytes', models.BigIntegerField(help_text='Size of the uploaded file', null=True)),
+                ('wall_seconds', models.FloatField()),
+                ('cpu_seconds', models.FloatField()),
+                ('peak_rss_bytes', models.BigIntegerField(help_text='Peak memory use. If `peak_rss_is_step` is False, this is the peak for the worker process, which may have run other tasks', null=True)),
+                ('peak_rss_is_step', models.BooleanField(default=False)),
+                ('bytes_read', models.BigIntegerField(null=True)),
+                ('bytes_written', models.BigIntegerField(null=True)),
+                ('rows', models.BigIntegerField(default=0, help_text='Rows processed (for steps that report progress)')),
+                ('fileset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='step_telemetry', to='gwas.AnalysisFileset')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
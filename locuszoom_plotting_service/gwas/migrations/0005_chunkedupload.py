@@ -0,0 +1,42 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:00
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import locuszoom_plotting_service.gwas.models
+import model_utils.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gwas', '0004_steptelemetry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('pipeline_path', models.CharField(default=locuszoom_plotting_service.gwas.models._pipeline_folder, help_text='Folder for the uploaded file (and later, the fileset created from it)', max_length=32)),
+                ('filename', models.CharField(help_text="The name of the file on the user's computer", max_length=255)),
+                ('parser_options', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, help_text='How the user plans to read the file, if known (used to check it early)')),
+                ('length', models.BigIntegerField(help_text='Size of the complete file')),
+                ('offset', models.BigIntegerField(default=0, help_text='Bytes received so far')),
+                ('file_sha256', models.BinaryField(help_text='Hash of the complete file', max_length=32, null=True)),
+                ('completed', models.DateTimeField(help_text='When the last part of the file was received', null=True)),
+                ('error', models.TextField(blank=True, help_text='Why the upload was rejected, if it was')),
+                ('fileset', models.OneToOneField(help_text='The fileset created from this upload, once it is complete', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='gwas.AnalysisFileset')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 import logging
 import os
+import typing as ty
 import uuid
 
 from django.contrib.auth import get_user_model
@@ -123,6 +124,7 @@ class AnalysisFileset(TimeStampedModel):
                                      verbose_name='GWAS file',
                                      help_text='The GWAS data to be uploaded. May be text-based, or (b)gzip compressed')
     file_sha256 = models.BinaryField(max_length=32,
+                                     db_index=True,
                                      help_text='The hash of the original, raw uploaded file')
 
     # Options related to the ingestion pipeline
@@ -136,6 +138,19 @@ class AnalysisFileset(TimeStampedModel):
     ingest_complete = models.DateTimeField(null=True,
                                            help_text='When the file finished processing (success OR failure)')
 
+    def find_duplicate(self) -> ty.Optional['AnalysisFileset']:
+        """
+        Find a previous upload of the same file (with the same parser options) that was processed successfully, so
+            that its results can be reused
+        """
+        if not self.file_sha256:
+            return None
+        return AnalysisFileset.objects.filter(
+            file_sha256=self.file_sha256,
+            parser_options=self.parser_options,
+            ingest_status=2,
+        ).exclude(pk=self.pk).order_by('-ingest_complete').first()
+
     #######
     # Helpers defining where to find/ store each asset
     @property
@@ -157,12 +172,89 @@ class AnalysisFileset(TimeStampedModel):
     def qq_path(self):
         return os.path.join(util.get_study_folder(self, absolute_path=True), 'qq.json')
 
+    @property
+    def preflight_path(self):
+        # Results of the quick check on a sample of the upload, made before the full pipeline runs
+        return os.path.join(util.get_study_folder(self, absolute_path=True), 'preflight.json')
+
+    @property
+    def sorted_gwas_path(self):
+        # Temporary file: a sorted copy of the upload, if the rows were out of order
+        return os.path.join(util.get_study_folder(self, absolute_path=True), 'sorted.txt.gz')
+
+    def get_normalize_shard_path(self, shard_index: int):
+        # Temporary file: one part of the normalized file, before all parts are joined
+        return os.path.join(util.get_study_folder(self, absolute_path=True), f'normalized_part_{shard_index}.bgz')
+
+    def get_summary_partial_path(self, shard_index: int):
+        # Temporary file: partial summary results for one chromosome, before they are merged
+        return os.path.join(util.get_study_folder(self, absolute_path=True), f'summary_part_{shard_index}.pkl')
+
+    def get_step_manifest_path(self, step: str):
+        # Records the inputs, options, and outputs of a completed ingest step, so that re-runs can skip it
+        return os.path.join(util.get_study_folder(self, absolute_path=True), f'{step}.manifest.json')
+
     @property
     def tophits_path(self):
         # PheWeb pipeline writes a tabixed file that supports region queries # TODO: Implement
         return os.path.join(util.get_study_folder(self, absolute_path=True), 'tophits.gz')
 
 
+class ChunkedUpload(TimeStampedModel):
+    """
+    A raw GWAS file that is being uploaded in several parts, so that an interrupted upload can be resumed (see
+        `chunked_upload`). The file is written to the pipeline folder that the finished upload will use.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    pipeline_path = models.CharField(max_length=32, default=_pipeline_folder,
+                                     help_text='Folder for the uploaded file (and later, the fileset created from it)')
+    filename = models.CharField(max_length=255, help_text='The name of the file on the user\'s computer')
+    parser_options = JSONField(default=dict, blank=True,
+                               help_text='How the user plans to read the file, if known (used to check it early)')
+
+    length = models.BigIntegerField(help_text='Size of the complete file')
+    offset = models.BigIntegerField(default=0, help_text='Bytes received so far')
+    file_sha256 = models.BinaryField(max_length=32, null=True, help_text='Hash of the complete file')
+    completed = models.DateTimeField(null=True, help_text='When the last part of the file was received')
+    error = models.TextField(blank=True, help_text='Why the upload was rejected, if it was')
+
+    fileset = models.OneToOneField(AnalysisFileset, on_delete=models.SET_NULL, null=True, related_name='upload',
+                                   help_text='The fileset created from this upload, once it is complete')
+
+    @property
+    def raw_gwas_name(self) -> str:
+        """Where the file is stored, relative to the media folder (as in `AnalysisFileset.raw_gwas_file`)"""
+        return util.get_gwas_raw_fn(self, self.filename)
+
+    @property
+    def raw_gwas_path(self) -> str:
+        return os.path.join(util.get_study_folder(self, absolute_path=True), os.path.basename(self.raw_gwas_name))
+
+
+class StepTelemetry(TimeStampedModel):
+    """
+    Resources used by one run of one ingest task. Used to size workers and to choose task time limits (see the
+        `ingest_telemetry` management command).
+    """
+    fileset = models.ForeignKey(AnalysisFileset, on_delete=models.CASCADE, related_name='step_telemetry')
+
+    task = models.CharField(max_length=50, help_text='Name of the celery task')
+    step = models.CharField(max_length=20, help_text='The pipeline step that this task is part of, eg "normalize"')
+    outcome = models.CharField(max_length=10, help_text='completed, skipped, parallel, or failed')
+    upload_bytes = models.BigIntegerField(null=True, help_text='Size of the uploaded file')
+
+    wall_seconds = models.FloatField()
+    cpu_seconds = models.FloatField()
+    peak_rss_bytes = models.BigIntegerField(null=True,
+                                            help_text='Peak memory use. If `peak_rss_is_step` is False, this is the '
+                                                      'peak for the worker process, which may have run other tasks')
+    peak_rss_is_step = models.BooleanField(default=False)
+    bytes_read = models.BigIntegerField(null=True)
+    bytes_written = models.BigIntegerField(null=True)
+    rows = models.BigIntegerField(default=0, help_text='Rows processed (for steps that report progress)')
+
+
 class OntologyTerm(models.Model):
     """Available classification schemes that can be used to tag studies- eg SNOMED CT, PheCode, or ICD10"""
     code = models.CharField(unique=True,
@@ -0,0 +1,205 @@
+"""
+Live progress of the ingest pipeline for each upload
+
+Progress is stored in Redis (not the database), so that a page which is waiting for a file to be processed can check
+    it often and cheaply. Every change is also published to a Redis channel, so that pages can be told about it as it
+    happens (see `stream_events`). This is informational only: if Redis is unavailable, progress is simply not shown.
+"""
+import functools
+import json
+import logging
+import time
+import typing as ty
+
+from django.conf import settings
+from django.core.cache import cache
+import redis
+
+from util.ingest.progress import ProgressReporter
+
+from .models import AnalysisInfo
+
+logger = logging.getLogger(__name__)
+
+# Progress is only useful while a file is being processed; old entries expire on their own
+PROGRESS_TTL = 24 * 60 * 60
+
+# Pipeline states, as reported by `get_progress`
+PENDING = 'pending'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+# Event streams send a comment this often (in seconds) when nothing has happened, so that proxies keep them open...
+STREAM_HEARTBEAT = 15
+# ...and end after this long. Browsers reconnect automatically (and get the latest progress when they do).
+STREAM_MAX_DURATION = 10 * 60
+# Browsers wait this long (in seconds) before they reconnect to a stream that ended
+STREAM_RETRY = 5
+
+# How long (in seconds) to remember which upload (and owner) belong to a study, for permission checks
+ACCESS_CACHE_TIMEOUT = 60
+
+
+@functools.lru_cache()
+def _connect(url: str) -> redis.Redis:
+    return redis.Redis.from_url(url)
+
+
+def _get_client() -> ty.Optional[redis.Redis]:
+    if not settings.LZ_PROGRESS_REDIS_URL:
+        return None
+    return _connect(settings.LZ_PROGRESS_REDIS_URL)
+
+
+def _get_key(fileset_id: int) -> str:
+    return f'lz:ingest-progress:{fileset_id}'
+
+
+def _get_channel(fileset_id: int) -> str:
+    return f'lz:ingest-events:{fileset_id}'
+
+
+def _save(fileset_id: int, fields: ty.Dict[str, dict], event: dict):
+    """Save the latest progress, and tell anyone who is listening about it"""
+    client = _get_client()
+    if client is None:
+        return
+    key = _get_key(fileset_id)
+    try:
+        pipe = client.pipeline()
+        if fields:
+            pipe.hmset(key, {name: json.dumps(value) for name, value in fields.items()})
+            pipe.expire(key, PROGRESS_TTL)
+        pipe.publish(_get_channel(fileset_id), json.dumps(event))
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning('Could not save ingest progress for fileset %s', fileset_id, exc_info=True)
+
+
+def publish_step(fileset_id: int, step: str, stats: dict):
+    """Save the latest stats for one step (or one part of a step, if it runs as several tasks)"""
+    stats = {**stats, 'updated': time.time()}
+    _save(fileset_id, {f'step:{step}': stats}, {'type': 'progress', 'step': step, **stats})
+
+
+def publish_transition(fileset_id: int, step: str, label: str, state: str):
+    """Announce that a step has started, completed, been skipped, or failed"""
+    _save(fileset_id, {}, {'type': 'step', 'step': step, 'label': label, 'state': state})
+
+
+def set_status(fileset_id: int, status: str):
+    _save(fileset_id, {'status': {'status': status, 'updated': time.time()}}, {'type': 'status', 'status': status})
+
+
+def make_reporter(fileset_id: int, step: str, shard_index: int = None) -> ProgressReporter:
+    """Create a reporter for one ingest step, which publishes its stats for this upload"""
+    name = step if shard_index is None else f'{step}:{shard_index}'
+    return ProgressReporter(functools.partial(publish_step, fileset_id, name),
+                            min_interval=settings.LZ_PROGRESS_INTERVAL)
+
+
+def get_progress(fileset_id: int) -> dict:
+    """
+    The pipeline status, and the latest stats for each step that has reported progress
+
+    Steps are listed in the order that they started.
+    """
+    client = _get_client()
+    fields: ty.Dict[bytes, bytes] = {}
+    if client is not None:
+        try:
+            fields = client.hgetall(_get_key(fileset_id))
+        except redis.RedisError:
+            logger.warning('Could not read ingest progress for fileset %s', fileset_id, exc_info=True)
+
+    status = {'status': PENDING}
+    steps = {}
+    for name, value in fields.items():
+        name = name.decode('utf-8')
+        if name == 'status':
+            status = json.loads(value)
+        elif name.startswith('step:'):
+            steps[name[len('step:'):]] = json.loads(value)
+
+    return {
+        'status': status['status'],
+        'steps': [{'step': name, **stats} for name, stats in sorted(steps.items(), key=_get_start_time)]
+    }
+
+
+def _get_start_time(item: ty.Tuple[str, dict]) -> float:
+    _, stats = item
+    return stats['updated'] - stats['elapsed_seconds']
+
+
+def clear(fileset_id: int):
+    """Forget any progress from a previous run (eg, before the pipeline is re-run)"""
+    client = _get_client()
+    if client is None:
+        return
+    try:
+        client.delete(_get_key(fileset_id))
+    except redis.RedisError:
+        logger.warning('Could not clear ingest progress for fileset %s', fileset_id, exc_info=True)
+
+
+def get_access(slug: str) -> ty.Optional[dict]:
+    """
+    Find the most recent upload for a study, and who can see it. This is cached, so that pages which check progress
+        often do not need to query the study tables each time.
+    """
+    key = f'lz:gwas-progress-access:{slug}'
+    access = cache.get(key)
+    if access is not None:
+        return access
+
+    gwas = AnalysisInfo.objects.filter(slug=slug).first()
+    fileset = gwas.analysisfileset_set.order_by('-created').first() if gwas else None
+    if fileset is None:
+        return None
+    access = {'fileset_id': fileset.pk, 'owner_id': gwas.owner_id, 'is_public': gwas.is_public}
+    cache.set(key, access, ACCESS_CACHE_TIMEOUT)
+    return access
+
+
+def _format_event(event: dict) -> str:
+    # https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+    return 'event: {}\ndata: {}\n\n'.format(event['type'], json.dumps(event))
+
+
+def stream_events(fileset_id: int) -> ty.Iterator[str]:
+    """
+    Server-sent events for one upload: the current progress, followed by every change until the pipeline finishes
+        (or `STREAM_MAX_DURATION` has passed)
+
+    If there is nothing to wait for (the pipeline has finished, or progress is not tracked), the stream ends with an
+        "end" event, which tells the browser not to reconnect.
+    """
+    client = _get_client()
+    pubsub = client.pubsub(ignore_subscribe_messages=True) if client is not None else None
+    try:
+        yield 'retry: {}\n\n'.format(STREAM_RETRY * 1000)
+        # Subscribe before reading the current progress, so that no changes are missed in between
+        if pubsub is not None:
+            pubsub.subscribe(_get_channel(fileset_id))
+        current = get_progress(fileset_id)
+        yield _format_event({'type': 'snapshot', **current})
+        if pubsub is None or current['status'] != PENDING:
+            yield _format_event({'type': 'end', 'status': current['status'], 'is_live': pubsub is not None})
+            return
+
+        deadline = time.monotonic() + STREAM_MAX_DURATION
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=STREAM_HEARTBEAT)
+            if message is None:
+                yield ': keep-alive\n\n'
+                continue
+            event = json.loads(message['data'])
+            yield _format_event(event)
+            if event['type'] == 'status' and event['status'] != PENDING:
+                return
+    except redis.RedisError:
+        logger.warning('Ingest event stream for fileset %s was interrupted', fileset_id, exc_info=True)
+    finally:
+        if pubsub is not None:
+            pubsub.close()
@@ -0,0 +1,27 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from .factories import AnalysisFilesetFactory
+from ..models import StepTelemetry
+
+
+class TestIngestTelemetry(TestCase):
+    def test_reports_percentiles_by_upload_size(self):
+        fileset = AnalysisFilesetFactory()
+        for wall_seconds in (1, 2, 3, 4):
+            StepTelemetry.objects.create(fileset=fileset, task='normalize_gwas', step='normalize', outcome='completed',
+                                         upload_bytes=2 ** 20, wall_seconds=wall_seconds, cpu_seconds=1, rows=1000)
+
+        out = StringIO()
+        call_command('ingest_telemetry', stdout=out)
+        report = out.getvalue().splitlines()
+        row = next(line for line in report if line.startswith('normalize'))
+        self.assertIn('<10 MB', row)
+        self.assertIn('2.5 / 3.8', row, 'Reports the median and 95th percentile wall time')
+
+    def test_no_telemetry(self):
+        out = StringIO()
+        call_command('ingest_telemetry', stdout=out)
+        self.assertIn('No telemetry', out.getvalue())
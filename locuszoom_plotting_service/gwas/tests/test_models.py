@@ -0,0 +1,25 @@
+from django.test import TestCase
+
+from .factories import AnalysisFilesetFactory
+
+
+class TestFindDuplicate(TestCase):
+    def test_finds_completed_upload_of_same_file(self):
+        original = AnalysisFilesetFactory(has_completed=True, file_sha256=b'a' * 32)
+        upload = AnalysisFilesetFactory(file_sha256=b'a' * 32)
+        self.assertEqual(upload.find_duplicate(), original)
+
+    def test_requires_same_parser_options(self):
+        original = AnalysisFilesetFactory(has_completed=True, file_sha256=b'a' * 32)
+        upload = AnalysisFilesetFactory(file_sha256=b'a' * 32,
+                                        parser_options={**original.parser_options, 'is_log_pval': True})
+        self.assertIsNone(upload.find_duplicate())
+
+    def test_ignores_failed_or_different_uploads(self):
+        AnalysisFilesetFactory(ingest_status=1, file_sha256=b'a' * 32)
+        AnalysisFilesetFactory(has_completed=True, file_sha256=b'b' * 32)
+        upload = AnalysisFilesetFactory(file_sha256=b'a' * 32)
+        self.assertIsNone(upload.find_duplicate())
+
+        unhashed = AnalysisFilesetFactory(file_sha256=b'')
+        self.assertIsNone(unhashed.find_duplicate(), 'Files with no known hash are never matched')
@@ -1,10 +1,18 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
 
 from .factories import (
     UserFactory, AnalysisInfoFactory
 )
+from .. import chunked_upload
+from ..models import AnalysisFileset
 
 
 class TestOverviewPermissions(TestCase):
@@ -48,3 +56,121 @@ class TestOverviewPermissions(TestCase):
         self.client.force_login(self.user_other)
         response = self.client.get(reverse('gwas:overview', args=[self.study_private.slug]))
         self.assertEqual(response.status_code, 403, 'Only owner can see a private study')
+
+
+@override_settings(LZ_PROGRESS_REDIS_URL=None)
+class TestIngestEvents(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_owner = UserFactory()
+        cls.user_other = UserFactory()
+        cls.study_private = AnalysisInfoFactory(owner=cls.user_owner, is_public=False)
+        cls.study_private.files.metadata = cls.study_private
+        cls.study_private.files.save()
+
+    def tearDown(self):
+        self.client.logout()
+        cache.clear()
+
+    def test_owner_receives_current_progress(self):
+        self.client.force_login(self.user_owner)
+        response = self.client.get(reverse('gwas:ingest-events', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('retry: '), 'Browsers are told how long to wait before reconnecting')
+        events = [event.split('\n')[0] for event in content.split('\n\n') if event.startswith('event: ')]
+        self.assertEqual(events, ['event: snapshot', 'event: end'],
+                         'The stream begins with the current progress, and ends if progress is not tracked')
+
+    def test_private_study_requires_auth(self):
+        response = self.client.get(reverse('gwas:ingest-events', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.user_other)
+        response = self.client.get(reverse('gwas:ingest-events', args=[self.study_private.slug]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(LZ_PROGRESS_REDIS_URL=None)
+class TestRerun(TestCase):
+    def setUp(self):
+        self.user_owner = UserFactory()
+        self.study = AnalysisInfoFactory(owner=self.user_owner, files__has_completed=True)
+        self.study.files.metadata = self.study
+        self.study.files.save()
+
+    def test_owner_can_rerun(self):
+        self.client.force_login(self.user_owner)
+        response = self.client.get(reverse('gwas:rerun', args=[self.study.slug]))
+        self.assertEqual(response.status_code, 302)
+        self.study.files.refresh_from_db()
+        self.assertEqual(self.study.files.ingest_status, 0)
+
+    def test_other_user_cannot_rerun(self):
+        self.client.force_login(UserFactory())
+        response = self.client.get(reverse('gwas:rerun', args=[self.study.slug]))
+        self.assertEqual(response.status_code, 403)
+        self.study.files.refresh_from_db()
+        self.assertEqual(self.study.files.ingest_status, 2, 'The upload is not changed')
+
+
+class TestUpload(TestCase):
+    def test_upload_calculates_hash(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        contents = b'#chrom\tpos\tref\talt\tpvalue\n1\t1\tA\tC\t0.5\n'
+
+        response = self.client.post(reverse('gwas:upload'), {
+            'metadata-label': 'My study',
+            'metadata-build': 'GRCh37',
+            'fileset-parser_options': json.dumps({
+                'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False
+            }),
+            'fileset-raw_gwas_file': SimpleUploadedFile('gwas.txt', contents),
+        })
+        self.assertEqual(response.status_code, 302, 'Upload succeeded')
+
+        fileset = AnalysisFileset.objects.get(metadata__owner=user)
+        self.assertEqual(bytes(fileset.file_sha256), hashlib.sha256(contents).digest(),
+                         'Hash was calculated during the upload')
+
+    def test_upload_sent_in_parts(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        contents = b'#chrom\tpos\tref\talt\tpvalue\n1\t1\tA\tC\t0.5\n'
+        upload = chunked_upload.create(user, 'gwas.txt', len(contents))
+        chunked_upload.append(upload.pk, 0, io.BytesIO(contents[:10]), 10)
+        chunked_upload.append(upload.pk, 10, io.BytesIO(contents[10:]), len(contents) - 10)
+
+        response = self.client.post(reverse('gwas:upload'), {
+            'metadata-label': 'My study',
+            'metadata-build': 'GRCh37',
+            'fileset-parser_options': json.dumps({
+                'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False
+            }),
+            'fileset-upload': str(upload.pk),
+        })
+        self.assertEqual(response.status_code, 302, 'Upload succeeded')
+
+        fileset = AnalysisFileset.objects.get(metadata__owner=user)
+        self.assertEqual(fileset.pipeline_path, upload.pipeline_path, 'File is already in the pipeline folder')
+        self.assertEqual(bytes(fileset.file_sha256), hashlib.sha256(contents).digest(),
+                         'Hash was calculated as the parts arrived')
+        with fileset.raw_gwas_file.open('rb') as f:
+            self.assertEqual(f.read(), contents)
+
+    def test_upload_must_be_complete(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        upload = chunked_upload.create(user, 'gwas.txt', 100)
+
+        response = self.client.post(reverse('gwas:upload'), {
+            'metadata-label': 'My study',
+            'metadata-build': 'GRCh37',
+            'fileset-parser_options': json.dumps({'chr_col': 1}),
+            'fileset-upload': str(upload.pk),
+        })
+        self.assertEqual(response.status_code, 200, 'Form is shown again, with an error')
+        self.assertFalse(AnalysisFileset.objects.filter(metadata__owner=user).exists())
@@ -0,0 +1,32 @@
+"""
+Custom file upload handlers, used to do work while an upload is received (instead of re-reading the file afterwards)
+"""
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class Sha256UploadHandler(FileUploadHandler):
+    """
+    Calculate the SHA256 hash of each uploaded file as the data arrives.
+
+    This handler does not store anything: it passes every chunk along to the next handler in the chain, and so it must
+        be inserted first. Digests are available (by form field name) once the request body has been read.
+    """
+    def __init__(self, *args, **kwargs):
+        super(Sha256UploadHandler, self).__init__(*args, **kwargs)
+        self._shasum_256 = None
+        self.digests: dict = {}
+
+    def new_file(self, *args, **kwargs):
+        super(Sha256UploadHandler, self).new_file(*args, **kwargs)
+        self._shasum_256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._shasum_256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._shasum_256.digest()
+        # Let the next handler in the chain create the actual file object
+        return None
@@ -23,4 +23,5 @@ urlpatterns = [
     path('<slug>/data/ingest_log/', views.GwasIngestLog.as_view(), name='gwas-ingest-log'),
     path('<slug>/data/manhattan/', views.GwasManhattanJson.as_view(), name='manhattan-json'),
     path('<slug>/data/qq/', views.GwasQQJson.as_view(), name='qq-json'),
+    path('<slug>/events/', views.GwasIngestEvents.as_view(), name='ingest-events'),
 ]
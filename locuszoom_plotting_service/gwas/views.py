@@ -4,10 +4,14 @@ import json
 import os
 import typing as ty
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import transaction
+from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.generic import (
     CreateView,
     DetailView,
@@ -17,13 +21,15 @@ from django.views.generic.base import View
 from django.views.generic.detail import SingleObjectMixin
 
 from django.shortcuts import redirect
-from django.http import FileResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse
 
 from locuszoom_plotting_service.taskapp import tasks
 
 from . import forms as lz_forms
 from . import models as lz_models
 from . import permissions as lz_permissions
+from . import progress as lz_progress
+from . import upload_handlers
 
 
 class BaseFileView(View, SingleObjectMixin):
@@ -55,24 +61,35 @@ def rerun_analysis(request, slug):
     """
     FIXME: TEMPORARY debugging view
     Replace this later with something smarter, eg "rerun, and possibly replace the options in some of the fields"
+
+    Steps whose outputs are up to date (same input, options, and code version) are skipped, so a re-run resumes at
+        the first step that is stale or failed.
     """
     metadata = lz_models.AnalysisInfo.objects.get(slug=slug)
+    if request.user != metadata.owner:
+        raise PermissionDenied
+
     files = metadata.analysisfileset_set.order_by('-created').first()
     files.ingest_status = 0
     files.save()
-
-    if request.user != metadata.owner:
-        raise HttpResponseBadRequest
-    transaction.on_commit(lambda: tasks.total_pipeline(files.pk).apply_async())
+    lz_progress.clear(files.pk)
+    transaction.on_commit(lambda: tasks.queue_pipeline(files.pk))
 
     return redirect(metadata)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 class GwasCreate(LoginRequiredMixin, CreateView):
     """
     Upload a GWAS file.
 
     Note there is a bit of trickery here to accommodate creating two models (file + metadata) instead of one.
+
+    The file is hashed as it is received, which requires adding an upload handler before the request body is read.
+        CSRF checks read the request body, so they are deferred until after the handler is in place (see `post`).
+
+    Large files can instead be sent in parts beforehand (see `chunked_upload`), so that an interrupted upload can be
+        resumed; the form then refers to that upload, instead of including the file.
     """
     model = lz_models.AnalysisInfo
     fields = ['label', 'pmid', 'is_public', 'build']
@@ -88,9 +105,14 @@ class GwasCreate(LoginRequiredMixin, CreateView):
         base_kwargs = self.get_form_kwargs()
         return {
             'metadata': self.get_form_class()(prefix='metadata', **base_kwargs),
-            'fileset': lz_forms.AnalysisFilesetForm(prefix='fileset', **base_kwargs)
+            'fileset': lz_forms.AnalysisFilesetForm(prefix='fileset', user=self.request.user, **base_kwargs)
         }
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['js_vars'] = json.dumps({'max_upload_size': settings.LZ_MAX_UPLOAD_SIZE})
+        return context
+
     def form_valid(self, form):
         """Followup action to take after verifying the form is valid"""
         metadata = form['metadata']
@@ -100,12 +122,29 @@ class GwasCreate(LoginRequiredMixin, CreateView):
         self.object = metadata.save()  # used by get_success_url
 
         fileset.instance.metadata = metadata.instance
+        upload = fileset.cleaned_data.get('upload')
+        if upload:
+            # The file was sent in parts, and is already in place (and hashed)
+            fileset.instance.pipeline_path = upload.pipeline_path
+            fileset.instance.raw_gwas_file = upload.raw_gwas_name
+            fileset.instance.file_sha256 = upload.file_sha256
+        else:
+            fileset.instance.file_sha256 = self._sha256_handler.digests.get(fileset.add_prefix('raw_gwas_file'), b'')
         fileset.save()
+        if upload:
+            upload.fileset = fileset.instance
+            upload.save()
 
         # Deliberately skip the super call, which assumes the view has only one form
         return HttpResponseRedirect(self.get_success_url())
 
     def post(self, request, *args, **kwargs):
+        self._sha256_handler = upload_handlers.Sha256UploadHandler(request)
+        request.upload_handlers.insert(0, self._sha256_handler)
+        return self._post(request, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def _post(self, request, *args, **kwargs):
         """Override parent create view, which relies on a single form.is_valid"""
         self.object = None
 
@@ -148,6 +187,35 @@ class GwasQQJson(lz_permissions.GwasViewPermission, BaseFileView):
     content_type = 'application/json'
 
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class GwasIngestEvents(View):
+    """
+    Push ingest progress for a study to the browser, as server-sent events: step transitions, stats, and the final
+        success or failure.
+
+    Each stream waits on a Redis channel, rather than polling the database, so that many users can watch their uploads
+        at once. The permission check uses the same (cached) lookup as the progress API. The request is not wrapped in
+        a transaction, so that the database connection can be closed while the stream is open.
+    """
+    def get(self, request, slug):
+        access = lz_progress.get_access(slug)
+        if access is None:
+            raise Http404
+        if not access['is_public'] and request.user.pk != access['owner_id']:
+            raise PermissionDenied
+
+        # The stream may stay open for several minutes: don't hold on to a database connection while it does. (A
+        #   connection that is in a transaction, eg in tests, can't be closed without ending that transaction.)
+        if not connection.in_atomic_block:
+            connection.close()
+
+        response = StreamingHttpResponse(lz_progress.stream_events(access['fileset_id']),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Ask proxies (eg nginx) to send each event right away
+        return response
+
+
 #######
 # HTML views
 class GwasSummary(lz_permissions.GwasViewPermission, DetailView):
@@ -166,6 +234,8 @@ class GwasSummary(lz_permissions.GwasViewPermission, DetailView):
             'ingest_status': gwas.ingest_status,
             'manhattan_url': reverse('gwas:manhattan-json', kwargs={'slug': gwas.slug}) if gwas.files else None,
             'qq_url': reverse('gwas:qq-json', kwargs={'slug': gwas.slug}) if gwas.files else None,
+            'progress_url': reverse('apiv1:gwas-progress', kwargs={'slug': gwas.slug}),
+            'events_url': reverse('gwas:ingest-events', kwargs={'slug': gwas.slug}),
         })
         return context
 
@@ -1,8 +1,13 @@
+import datetime
 import functools
+import json
 import os
+import shutil
+import typing as ty
 
+from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
-from celery import shared_task
+from celery import chord, group, shared_task
 from django.conf import settings
 from django.core.mail import mail_admins, send_mail
 from django.db.models import signals
@@ -10,33 +15,91 @@ from django.db import transaction
 from django.dispatch import receiver
 from django.utils import timezone
 
-from locuszoom_plotting_service.gwas import models
+from locuszoom_plotting_service.gwas import models, progress
 from util.ingest import (
     exceptions,
+    manifest,
+    preflight,
     processors,
+    scheduling,
+    sorting,
+    telemetry,
     validators
 )
 
 
 logger = get_task_logger(__name__)
 
+# A step can return one of these messages to explain why it did not need to run
+STEP_SKIPPED = 'Outputs are up to date; step skipped'  # See `util.ingest.manifest`
+STEP_REUSED = 'Reused the results of an identical upload; step skipped'
 
-def lz_file_prep(step_name):
+
+def _get_upload_bytes(instance: models.AnalysisFileset) -> ty.Optional[int]:
+    raw_path = os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name)
+    return os.path.getsize(raw_path) if os.path.isfile(raw_path) else None
+
+
+def _get_task_options(upload_bytes: ty.Optional[int]) -> dict:
+    """The queue and time limits for an ingest task that reads this much data (see `util.ingest.scheduling`)"""
+    return scheduling.get_task_options(
+        upload_bytes,
+        heavy_threshold=settings.LZ_INGEST_HEAVY_THRESHOLD,
+        fast_queue=settings.LZ_INGEST_FAST_QUEUE,
+        heavy_queue=settings.LZ_INGEST_HEAVY_QUEUE,
+        seconds_per_gb=settings.LZ_INGEST_SECONDS_PER_GB,
+        minimum=settings.LZ_INGEST_MIN_TIME_LIMIT,
+        grace=settings.LZ_INGEST_TIME_LIMIT_GRACE,
+    )
+
+
+def _save_telemetry(instance: models.AnalysisFileset, task: str, step: str, outcome: str, usage: dict):
+    """Store (and log) the resources used by a task. This is for monitoring only, so problems are logged, not raised."""
+    try:
+        upload_bytes = _get_upload_bytes(instance)
+        logger.info('[telemetry] %s', json.dumps({'fileset': instance.pk, 'task': task, 'step': step,
+                                                  'outcome': outcome, 'upload_bytes': upload_bytes, **usage}))
+        models.StepTelemetry.objects.create(fileset=instance, task=task, step=step, outcome=outcome,
+                                            upload_bytes=upload_bytes, **usage)
+    except Exception:
+        logger.exception('Could not save telemetry for fileset %s', instance.pk)
+
+
+def lz_file_prep(step_name, step: str):
     """Prepare a task that operates on files, and logs success/ failure.
     The tasks we define here ACTUALLY receive IDs, which are magically converted into a DB instance before being run
+
+    Each change in the state of the task is also announced (as part of `step`) to anyone watching the upload's progress,
+        and the resources used by the task are recorded (see `models.StepTelemetry`)
     """
     def decorator(func):
         @functools.wraps(func)
-        def inner(self, fileset_id: int):
+        def inner(self, fileset_id: int, *args, **kwargs):
             instance = models.AnalysisFileset.objects.get(pk=fileset_id)
             log_path = instance.normalized_gwas_log_path
             message = '[ingest][{}] Performing upload step: {}\n'.format(
                 timezone.now().replace(microsecond=0).isoformat(),
                 step_name
             )
+            progress.publish_transition(fileset_id, step, step_name, 'started')
+            state = 'failed'
+            usage = telemetry.StepTelemetry()
             try:
-                func(self, instance)
-                message += '[success][{}] Step completed\n'.format(timezone.now().replace(microsecond=0).isoformat())
+                with usage:
+                    result = func(self, instance, *args, **kwargs)
+                if result in (STEP_SKIPPED, STEP_REUSED):
+                    state = 'skipped'
+                    message += '[success][{}] {}\n'.format(timezone.now().replace(microsecond=0).isoformat(), result)
+                else:
+                    state = 'completed'
+                    message += '[success][{}] Step completed\n'.format(
+                        timezone.now().replace(microsecond=0).isoformat())
+            except Ignore:
+                # The step was replaced by other tasks (which log their own progress)
+                state = 'parallel'
+                message += '[success][{}] Step continues in parallel tasks\n'.format(
+                    timezone.now().replace(microsecond=0).isoformat())
+                raise
             except Exception as e:
                 message += '[failure][{}] An error prevented this step from completing\n'.format(
                     timezone.now().replace(microsecond=0).isoformat())
@@ -45,49 +108,244 @@ def lz_file_prep(step_name):
             finally:
                 with open(log_path, 'a+') as f:
                     f.write(message)
+                progress.publish_transition(fileset_id, step, step_name, state)
+                _save_telemetry(instance, func.__name__, step, state, usage.get_result())
         return inner
     return decorator
 
 
+def run_preflight(instance: models.AnalysisFileset) -> dict:
+    """Check a sample of the upload (see `util.ingest.preflight`), and save the report"""
+    src_path = os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name)
+    parser_options = instance.parser_options
+    report = preflight.check_sample(
+        src_path, parser_options,
+        max_error_rate=settings.LZ_PREFLIGHT_MAX_ERROR_RATE,
+        # Rows that are out of order will be sorted, if possible
+        allow_unsorted=settings.LZ_SORT_UPLOADS and sorting.can_sort(parser_options)
+    )
+    with open(instance.preflight_path, 'w') as f:
+        json.dump(report, f)
+    return report
+
+
+@shared_task(bind=True)
+@lz_file_prep("Check a sample of the GWAS file", step='preflight')
+def preflight_gwas(self, instance: models.AnalysisFileset):
+    """
+    Reject an upload that clearly can't be processed (eg, because the column options are wrong) before the full
+        pipeline starts. This only reads a sample of the file, and takes about a second.
+    """
+    report = run_preflight(instance)
+    if not report['ok']:
+        raise exceptions.ValidationException('Problems were found in a sample of the file: {}'.format(
+            '; '.join(report['problems'])))
+
+
 @shared_task(bind=True)
-@lz_file_prep("Calculate SHA256")
+@lz_file_prep("Calculate SHA256", step='hash')
 def hash_contents(self, instance: models.AnalysisFileset):
     """Store a unique hash of the file contents"""
     # instance = models.AnalysisFileset.objects.get(pk=fileset_id)
+    if instance.file_sha256:
+        # Usually calculated while the file is uploaded (see `gwas.upload_handlers`), so there is no need to re-read it
+        return
 
-    sha256 = processors.get_file_sha256(os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name))
+    sha256 = processors.get_file_sha256(os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name),
+                                        reporter=progress.make_reporter(instance.pk, 'hash'))
     instance.file_sha256 = sha256
-    instance.save()
+    # The rest of the pipeline does not wait for this step, so don't overwrite any other fields that it has changed
+    instance.save(update_fields=['file_sha256'])
+    # If normalization (which runs at the same time) finished first, it could not record which file it read
+    manifest.set_input(instance.get_step_manifest_path('normalize'), sha256.hex())
+
+
+def _get_raw_digest(instance: models.AnalysisFileset) -> ty.Optional[str]:
+    """
+    The SHA256 of the uploaded file, as a hex string. This is usually known from the upload, or else it is calculated
+        by `hash_contents` (which runs at the same time as normalization), so the file is never read twice to find it.
+    """
+    instance.refresh_from_db(fields=['file_sha256'])
+    if instance.file_sha256:
+        return bytes(instance.file_sha256).hex()
+    return None
+
+
+def _record_normalize(instance: models.AnalysisFileset):
+    # If the digest is not known yet, `hash_contents` adds it to the manifest once it is
+    manifest.write(instance.get_step_manifest_path('normalize'), 'normalize',
+                   _get_raw_digest(instance),
+                   instance.parser_options,
+                   [instance.normalized_gwas_path, instance.normalized_gwas_path + '.tbi'])
+
+
+def _reuse_duplicate(instance: models.AnalysisFileset) -> bool:
+    """
+    If the same file was already processed with the same options, share its results (as hardlinks) instead of
+        processing it again. The manifests are copied too, so that later steps see that their outputs are up to date.
+    """
+    if _get_raw_digest(instance) is None:
+        return False
+    source = instance.find_duplicate()
+    if source is None:
+        return False
+
+    outputs = [
+        (source.normalized_gwas_path, instance.normalized_gwas_path),
+        (source.normalized_gwas_path + '.tbi', instance.normalized_gwas_path + '.tbi'),
+        (source.manhattan_path, instance.manhattan_path),
+        (source.qq_path, instance.qq_path),
+    ]
+    if not all(os.path.isfile(src) for src, _ in outputs):
+        return False
+
+    for src, dest in outputs:
+        processors.link_or_copy(src, dest)
+    if os.path.isfile(source.normalized_gwas_log_path):
+        # Keep the record of any lines that were skipped
+        with open(source.normalized_gwas_log_path, 'r') as src, open(instance.normalized_gwas_log_path, 'a') as dest:
+            shutil.copyfileobj(src, dest)
+
+    for step, record in (('normalize', _record_normalize), ('summarize', _record_summaries)):
+        if not os.path.isfile(source.get_step_manifest_path(step)):
+            # Older uploads need a manifest too, so that a re-run of either upload replaces (not edits) shared files
+            record(source)
+        shutil.copyfile(source.get_step_manifest_path(step), instance.get_step_manifest_path(step))
+
+    source_view = source.metadata.top_hit_view if source.metadata else None
+    if source_view and instance.metadata:
+        instance.metadata.top_hit_view = models.RegionView.objects.create(
+            gwas=instance.metadata,
+            label=source_view.label,
+            chrom=source_view.chrom,
+            start=source_view.start,
+            end=source_view.end
+        )
+        instance.metadata.save()
+    return True
+
+
+def _get_summarize_task(instance: models.AnalysisFileset):
+    """The step after normalization. It is started by whichever task finishes writing the normalized file."""
+    return summarize_gwas.si(instance.pk).set(**_get_task_options(_get_upload_bytes(instance))).on_error(
+        mark_failure.si(instance.pk).set(**_get_task_options(None)))
 
 
 @shared_task(bind=True)
-@lz_file_prep("Normalize GWAS file format")
+@lz_file_prep("Normalize GWAS file format", step='normalize')
 def normalize_gwas(self, instance: models.AnalysisFileset):
+    """
+    Write the upload in a standard format (see `processors.normalize_contents`), and then start `summarize_gwas`
+
+    Large files may be normalized by a chord of tasks, one for each part of the file. The summaries are then started
+        by the task that merges the parts (see `total_pipeline`).
+    """
     src_path = os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name)
     dest_path = instance.normalized_gwas_path
     parser_options = instance.parser_options
 
     log_path = instance.normalized_gwas_log_path
 
-    if not validators.standard_gwas_validator.validate(src_path, instance.parser_options):
-        logger.info(f"Could not load GWAS '{src_path}' because contents failed to validate")
-        raise exceptions.ValidationException(f'Validation failed for study ID {fileset_id}')
+    # When re-run with the same file and options, there is no need to normalize the data again
+    summarize = _get_summarize_task(instance)
+    manifest_path = instance.get_step_manifest_path('normalize')
+    if manifest.is_current(manifest_path, 'normalize', _get_raw_digest(instance), parser_options):
+        summarize.apply_async()
+        return STEP_SKIPPED
+    manifest.clear(manifest_path)
+
+    if _reuse_duplicate(instance):
+        summarize.apply_async()
+        return STEP_REUSED
+
+    if not validators.standard_gwas_validator.validate_file_type(src_path):
+        logger.info(f"Could not load GWAS '{src_path}' because it is not a supported file type")
+        raise exceptions.ValidationException(f'Validation failed for study ID {instance.pk}')
 
     # For now the writer expects a temp file name, and it creates the .gz version internally
     tmp_normalized_path = dest_path.replace('.txt.gz', '.txt')
-    processors.normalize_contents(src_path, parser_options, tmp_normalized_path, log_path)
+
+    # Files that are already normalized (eg, from a previous download) only need to be indexed
+    if processors.adopt_normalized(src_path, parser_options, tmp_normalized_path, log_path,
+                                   threads=settings.LZ_INGEST_THREADS,
+                                   reporter=progress.make_reporter(instance.pk, 'normalize')):
+        _record_normalize(instance)
+        summarize.apply_async()
+        return
+
+    # Optionally, rows that are out of order can be sorted (instead of rejected). The order is checked while the file is
+    #   normalized, and the file is only sorted if that fails. This needs one task that reads the whole file, so a file
+    #   that could be sorted is not split into parts.
+    sort_if_needed = settings.LZ_SORT_UPLOADS and sorting.can_sort(parser_options)
+
+    shards = [] if sort_if_needed else processors.get_normalize_shards(src_path, settings.LZ_NORMALIZE_MAX_SHARDS)
+    if shards:
+        # The merge step is the last part of the chord, so it also reports failures from any shard, and is followed by
+        #   `summarize_gwas`. Each shard is routed (and limited) based on the size of its own part of the file.
+        merge = merge_normalized_shards.si(instance.pk, len(shards)).set(
+            **_get_task_options(_get_upload_bytes(instance))
+        ).on_error(mark_failure.si(instance.pk).set(**_get_task_options(None)))
+        merge.link(summarize)
+        chord(
+            [normalize_shard.si(instance.pk, start, end, index).set(**_get_task_options(end - start))
+             for index, (start, end) in enumerate(shards)],
+            merge
+        ).apply_async()
+        raise Ignore()  # The step continues in the tasks above
+
+    # File contents are validated while the normalized file is written; this avoids parsing the entire file twice.
+    try:
+        processors.normalize_contents(src_path, parser_options, tmp_normalized_path, log_path,
+                                      threads=settings.LZ_INGEST_THREADS,
+                                      reporter=progress.make_reporter(instance.pk, 'normalize'))
+    except exceptions.SortOrderException:
+        if not sort_if_needed:
+            raise
+        # The partial output has been removed; start again from a sorted copy
+        _normalize_sorted(instance, src_path, tmp_normalized_path)
+    else:
+        _record_normalize(instance)
+    summarize.apply_async()
+
+
+def _normalize_sorted(instance: models.AnalysisFileset, src_path: str, tmp_normalized_path: str):
+    """Sort the rows of an upload (in a temporary copy), and normalize that instead"""
+    sorted_path = instance.sorted_gwas_path
+    with open(instance.normalized_gwas_log_path, 'a+') as f:
+        f.write('Rows are out of order, and will be sorted. Row numbers below refer to the sorted file.\n')
+    sorting.sort_gwas(src_path, instance.parser_options, sorted_path,
+                      memory_budget=settings.LZ_SORT_MEMORY_BUDGET, scratch_dir=settings.LZ_SORT_SCRATCH_DIR,
+                      threads=settings.LZ_INGEST_THREADS, reporter=progress.make_reporter(instance.pk, 'sort'))
+    try:
+        processors.normalize_contents(sorted_path, instance.parser_options, tmp_normalized_path,
+                                      instance.normalized_gwas_log_path, threads=settings.LZ_INGEST_THREADS,
+                                      reporter=progress.make_reporter(instance.pk, 'normalize'))
+    finally:
+        os.remove(sorted_path)
+    _record_normalize(instance)
 
 
 @shared_task(bind=True)
-@lz_file_prep("Manhattan, QQ, and top hit detection")
-def summarize_gwas(self, instance: models.AnalysisFileset):
-    """Generate "summary" files based on the overall study contents; uses PheWeb loader code"""
-    normalized_path = instance.normalized_gwas_path
-    manhattan_path = instance.manhattan_path
-    qq_path = instance.qq_path
+@lz_file_prep("Normalize part of a GWAS file", step='normalize')
+def normalize_shard(self, instance: models.AnalysisFileset, start: int, end: int, shard_index: int):
+    """Normalize one byte range of the uploaded file; the parts are joined by `merge_normalized_shards`"""
+    src_path = os.path.join(settings.MEDIA_ROOT, instance.raw_gwas_file.name)
+    processors.normalize_shard(src_path, instance.parser_options, start, end,
+                               instance.get_normalize_shard_path(shard_index), threads=settings.LZ_INGEST_THREADS,
+                               reporter=progress.make_reporter(instance.pk, 'normalize', shard_index))
+
+
+@shared_task(bind=True)
+@lz_file_prep("Combine normalized GWAS file", step='normalize')
+def merge_normalized_shards(self, instance: models.AnalysisFileset, num_shards: int):
+    """Join the normalized parts (in order), and report any problems just as a single-task normalization would"""
+    shard_paths = [instance.get_normalize_shard_path(index) for index in range(num_shards)]
+    tmp_normalized_path = instance.normalized_gwas_path.replace('.txt.gz', '.txt')
+    processors.merge_normalized_shards(shard_paths, tmp_normalized_path, instance.normalized_gwas_log_path)
+    _record_normalize(instance)
+
 
-    # Find top hit
-    best_row = processors.get_top_hit(normalized_path)
+def _save_top_hit(instance: models.AnalysisFileset, best_row):
     top_hit = models.RegionView.objects.create(
         gwas=instance.metadata,
         label='Top hit',
@@ -98,9 +356,90 @@ def summarize_gwas(self, instance: models.AnalysisFileset):
     instance.metadata.top_hit_view = top_hit
     instance.metadata.save()
 
-    # Generate files
-    processors.generate_manhattan(normalized_path, manhattan_path)
-    processors.generate_qq(normalized_path, qq_path)
+
+def _get_summary_options() -> dict:
+    # Settings that change the contents of the summary files
+    return {'qq_streaming': settings.LZ_QQ_STREAMING}
+
+
+def _record_summaries(instance: models.AnalysisFileset):
+    normalize_manifest = instance.get_step_manifest_path('normalize')
+    manifest.write(instance.get_step_manifest_path('summarize'), 'summarize',
+                   manifest.get_output_digest(normalize_manifest, instance.normalized_gwas_path),
+                   _get_summary_options(),
+                   [instance.manhattan_path, instance.qq_path])
+
+
+@shared_task(bind=True)
+@lz_file_prep("Manhattan, QQ, and top hit detection", step='summarize')
+def summarize_gwas(self, instance: models.AnalysisFileset):
+    """
+    Generate "summary" files based on the overall study contents; uses PheWeb loader code
+
+    If the study has several chromosomes, each one is summarized by a separate task (so that they can run at the same
+        time), and the results are merged at the end
+
+    This is the last step of the pipeline. It is started by `normalize_gwas` (or the task that merges its parts), and
+        it starts `mark_success` itself once the summaries are done (see `total_pipeline`).
+    """
+    normalized_path = instance.normalized_gwas_path
+    finish = mark_success.si(instance.pk).set(**_get_task_options(None))
+
+    # The summaries only need to be regenerated if the normalized file (or the summary code) has changed
+    manifest_path = instance.get_step_manifest_path('summarize')
+    input_digest = manifest.get_output_digest(instance.get_step_manifest_path('normalize'), normalized_path)
+    if instance.metadata.top_hit_view and manifest.is_current(manifest_path, 'summarize', input_digest,
+                                                              _get_summary_options()):
+        finish.apply_async()
+        return STEP_SKIPPED
+    manifest.clear(manifest_path)
+
+    shards = processors.get_summary_shards(normalized_path)
+
+    if len(shards) > 1:
+        # The merge step is the last part of the chord, so it also reports failures from any shard, and is followed by
+        #   `mark_success`. The size of each chromosome is not known in advance, so every task is routed (and limited)
+        #   based on the whole upload.
+        options = _get_task_options(_get_upload_bytes(instance))
+        merge = merge_summaries.si(instance.pk, len(shards)).set(**options).on_error(
+            mark_failure.si(instance.pk).set(**_get_task_options(None)))
+        merge.link(finish)
+        chord(
+            [summarize_shard.si(instance.pk, chrom, index).set(**options) for index, chrom in enumerate(shards)],
+            merge
+        ).apply_async()
+        raise Ignore()  # The step continues in the tasks above
+
+    # Generate files, and find the top hit, in a single pass over the normalized data
+    best_row = processors.generate_summaries(normalized_path, instance.manhattan_path, instance.qq_path,
+                                             qq_streaming=settings.LZ_QQ_STREAMING,
+                                             threads=settings.LZ_INGEST_THREADS,
+                                             reporter=progress.make_reporter(instance.pk, 'summarize'))
+    _save_top_hit(instance, best_row)
+    _record_summaries(instance)
+    finish.apply_async()
+
+
+@shared_task(bind=True)
+@lz_file_prep("Summarize one chromosome", step='summarize')
+def summarize_shard(self, instance: models.AnalysisFileset, chrom: str, shard_index: int):
+    """Save partial summary results for one chromosome, which will be merged by `merge_summaries`"""
+    processors.summarize_shard(instance.normalized_gwas_path, chrom, instance.get_summary_partial_path(shard_index),
+                               qq_streaming=settings.LZ_QQ_STREAMING,
+                               reporter=progress.make_reporter(instance.pk, 'summarize', shard_index))
+
+
+@shared_task(bind=True)
+@lz_file_prep("Merge Manhattan, QQ, and top hit data", step='summarize')
+def merge_summaries(self, instance: models.AnalysisFileset, num_shards: int):
+    """Combine the results for each chromosome, and write the final summary files"""
+    partial_paths = [instance.get_summary_partial_path(index) for index in range(num_shards)]
+    best_row = processors.merge_summaries(partial_paths, instance.manhattan_path, instance.qq_path)
+    _save_top_hit(instance, best_row)
+    _record_summaries(instance)
+
+    for path in partial_paths:
+        os.remove(path)
 
 
 @shared_task(bind=True)
@@ -111,6 +450,7 @@ def mark_success(self, fileset_id):
     instance.ingest_status = 2
     instance.ingest_complete = timezone.now()
     instance.save()
+    progress.set_status(fileset_id, progress.COMPLETE)
 
     # The parent object needs to know which instance is the current newest / best one to display
     metadata = instance.metadata
@@ -135,6 +475,7 @@ def mark_failure(self, fileset_id):
     instance.ingest_status = 1
     instance.ingest_complete = timezone.now()
     instance.save()
+    progress.set_status(fileset_id, progress.FAILED)
 
     mail_admins('Results done processing',
                 f'Data ingestion failed for gwas id: {fileset_id}. Please see logs for details.'
@@ -142,13 +483,72 @@ def mark_failure(self, fileset_id):
 
 
 def total_pipeline(fileset_id: int):
-    """Combine discrete tasks into a total pipeline"""
+    """
+    Combine discrete tasks into a total pipeline
+
+    A quick check of a sample of the file runs first, so that bad uploads fail fast. Hashing does not depend on the
+        normalized file, so it runs at the same time as normalization (and the later steps do not wait for it). When
+        the pipeline is re-run, steps whose outputs are still up to date are skipped (see `util.ingest.manifest`).
+
+    Normalizing and summarizing may each continue in a chord of parallel tasks (one per part of the file, or one per
+        chromosome). The steps after them are not chained here: a task that hands its work to a chord ends before the
+        work is done, so the next step would start too early (or, after a group, never start at all). Instead,
+        `normalize_gwas` starts `summarize_gwas`, which starts `mark_success`; when a step continues in a chord, the
+        next step is linked to the task that merges the results.
+
+    Steps that read the whole file run on a queue (and with time limits) chosen by the size of the upload; the quick
+        steps always run on the fast queue, with the shortest time limits.
+    """
+    instance = models.AnalysisFileset.objects.get(pk=fileset_id)
+    options = _get_task_options(_get_upload_bytes(instance))
+    fast = _get_task_options(None)
     return (
-        hash_contents.si(fileset_id) |
-        normalize_gwas.si(fileset_id) |
-        summarize_gwas.si(fileset_id) |
-        mark_success.si(fileset_id)
-    ).on_error(mark_failure.si(fileset_id))
+        preflight_gwas.si(fileset_id).set(**fast) |
+        group(hash_contents.si(fileset_id).set(**options), normalize_gwas.si(fileset_id).set(**options))
+    ).on_error(mark_failure.si(fileset_id).set(**fast))
+
+
+def _count_active_before(instance: models.AnalysisFileset) -> int:
+    """The number of uploads by the same user that are still being processed, and were created before this one"""
+    owner_id = instance.metadata.owner_id if instance.metadata else None
+    if owner_id is None:
+        return 0
+    stale_before = timezone.now() - datetime.timedelta(seconds=settings.LZ_INGEST_STALE_AFTER)
+    return models.AnalysisFileset.objects.filter(
+        metadata__owner_id=owner_id,
+        ingest_status=0,
+        modified__gte=stale_before,
+        pk__lt=instance.pk,
+    ).count()
+
+
+@shared_task(bind=True, max_retries=None)
+def start_pipeline(self, fileset_id: int):
+    """
+    Start the ingest pipeline, once it is this upload's turn
+
+    Fair share: each user may have at most `LZ_INGEST_MAX_ACTIVE_PER_USER` uploads processed at once, so that one
+        user's batch of uploads does not fill the queues ahead of everyone else's. Later uploads wait (without holding
+        a worker) until the earlier ones finish, and then start in the order that they were created.
+    """
+    instance = models.AnalysisFileset.objects.get(pk=fileset_id)
+    if instance.ingest_status != 0:
+        return  # Processed (or cancelled) while waiting
+
+    max_active = settings.LZ_INGEST_MAX_ACTIVE_PER_USER
+    if max_active and _count_active_before(instance) >= max_active:
+        if not self.request.retries:
+            progress.publish_transition(fileset_id, 'queue', "Wait for this user's earlier uploads", 'started')
+        raise self.retry(countdown=settings.LZ_INGEST_WAIT_INTERVAL)
+
+    if self.request.retries:
+        progress.publish_transition(fileset_id, 'queue', "Wait for this user's earlier uploads", 'completed')
+    total_pipeline(fileset_id).apply_async()
+
+
+def queue_pipeline(fileset_id: int):
+    """Start the ingest pipeline for an upload, subject to fair share (see `start_pipeline`)"""
+    start_pipeline.apply_async((fileset_id,), queue=settings.LZ_INGEST_FAST_QUEUE)
 
 
 @receiver(signals.post_save, sender=models.AnalysisFileset)
@@ -164,5 +564,5 @@ def gwas_upload_signal(sender, instance: models.AnalysisFileset = None, created=
         return
 
     # Avoid atomic request race condition by only running task once record created
-    transaction.on_commit(lambda: total_pipeline(instance.pk).apply_async())
+    transaction.on_commit(lambda: queue_pipeline(instance.pk))
 
@@ -0,0 +1,143 @@
+import datetime
+import os
+import shutil
+from unittest import mock
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from locuszoom_plotting_service.gwas import util as lz_util
+from locuszoom_plotting_service.gwas.models import AnalysisFileset, StepTelemetry
+from locuszoom_plotting_service.gwas.tests.factories import AnalysisInfoFactory
+from locuszoom_plotting_service.users.tests.factories import UserFactory
+from util.ingest import processors
+
+from .. import tasks
+from ..celery import app as celery_app
+
+
+@override_settings(LZ_PROGRESS_REDIS_URL=None)
+class TestTotalPipeline(TestCase):
+    def setUp(self):
+        # Run every task (including chords started by a task) in this process, in order
+        self._conf = (celery_app.conf.task_always_eager, celery_app.conf.task_eager_propagates)
+        celery_app.conf.task_always_eager = True
+        celery_app.conf.task_eager_propagates = True
+
+        self.study = AnalysisInfoFactory(files__has_data=True)
+        self.fileset = self.study.files
+        self.fileset.metadata = self.study
+        self.fileset.save()
+
+    def tearDown(self):
+        celery_app.conf.task_always_eager, celery_app.conf.task_eager_propagates = self._conf
+        shutil.rmtree(lz_util.get_study_folder(self.fileset, absolute_path=True), ignore_errors=True)
+
+    def test_pipeline_succeeds_once_after_summaries_are_merged(self):
+        # The sample file has several chromosomes, so the summaries are calculated in a chord of per-chromosome tasks
+        tasks.total_pipeline(self.fileset.pk).apply_async()
+
+        self.fileset.refresh_from_db()
+        self.assertEqual(self.fileset.ingest_status, 2)
+        success_emails = [message for message in mail.outbox if message.to == [self.study.owner.email]]
+        self.assertEqual(len(success_emails), 1, 'The pipeline is marked as successful exactly once')
+
+        telemetry = StepTelemetry.objects.filter(fileset=self.fileset)
+        self.assertEqual(telemetry.get(task='summarize_gwas').outcome, 'parallel')
+        self.assertGreater(telemetry.filter(task='summarize_shard').count(), 1)
+        merge = telemetry.get(task='merge_summaries')
+        self.assertEqual(merge.outcome, 'completed')
+        self.assertLessEqual(merge.created, self.fileset.ingest_complete, 'Success is marked after the merge step')
+
+    @override_settings(LZ_NORMALIZE_MAX_SHARDS=3)
+    def test_pipeline_summarizes_after_shards_are_merged(self):
+        # The sample file is small, so allow it to be split into (small) parts
+        get_shards = processors.get_normalize_shards
+        with mock.patch.object(tasks.processors, 'get_normalize_shards',
+                               side_effect=lambda path, max_shards: get_shards(path, max_shards, min_shard_size=500)):
+            tasks.total_pipeline(self.fileset.pk).apply_async()
+
+        self.fileset.refresh_from_db()
+        self.assertEqual(self.fileset.ingest_status, 2)
+        self.assertTrue(os.path.isfile(self.fileset.normalized_gwas_path + '.tbi'))
+
+        telemetry = StepTelemetry.objects.filter(fileset=self.fileset)
+        self.assertEqual(telemetry.get(task='normalize_gwas').outcome, 'parallel')
+        self.assertEqual(telemetry.filter(task='normalize_shard').count(), 3)
+        merge = telemetry.get(task='merge_normalized_shards')
+        self.assertEqual(merge.outcome, 'completed')
+        summarize = telemetry.get(task='summarize_gwas')  # Exactly once
+        self.assertLessEqual(merge.created, summarize.created, 'Summaries are made after the parts are merged')
+
+    @override_settings(LZ_SORT_UPLOADS=True)
+    def test_pipeline_sorts_rows_only_when_needed(self):
+        no_extra_pass = AssertionError('The order is checked while the file is normalized, not in a separate pass')
+        with mock.patch.object(tasks.sorting, 'sort_gwas', wraps=tasks.sorting.sort_gwas) as sort_gwas, \
+                mock.patch.object(tasks.sorting, 'is_sorted', side_effect=no_extra_pass):
+            tasks.total_pipeline(self.fileset.pk).apply_async()
+            self.assertFalse(sort_gwas.called, 'A sorted upload is normalized in a single pass')
+
+            # Upload the same rows in reverse order, and run the pipeline again
+            raw_path = os.path.join(settings.MEDIA_ROOT, self.fileset.raw_gwas_file.name)
+            with open(raw_path, 'r') as f:
+                header, *rows = f.readlines()
+            with open(raw_path, 'w') as f:
+                f.writelines([header] + rows[::-1])
+            self.fileset.refresh_from_db()
+            self.fileset.file_sha256 = b''  # A different file
+            self.fileset.ingest_status = 0
+            self.fileset.save()
+            tasks.total_pipeline(self.fileset.pk).apply_async()
+            self.assertTrue(sort_gwas.called, 'Rows are sorted after normalizing finds that they are out of order')
+
+        self.fileset.refresh_from_db()
+        self.assertEqual(self.fileset.ingest_status, 2)
+
+
+@override_settings(LZ_PROGRESS_REDIS_URL=None, LZ_INGEST_MAX_ACTIVE_PER_USER=2, LZ_INGEST_STALE_AFTER=3600)
+class TestStartPipeline(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+
+    def _make_upload(self, owner, ingest_status=0) -> AnalysisFileset:
+        study = AnalysisInfoFactory(owner=owner, files__ingest_status=ingest_status)
+        study.files.metadata = study
+        study.files.save()
+        return study.files
+
+    def _start(self, fileset: AnalysisFileset) -> bool:
+        """Run the task (without a worker), and report whether it started the pipeline or asked to wait"""
+        with mock.patch.object(tasks, 'total_pipeline') as total_pipeline, \
+                mock.patch.object(tasks.start_pipeline, 'retry', side_effect=Retry):
+            try:
+                tasks.start_pipeline(fileset.pk)
+            except Retry:
+                self.assertFalse(total_pipeline.called)
+                return False
+        self.assertTrue(total_pipeline.called)
+        return True
+
+    def test_third_upload_waits_for_earlier_ones(self):
+        first, second, third = (self._make_upload(self.user) for _ in range(3))
+        self.assertTrue(self._start(first))
+        self.assertTrue(self._start(second))
+        self.assertFalse(self._start(third), 'Each user may have two uploads processed at once')
+
+    def test_other_users_upload_starts(self):
+        for _ in range(2):
+            self._make_upload(self.user)
+        self.assertTrue(self._start(self._make_upload(UserFactory())), "Waits only for the same user's uploads")
+
+    def test_finished_and_stale_uploads_are_not_counted(self):
+        self._make_upload(self.user, ingest_status=2)
+        stale = self._make_upload(self.user)
+        # Saving a fileset always updates the modified time, so change it directly
+        AnalysisFileset.objects.filter(pk=stale.pk).update(modified=timezone.now() - datetime.timedelta(hours=2))
+        self._make_upload(self.user)
+
+        upload = self._make_upload(self.user)
+        self.assertEqual(tasks._count_active_before(upload), 1, 'Only one earlier upload is still being processed')
+        self.assertTrue(self._start(upload))
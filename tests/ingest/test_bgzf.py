@@ -0,0 +1,53 @@
+import gzip
+import os
+
+import pytest
+
+from util.ingest import bgzf
+
+
+SAMPLE_NORM = os.path.join(os.path.dirname(__file__), 'fixtures/gwas.tab.gz')
+
+# Enough text to fill several blocks
+CONTENTS = ''.join('1\t{}\tA\tC\t0.{}\n'.format(i, i) for i in range(1, 20_000))
+
+
+class TestBgzf:
+    @pytest.mark.parametrize('threads', [1, 3])
+    def test_round_trip(self, tmpdir, threads):
+        path = str(tmpdir / 'out.gz')
+        with bgzf.BgzfWriter(path, threads=threads) as writer:
+            for start in range(0, len(CONTENTS), 1000):
+                writer.write(CONTENTS[start:start + 1000])
+
+        assert bgzf.is_bgzf(path)
+        with gzip.open(path, 'rt') as f:
+            assert f.read() == CONTENTS, 'Output can be read by any gzip reader'
+        with bgzf.open_text(path, threads=threads) as f:
+            assert f.read() == CONTENTS
+
+    def test_threads_do_not_change_output(self, tmpdir):
+        for threads in (1, 4):
+            with bgzf.BgzfWriter(str(tmpdir / 'out_{}.gz'.format(threads)), threads=threads) as writer:
+                writer.write(CONTENTS)
+        assert (tmpdir / 'out_1.gz').read_binary() == (tmpdir / 'out_4.gz').read_binary()
+
+    def test_concatenate(self, tmpdir):
+        half = len(CONTENTS) // 2
+        with bgzf.BgzfWriter(str(tmpdir / 'part_1.gz')) as writer:
+            writer.write(CONTENTS[:half])
+        with bgzf.BgzfWriter(str(tmpdir / 'part_2.gz'), write_eof=False) as writer:
+            writer.write(CONTENTS[half:])
+
+        path = str(tmpdir / 'combined.gz')
+        bgzf.concatenate([str(tmpdir / 'part_1.gz'), str(tmpdir / 'part_2.gz')], path)
+        with bgzf.open_text(path, threads=2) as f:
+            assert f.read() == CONTENTS
+        with open(path, 'rb') as f:
+            data = f.read()
+        assert data.count(bgzf.EOF_BLOCK) == 1 and data.endswith(bgzf.EOF_BLOCK), 'One EOF marker, at the end'
+
+    def test_reads_regular_gzip(self):
+        assert not bgzf.is_bgzf(SAMPLE_NORM)
+        with bgzf.open_text(SAMPLE_NORM, threads=2) as f, gzip.open(SAMPLE_NORM, 'rt') as expected:
+            assert f.read() == expected.read(), 'Files that are not BGZF are read normally'
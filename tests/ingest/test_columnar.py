@@ -0,0 +1,30 @@
+"""Tests of the column-oriented reader used by vectorized summary steps"""
+import os
+
+from zorp import readers
+
+from util.ingest import columnar
+
+
+SAMPLE_NORM = os.path.join(os.path.dirname(__file__), 'fixtures/gwas.tab.gz')
+
+
+class TestBatchReader:
+    def test_reads_same_rows_as_standard_reader(self):
+        expected = list(readers.standard_gwas_reader(SAMPLE_NORM)
+                        .add_filter('neg_log_pvalue', lambda v, row: v is not None))
+
+        batches = list(columnar.read_batches(SAMPLE_NORM, chunk_size=20))
+        assert len(batches) == 5, 'Splits rows into batches of the requested size'
+        assert sum(len(batch) for batch in batches) == len(expected)
+
+        actual = [
+            (batch.chrom_names[batch.chrom[i]], batch.pos[i], batch.neg_log_pvalue[i])
+            for batch in batches for i in range(len(batch))
+        ]
+        assert actual == [(row.chrom, row.pos, row.neg_log_pvalue) for row in expected]
+
+    def test_gets_full_variant(self):
+        batch = next(columnar.read_batches(SAMPLE_NORM))
+        first = next(iter(readers.standard_gwas_reader(SAMPLE_NORM)))
+        assert batch.get_variant(0) == first, 'Individual rows are parsed just like the row-based reader'
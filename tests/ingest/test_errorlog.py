@@ -0,0 +1,50 @@
+import io
+
+from util.ingest import errorlog
+
+
+def _make_errors(count, start=1):
+    return [(n, "could not convert string to float: 'x{}'".format(n), 'bad row {}'.format(n))
+            for n in range(start, start + count)]
+
+
+class TestErrorLog:
+    def test_writes_errors_as_they_are_found(self):
+        log_file = io.StringIO()
+        error_log = errorlog.ErrorLog(log_file, max_logged=2, max_examples=1)
+        for error in _make_errors(2):
+            error_log.append(error)
+        assert log_file.getvalue().count('Excluded row') == 2, 'Errors are written before the log is finished'
+
+        error_log.append((3, 'list index out of range', 'short row'))
+        error_log.write_summary()
+        text = log_file.getvalue()
+        assert text.count('Excluded row') == 2, 'Only the first errors are listed'
+        assert 'Further parse errors are not listed' in text
+        assert '    could not convert string to float: 2\n' in text
+        assert '    list index out of range: 1\n' in text
+        assert '    Row 1: bad row 1\n' in text
+        assert 'bad row 2' not in text, 'Only the first examples are kept'
+
+    def test_counts_every_error(self):
+        error_log = errorlog.ErrorLog(io.StringIO(), max_logged=10, max_examples=5)
+        for error in _make_errors(500):
+            error_log.append(error)
+        assert len(error_log) == 500, 'Length is the number of errors, so that zorp knows when to stop'
+        assert list(error_log) == _make_errors(5), 'Only examples are kept in memory'
+        assert error_log.counts == {'could not convert string to float': 500}
+
+    def test_merge_parts_of_a_file(self):
+        parts = []
+        for start in (1, 101):
+            part = errorlog.ErrorLog(max_logged=3, max_examples=2)
+            for n, reason, line in _make_errors(5, start=start):
+                part.append((n - start + 1, reason, line))
+            parts.append(part.to_dict())
+
+        merged = errorlog.ErrorLog(io.StringIO(), max_logged=3, max_examples=2)
+        merged.merge(parts[0])
+        merged.merge(parts[1], line_offset=100, limit=8)
+        assert len(merged) == 8, 'Merging stops at the limit'
+        assert merged.counts == {'could not convert string to float': 8}
+        assert list(merged) == _make_errors(2), 'Examples are the first rows in the whole file'
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+from zorp import readers
+
+from util.ingest import columnar, manhattan
+
+
+SAMPLE_NORM = os.path.join(os.path.dirname(__file__), 'fixtures/gwas.tab.gz')
+
+# Small limits, so that the sample file exercises peaks as well as the binned and unbinned variants
+BINNER_OPTIONS = {'peak_pval_threshold': 0.3, 'peak_max_count': 3, 'num_unbinned': 5}
+
+
+def _get_expected():
+    binner = manhattan.Binner(**BINNER_OPTIONS)
+    for variant in readers.standard_gwas_reader(SAMPLE_NORM):
+        binner.process_variant(variant)
+    return binner.get_result()
+
+
+class TestCompactBinner:
+    def test_rows_match_binner(self):
+        binner = manhattan.CompactBinner(**BINNER_OPTIONS)
+        for variant in readers.standard_gwas_reader(SAMPLE_NORM):
+            binner.process_variant(variant)
+        assert binner.get_result() == _get_expected()
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+    def test_batches_match_binner(self, chunk_size):
+        binner = manhattan.CompactBinner(**BINNER_OPTIONS)
+        for batch in columnar.read_batches(SAMPLE_NORM, chunk_size=chunk_size):
+            binner.process_batch(batch)
+
+        result = binner.get_result()
+        assert result == _get_expected()
+        assert any(variant.get('peak') for variant in result['unbinned_variants']), 'Sample data includes peaks'
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from util.ingest import manifest
+
+
+@pytest.fixture
+def step_output(tmpdir):
+    output = tmpdir / 'normalized.txt.gz'
+    output.write_binary(b'some data')
+    manifest_path = str(tmpdir / 'normalize.manifest.json')
+    manifest.write(manifest_path, 'normalize', 'abc123', {'chr_col': 1}, [str(output)])
+    return manifest_path, output
+
+
+class TestManifest:
+    def test_unchanged_step_is_current(self, step_output):
+        manifest_path, output = step_output
+        assert manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+        stat = os.stat(str(output))
+        assert manifest.get_output_digest(manifest_path, str(output)) == '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+    @pytest.mark.parametrize('input_digest,options', [
+        ('def456', {'chr_col': 1}),
+        ('abc123', {'chr_col': 2}),
+        (None, {'chr_col': 1}),
+    ])
+    def test_changed_inputs_are_stale(self, step_output, input_digest, options):
+        manifest_path, _ = step_output
+        assert not manifest.is_current(manifest_path, 'normalize', input_digest, options)
+
+    def test_changed_output_is_stale(self, step_output):
+        manifest_path, output = step_output
+        mtime_ns = os.stat(str(output)).st_mtime_ns
+        output.write_binary(b'same size')
+        os.utime(str(output), ns=(mtime_ns + 10 ** 9, mtime_ns + 10 ** 9))
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+        # Outputs are not re-read: only the size and modification time are compared
+        os.utime(str(output), ns=(mtime_ns, mtime_ns))
+        assert manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+        output.write_binary(b'other data')
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+        output.remove()
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+    def test_input_digest_added_later(self, tmpdir):
+        output = tmpdir / 'normalized.txt.gz'
+        output.write_binary(b'some data')
+        manifest_path = str(tmpdir / 'normalize.manifest.json')
+        manifest.write(manifest_path, 'normalize', None, {'chr_col': 1}, [str(output)])
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+        manifest.set_input(manifest_path, 'abc123')
+        assert manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+        manifest.set_input(manifest_path, 'def456')
+        assert manifest.read(manifest_path)['input_sha256'] == 'abc123', 'A known digest is never replaced'
+
+    def test_new_code_version_is_stale(self, step_output, monkeypatch):
+        manifest_path, _ = step_output
+        monkeypatch.setitem(manifest.STEP_VERSIONS, 'normalize', manifest.STEP_VERSIONS['normalize'] + 1)
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+
+    def test_removed_manifest_is_stale(self, step_output):
+        manifest_path, _ = step_output
+        manifest.remove(manifest_path)
+        assert not manifest.is_current(manifest_path, 'normalize', 'abc123', {'chr_col': 1})
+        assert manifest.get_output_digest(manifest_path, 'normalized.txt.gz') is None
+
+    def test_clear_removes_outputs(self, step_output):
+        manifest_path, output = step_output
+        manifest.clear(manifest_path)
+        assert manifest.read(manifest_path) is None
+        assert not output.exists(), 'Outputs are removed, so that shared (hardlinked) files are never edited'
@@ -0,0 +1,108 @@
+"""
+Peak memory budgets for each processor, measured on a generated file
+
+Each step declares a fixed budget (eg, one batch of rows), plus an allowance per row for steps that must keep some data
+    for every row. A change that makes any step hold on to more data than it declares will fail here. Small per-row
+    costs only stand out on large files: set `LZ_MEMORY_TEST_ROWS` to check budgets on (eg) 10000000 rows.
+
+Memory is measured with `tracemalloc`, so only Python (and NumPy) allocations are counted.
+"""
+import os
+import tracemalloc
+import typing as ty
+
+import pytest
+
+from util.ingest import processors, sorting, synthetic
+
+MB = 2 ** 20
+
+# Large enough that summary steps read several batches (see `columnar.DEFAULT_CHUNK_SIZE`)
+NUM_ROWS = int(os.environ.get('LZ_MEMORY_TEST_ROWS', 150_000))
+
+
+class Budget(ty.NamedTuple):
+    fixed: int
+    per_row: float = 0
+
+    def get_limit(self, rows: int) -> float:
+        return self.fixed + self.per_row * rows
+
+
+# Summary steps parse one batch of rows at a time (see `columnar`); a full batch peaks at ~50 MB
+_BATCH = 64 * MB
+
+_SORT_MEMORY = 16 * MB
+
+# Exact QQ plots keep every p-value (8 bytes each, in an array that may be over-allocated while it grows)
+BUDGETS = {
+    'sha256': Budget(8 * MB),
+    'normalize': Budget(16 * MB),
+    'summaries': Budget(_BATCH, per_row=24),
+    'summaries_streaming': Budget(_BATCH),
+    'summarize_shard': Budget(_BATCH),
+    'manhattan': Budget(_BATCH),
+    'qq': Budget(_BATCH, per_row=24),
+    'qq_streaming': Budget(_BATCH),
+    'top_hit': Budget(_BATCH),
+    # Rows being sorted are limited by the sort's own budget (plus buffers for each run)
+    'sort': Budget(_SORT_MEMORY + 8 * MB),
+}
+
+
+def get_peak_memory(func: ty.Callable, *args, **kwargs) -> int:
+    """Peak memory allocated (in bytes) while running a function"""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+@pytest.fixture(scope='module')
+def synthetic_files(tmpdir_factory):
+    """A raw GWAS file, and the result of normalizing it"""
+    tmpdir = tmpdir_factory.mktemp('memory')
+    src_path = str(tmpdir / 'synthetic.txt.gz')
+    synthetic.generate_gwas(src_path, NUM_ROWS, missing_pval_rate=0.01)
+
+    normalize_path = str(tmpdir / 'normalized.txt')
+    peak = get_peak_memory(processors.normalize_contents, src_path, synthetic.PARSER_OPTIONS, normalize_path,
+                           str(tmpdir / 'normalize.log'))
+    return tmpdir, src_path, normalize_path + '.gz', peak
+
+
+def _run_step(step: str, tmpdir, src_path: str, normalized_path: str) -> int:
+    manhattan_path = str(tmpdir / 'manhattan.json')
+    qq_path = str(tmpdir / 'qq.json')
+    steps: ty.Dict[str, ty.Callable[[], ty.Any]] = {
+        'sha256': lambda: processors.get_file_sha256(src_path),
+        'summaries': lambda: processors.generate_summaries(normalized_path, manhattan_path, qq_path),
+        'summaries_streaming': lambda: processors.generate_summaries(normalized_path, manhattan_path, qq_path,
+                                                                     qq_streaming=True),
+        'summarize_shard': lambda: processors.summarize_shard(normalized_path, '1', str(tmpdir / 'partial.pickle'),
+                                                              qq_streaming=True),
+        'manhattan': lambda: processors.generate_manhattan(normalized_path, manhattan_path),
+        'qq': lambda: processors.generate_qq(normalized_path, qq_path),
+        'qq_streaming': lambda: processors.generate_qq(normalized_path, qq_path, streaming=True),
+        'top_hit': lambda: processors.get_top_hit(normalized_path),
+        'sort': lambda: sorting.sort_gwas(src_path, synthetic.PARSER_OPTIONS, str(tmpdir / 'sorted.txt.gz'),
+                                          memory_budget=_SORT_MEMORY),
+    }
+    return get_peak_memory(steps[step])
+
+
+class TestMemoryBudgets:
+    def test_normalize(self, synthetic_files):
+        *_, peak = synthetic_files
+        limit = BUDGETS['normalize'].get_limit(NUM_ROWS)
+        assert peak <= limit, f'normalize used {peak / MB:.1f} MB, budget is {limit / MB:.1f} MB'
+
+    @pytest.mark.parametrize('step', sorted(set(BUDGETS) - {'normalize'}))
+    def test_step(self, synthetic_files, step):
+        tmpdir, src_path, normalized_path, _ = synthetic_files
+        peak = _run_step(step, tmpdir, src_path, normalized_path)
+        limit = BUDGETS[step].get_limit(NUM_ROWS)
+        assert peak <= limit, f'{step} used {peak / MB:.1f} MB, budget is {limit / MB:.1f} MB'
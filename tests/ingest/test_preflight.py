@@ -0,0 +1,86 @@
+import gzip
+import random
+
+import pytest
+
+from util.ingest import preflight, synthetic
+
+
+@pytest.fixture(scope='module')
+def large_file(tmpdir_factory):
+    """A file that is long enough to be sampled at several points (as plain text)"""
+    src_path = str(tmpdir_factory.mktemp('preflight') / 'large.txt')
+    synthetic.generate_gwas(src_path, 50_000)
+    return src_path
+
+
+class TestPreflight:
+    def test_good_file(self, tmpdir):
+        src_path = str(tmpdir / 'sample.txt.gz')
+        synthetic.generate_gwas(src_path, 50_000)
+        report = preflight.check_sample(src_path, synthetic.PARSER_OPTIONS)
+        assert report['ok'], report['problems']
+        assert report['compression'] == 'bgzf'
+        assert report['seek_points'] > 0, 'Rows are checked from several places in the file'
+        assert report['rows_checked'] > preflight.HEAD_ROWS
+        assert report['columns'] == ['#chrom', 'pos', 'ref', 'alt', 'pvalue']
+        assert report['column_names']['pval_col'] == 'pvalue'
+        assert report['is_sorted']
+        assert report['parse_errors'] == 0
+
+    def test_wrong_columns(self, large_file):
+        report = preflight.check_sample(large_file, {**synthetic.PARSER_OPTIONS, 'pval_col': 3})
+        assert not report['ok']
+        assert report['problems'] == ['None of the sampled rows could be read with these options']
+        assert report['error_rate'] == 1
+        assert len(report['error_examples']) == preflight.MAX_EXAMPLES
+        assert report['error_examples'][0]['row'] == 2, 'Row numbers count the header'
+
+    def test_missing_column(self, large_file):
+        report = preflight.check_sample(large_file, {**synthetic.PARSER_OPTIONS, 'pval_col': 9})
+        assert not report['ok']
+        assert 'Column 9 (pval_col) does not exist: rows have 5 columns' in report['problems']
+
+    def test_errors_after_the_start(self, tmpdir, large_file):
+        # The first rows are fine; a block of rows in the middle of the file has bad p-values
+        with open(large_file, 'r') as f:
+            lines = f.readlines()
+        start, end = len(lines) * 3 // 10, len(lines) * 7 // 10
+        lines[start:end] = [line.rsplit('\t', 1)[0] + '\tnot_a_number\n' for line in lines[start:end]]
+        src_path = tmpdir / 'bad_middle.txt'
+        src_path.write(''.join(lines))
+
+        report = preflight.check_sample(str(src_path), synthetic.PARSER_OPTIONS, max_error_rate=0.01)
+        assert not report['ok']
+        assert report['parse_errors'] > 0
+        assert report['error_examples'][0]['row'] is None, 'Row numbers are not known partway through the file'
+
+    def test_unsorted_rows(self, tmpdir, large_file):
+        with open(large_file, 'r') as f:
+            header, *rows = f.readlines()
+        random.Random(1).shuffle(rows)
+        src_path = tmpdir / 'shuffled.txt'
+        src_path.write(header + ''.join(rows))
+
+        report = preflight.check_sample(str(src_path), synthetic.PARSER_OPTIONS)
+        assert not report['is_sorted']
+        assert report['problems'] == ['Rows must be grouped by chromosome, and sorted by position']
+        assert preflight.check_sample(str(src_path), synthetic.PARSER_OPTIONS, allow_unsorted=True)['ok']
+
+    def test_gzip_only_checks_head(self, tmpdir, large_file):
+        src_path = str(tmpdir / 'plain.txt.gz')
+        with open(large_file, 'rb') as src, gzip.open(src_path, 'wb') as dest:
+            dest.write(src.read())
+        report = preflight.check_sample(src_path, synthetic.PARSER_OPTIONS)
+        assert report['ok']
+        assert report['compression'] == 'gzip'
+        assert report['seek_points'] == 0
+        assert report['rows_checked'] == preflight.HEAD_ROWS
+
+    def test_short_file(self, tmpdir):
+        src_path = tmpdir / 'short.txt'
+        src_path.write('#chrom\tpos\tref\talt\tpvalue\n1\t1\tA\tC\t0.5\n1\t2\tA\tC\t0.5\n')
+        report = preflight.check_sample(str(src_path), synthetic.PARSER_OPTIONS)
+        assert report['ok']
+        assert report['rows_checked'] == 2
+        assert report['seek_points'] == 0
@@ -0,0 +1,67 @@
+import gzip
+
+import pytest
+
+from util.ingest import exceptions, preview, synthetic
+
+
+@pytest.fixture(scope='module')
+def sample_file(tmpdir_factory):
+    src_path = str(tmpdir_factory.mktemp('preview') / 'sample.txt.gz')
+    synthetic.generate_gwas(src_path, 5000)
+    return src_path
+
+
+def _read_head(path: str, size: int = 5000) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+class TestPreview:
+    def test_guesses_options_from_header(self, sample_file):
+        result = preview.preview_head(_read_head(sample_file))
+        assert result['compression'] == 'bgzf'
+        assert result['columns'] == ['#chrom', 'pos', 'ref', 'alt', 'pvalue']
+        assert result['parser_options'] == synthetic.PARSER_OPTIONS
+        assert result['is_complete']
+        assert result['parse_errors'] == 0
+        assert result['rows_checked'] > 100, 'Every complete row in the head is checked'
+        assert len(result['preview']) == preview.PREVIEW_ROWS
+        assert set(result['preview'][0]) == {'chrom', 'pos', 'ref', 'alt', 'pvalue', 'neg_log_pvalue'}
+
+    def test_plain_gzip(self, sample_file):
+        with gzip.open(sample_file, 'rb') as f:
+            data = gzip.compress(f.read())
+        result = preview.preview_head(data[:5000])
+        assert result['compression'] == 'gzip'
+        assert result['is_complete']
+
+    def test_header_names(self):
+        data = b'CHR,BP,SNP,A1,A2,FRQ,LOG10P\n' + b'1,100,rs1,A,G,0.2,1.5\n' * 20
+        options = preview.preview_head(data)['parser_options']
+        assert options == {'chr_col': 1, 'pos_col': 2, 'ref_col': 4, 'alt_col': 5, 'pval_col': 7,
+                           'is_log_pval': True, 'delimiter': ','}
+
+    def test_no_header(self):
+        data = b'chr1\t100\tT\tC\t0.5\nchr1\t200\tA\tG\t1e-8\n' * 10
+        result = preview.preview_head(data)
+        assert result['columns'] is None
+        assert result['parser_options'] == synthetic.PARSER_OPTIONS
+        assert result['preview'][1]['pvalue'] == pytest.approx(1e-8)
+
+    def test_ambiguous_columns(self):
+        # Frequency and p-value columns look alike; the user must choose
+        data = b'1\t100\tA\tG\t0.2\t0.5\n' * 10
+        result = preview.preview_head(data)
+        assert result['parser_options']['pval_col'] is None
+        assert not result['is_complete']
+        assert result['preview'] == []
+
+    def test_given_options(self, sample_file):
+        result = preview.preview_head(_read_head(sample_file), {**synthetic.PARSER_OPTIONS, 'pval_col': 3})
+        assert result['parse_errors'] == result['rows_checked']
+        assert result['error_examples'][0]['row'] == 2
+
+    def test_not_text(self):
+        with pytest.raises(exceptions.ValidationException):
+            preview.preview_head(bytes(range(256)) * 4)
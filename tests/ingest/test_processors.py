@@ -1,6 +1,13 @@
+import gzip
+import json
 import os
+import shutil
 
-from util.ingest import processors
+import numpy as np
+import pysam
+import pytest
+
+from util.ingest import bgzf, exceptions, processors, qq
 
 
 # A sample file with enough data to be worth meaningfully processing
@@ -9,6 +16,29 @@ SAMPLE_FILE = os.path.join(os.path.dirname(__file__), 'fixtures/gwas.tab')
 SAMPLE_NORM = os.path.join(os.path.dirname(__file__), 'fixtures/gwas.tab.gz')
 
 
+def _write_long_alleles(tmpdir):
+    # Rows with long alleles overlap the positions after them. The vcf preset reads the 4th column (alt, in the
+    #   normalized format) to decide where each row ends
+    src_path = tmpdir / 'long_alleles.txt'
+    src_path.write('#chrom\tpos\tref\talt\tpvalue\n' + ''.join(
+        '1\t{}\tC\t{}\t0.5\n'.format(pos, 'A' * 40) for pos in range(100, 2100, 20)))
+    return src_path, {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False}
+
+
+def _check_index_matches_zorp(tmpdir, gz_path):
+    # The index that zorp writes for single-process output (`reader.write(make_tabix=True)`)
+    expected_path = str(tmpdir / 'expected.txt.gz')
+    shutil.copyfile(gz_path, expected_path)
+    pysam.tabix_index(expected_path, force=True, preset='vcf')
+
+    with gzip.open(gz_path + '.tbi', 'rb') as actual, gzip.open(expected_path + '.tbi', 'rb') as expected:
+        assert actual.read() == expected.read(), 'Index is identical'
+    actual_file, expected_file = pysam.TabixFile(gz_path), pysam.TabixFile(expected_path)
+    for start, end in ((0, 110), (125, 130), (1000, 1030), (2085, 3000)):
+        assert list(actual_file.fetch('1', start, end)) == list(expected_file.fetch('1', start, end))
+    assert len(list(actual_file.fetch('1', 125, 130))) == 2, 'Rows that start before a region can overlap it'
+
+
 class TestPipelineTasks:
     def test_normalizes(self, tmpdir):
         status = processors.normalize_contents(
@@ -29,6 +59,24 @@ class TestPipelineTasks:
         assert os.path.isfile(os.path.join(tmpdir, 'normalized.txt.gz')), 'Normalized file written'
         assert os.path.isfile(os.path.join(tmpdir, 'normalized.txt.gz.tbi')), 'Normalized file was tabix indexed'
 
+    def test_normalize_validates_sort_order(self, tmpdir):
+        src_path = tmpdir / 'unsorted.txt'
+        src_path.write('\n'.join([
+            '#chrom\tpos\tref\talt\tpvalue',
+            '1\t2\tA\tC\t0.5',
+            '1\t1\tA\tC\t0.5',
+        ]))
+        with pytest.raises(exceptions.ValidationException):
+            processors.normalize_contents(
+                str(src_path),
+                {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False},
+                os.path.join(tmpdir, 'normalized.txt'),
+                os.path.join(tmpdir, 'logalog.log'),
+            )
+
+        assert not os.path.isfile(os.path.join(tmpdir, 'normalized.txt')), 'Partial output was removed'
+        assert not os.path.isfile(os.path.join(tmpdir, 'normalized.txt.gz')), 'Invalid file was not compressed'
+
     def test_makes_manhattan(self, tmpdir):
         expected = tmpdir / 'manhattan.json'
         status = processors.generate_manhattan(SAMPLE_NORM, str(expected))
@@ -40,3 +88,227 @@ class TestPipelineTasks:
         status = processors.generate_qq(SAMPLE_NORM, expected)
         assert status is True
         assert os.path.isfile(expected), 'QQ data created'
+
+    def test_single_pass_summaries_match_individual_steps(self, tmpdir):
+        best_row = processors.generate_summaries(
+            SAMPLE_NORM,
+            str(tmpdir / 'manhattan_fused.json'),
+            str(tmpdir / 'qq_fused.json'),
+        )
+        processors.generate_manhattan(SAMPLE_NORM, str(tmpdir / 'manhattan.json'))
+        processors.generate_qq(SAMPLE_NORM, str(tmpdir / 'qq.json'))
+
+        assert best_row == processors.get_top_hit(SAMPLE_NORM), 'Finds the same top hit'
+        assert (tmpdir / 'manhattan_fused.json').read() == (tmpdir / 'manhattan.json').read(), 'Same manhattan data'
+        assert (tmpdir / 'qq_fused.json').read() == (tmpdir / 'qq.json').read(), 'Same QQ data'
+
+    def test_streaming_qq_approximates_exact(self, tmpdir):
+        exact_path = str(tmpdir / 'qq.json')
+        streaming_path = str(tmpdir / 'qq_streaming.json')
+        processors.generate_qq(SAMPLE_NORM, exact_path)
+        processors.generate_qq(SAMPLE_NORM, streaming_path, streaming=True)
+
+        with open(exact_path, 'r') as f:
+            exact = json.load(f)
+        with open(streaming_path, 'r') as f:
+            streaming = json.load(f)
+
+        assert streaming['ci'] == exact['ci'], 'Confidence intervals depend only on the number of variants'
+        assert streaming['overall']['count'] == exact['overall']['count']
+        for perc, value in exact['overall']['gc_lambda'].items():
+            assert streaming['overall']['gc_lambda'][perc] == pytest.approx(value, rel=3e-4), 'Within error bound'
+
+    @pytest.mark.parametrize('use_batches', [False, True])
+    def test_streaming_qq_scale_is_exact(self, use_batches):
+        # P-values rounded to 3 decimals (plus some p=0 rows) put the scale of the plot at a value below the threshold
+        #   for exact counting. Every bin depends on that scale, so it must not be approximated.
+        pvals = np.round(np.random.RandomState(1).uniform(size=10_000), 3)
+        pvals[:20] = 0
+        qvals = np.where(pvals == 0, 1000, -np.log10(np.where(pvals == 0, 1, pvals)))
+
+        histogram = qq.QQHistogram()
+        if use_batches:
+            other = qq.QQHistogram()
+            histogram.add_batch(qvals[:5000])
+            other.add_batch(qvals[5000:])
+            histogram.merge(other)
+        else:
+            for qval in qvals.tolist():
+                histogram.add(qval)
+
+        exact = qq.compute_qq(np.sort(qvals)[::-1])
+        streaming = qq.compute_qq_streaming(histogram)
+        assert max(obs for _, obs in exact['bins']) == 3.0
+        assert streaming == exact
+
+    def test_sharded_summaries_match_single_pass(self, tmpdir):
+        # Sharding relies on the tabix index, so start from a freshly normalized file
+        norm_path = str(tmpdir / 'normalized.txt')
+        processors.normalize_contents(
+            SAMPLE_FILE,
+            {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False},
+            norm_path,
+            str(tmpdir / 'normalize.log'),
+        )
+        norm_path += '.gz'
+
+        best_row = processors.generate_summaries(norm_path, str(tmpdir / 'manhattan.json'), str(tmpdir / 'qq.json'))
+
+        shards = processors.get_summary_shards(norm_path)
+        assert len(shards) > 1, 'Sample file has several chromosomes'
+        partial_paths = []
+        for i, chrom in enumerate(shards):
+            partial_paths.append(str(tmpdir / 'partial_{}.pkl'.format(i)))
+            processors.summarize_shard(norm_path, chrom, partial_paths[-1])
+
+        merged_row = processors.merge_summaries(
+            partial_paths,
+            str(tmpdir / 'manhattan_merged.json'),
+            str(tmpdir / 'qq_merged.json'),
+        )
+        assert merged_row == best_row, 'Finds the same top hit'
+
+        expected = json.loads((tmpdir / 'manhattan.json').read())
+        actual = json.loads((tmpdir / 'manhattan_merged.json').read())
+        assert actual['variant_bins'] == expected['variant_bins'], 'Same manhattan bins'
+        # Variants with exactly equal pvalues may be listed in a different order
+        sort_key = lambda variant: (variant['pval'], variant['chrom'], variant['pos'])  # noqa: E731
+        assert sorted(actual['unbinned_variants'], key=sort_key) == sorted(expected['unbinned_variants'], key=sort_key)
+        assert (tmpdir / 'qq_merged.json').read() == (tmpdir / 'qq.json').read(), 'Same QQ data'
+
+    def test_sharded_normalize_matches_single_process(self, tmpdir):
+        parser_options = {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False}
+        expected_path = str(tmpdir / 'expected.txt')
+        processors.normalize_contents(SAMPLE_FILE, parser_options, expected_path, str(tmpdir / 'expected.log'))
+
+        shards = processors.get_normalize_shards(SAMPLE_FILE, 3, min_shard_size=500)
+        assert len(shards) == 3, 'Small shards are allowed, for testing purposes'
+        shard_paths = []
+        for i, (start, end) in enumerate(shards):
+            shard_paths.append(str(tmpdir / 'shard_{}.bgz'.format(i)))
+            processors.normalize_shard(SAMPLE_FILE, parser_options, start, end, shard_paths[-1])
+
+        actual_path = str(tmpdir / 'actual.txt')
+        status = processors.merge_normalized_shards(shard_paths, actual_path, str(tmpdir / 'actual.log'))
+        assert status is True
+
+        with gzip.open(expected_path + '.gz', 'rt') as expected, gzip.open(actual_path + '.gz', 'rt') as actual:
+            assert actual.read() == expected.read(), 'Normalized data is identical'
+        assert (tmpdir / 'actual.log').read() == (tmpdir / 'expected.log').read(), 'Log is identical'
+        assert os.path.isfile(actual_path + '.gz.tbi'), 'Merged file was tabix indexed'
+        assert not any(os.path.exists(path) for path in shard_paths), 'Shards were cleaned up'
+
+    def test_sharded_normalize_index_matches_zorp(self, tmpdir):
+        src_path, parser_options = _write_long_alleles(tmpdir)
+        shards = processors.get_normalize_shards(str(src_path), 3, min_shard_size=500)
+        assert len(shards) > 1
+        shard_paths = []
+        for i, (start, end) in enumerate(shards):
+            shard_paths.append(str(tmpdir / 'shard_{}.bgz'.format(i)))
+            processors.normalize_shard(str(src_path), parser_options, start, end, shard_paths[-1])
+        actual_path = str(tmpdir / 'actual.txt')
+        processors.merge_normalized_shards(shard_paths, actual_path, str(tmpdir / 'actual.log'))
+
+        _check_index_matches_zorp(tmpdir, actual_path + '.gz')
+
+    def test_threaded_normalize_index_matches_zorp(self, tmpdir):
+        src_path, parser_options = _write_long_alleles(tmpdir)
+        actual_path = str(tmpdir / 'actual.txt')
+        processors.normalize_contents(str(src_path), parser_options, actual_path, str(tmpdir / 'actual.log'), threads=3)
+        _check_index_matches_zorp(tmpdir, actual_path + '.gz')
+
+    def test_sharded_normalize_logs_bad_rows_like_single_process(self, tmpdir):
+        src_path = tmpdir / 'bad_rows.txt'
+        src_path.write('#chrom\tpos\tref\talt\tpvalue\n' + ''.join(
+            '1\t{}\tA\tC\t{}\n'.format(pos, 'oops' if pos % 10 == 0 else 0.5) for pos in range(1, 51)))
+        parser_options = {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False}
+        processors.normalize_contents(str(src_path), parser_options, str(tmpdir / 'expected.txt'),
+                                      str(tmpdir / 'expected.log'))
+
+        shards = processors.get_normalize_shards(str(src_path), 3, min_shard_size=100)
+        shard_paths = []
+        for i, (start, end) in enumerate(shards):
+            shard_paths.append(str(tmpdir / 'shard_{}.bgz'.format(i)))
+            processors.normalize_shard(str(src_path), parser_options, start, end, shard_paths[-1])
+        processors.merge_normalized_shards(shard_paths, str(tmpdir / 'actual.txt'), str(tmpdir / 'actual.log'))
+
+        log = (tmpdir / 'expected.log').read()
+        assert log.count('Excluded row') == 5
+        assert 'Row 11: 1\t10\tA\tC\toops' in log, 'Log shows examples of bad rows'
+        assert (tmpdir / 'actual.log').read() == log, 'Log is identical'
+
+    def test_sharded_normalize_validates_sort_order_between_shards(self, tmpdir):
+        src_path = tmpdir / 'unsorted.txt'
+        src_path.write('#chrom\tpos\tref\talt\tpvalue\n1\t2\tA\tC\t0.5\n1\t1\tA\tC\t0.5\n')
+        parser_options = {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False}
+        shard_paths = [str(tmpdir / 'shard_0.bgz'), str(tmpdir / 'shard_1.bgz')]
+        # Each shard is sorted, but the second starts before the end of the first
+        processors.normalize_shard(str(src_path), parser_options, 0, 38, shard_paths[0])
+        processors.normalize_shard(str(src_path), parser_options, 38, 50, shard_paths[1])
+
+        with pytest.raises(exceptions.ValidationException):
+            processors.merge_normalized_shards(shard_paths, str(tmpdir / 'merged.txt'), str(tmpdir / 'merged.log'))
+        assert not os.path.exists(str(tmpdir / 'merged.txt.gz')), 'No partial output is left behind'
+
+    def test_adopts_file_that_is_already_normalized(self, tmpdir):
+        # A normalized file (eg, downloaded from this site) is uploaded again
+        parser_options = {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': False}
+        processors.normalize_contents(SAMPLE_FILE, parser_options, str(tmpdir / 'upload.txt'), str(tmpdir / 'a.log'))
+        upload_path = str(tmpdir / 'upload.txt.gz')
+        with open(upload_path, 'rb') as f:
+            upload = f.read()
+
+        normalized_options = processors.NORMALIZED_PARSER_OPTIONS
+        assert processors.is_normalized(upload_path, normalized_options)
+        assert not processors.is_normalized(upload_path, parser_options), 'Options must read the file as-is'
+        assert not processors.is_normalized(SAMPLE_NORM, normalized_options), 'Must be BGZF, not just gzip'
+        assert not processors.is_normalized(SAMPLE_FILE, parser_options)
+
+        dest_path = str(tmpdir / 'normalized.txt')
+        assert processors.adopt_normalized(upload_path, normalized_options, dest_path, str(tmpdir / 'normalize.log'))
+        assert os.path.isfile(dest_path + '.gz.tbi'), 'Adopted file was tabix indexed'
+        assert processors.get_top_hit(dest_path + '.gz') == processors.get_top_hit(upload_path)
+        assert 'used without being converted' in (tmpdir / 'normalize.log').read()
+
+        # Normalizing again replaces the adopted file, instead of writing over the upload that it shares contents with
+        processors.normalize_contents(SAMPLE_FILE, parser_options, dest_path, str(tmpdir / 'normalize.log'))
+        with open(upload_path, 'rb') as f:
+            assert f.read() == upload, 'Upload is unchanged'
+
+    def test_does_not_adopt_unsorted_file(self, tmpdir):
+        upload_path = str(tmpdir / 'upload.txt.gz')
+        with bgzf.BgzfWriter(upload_path) as f:
+            f.write(processors.NORMALIZED_HEADER + '\n')
+            for chrom in ('1', '2', '1'):
+                f.write('{}\t1\tA\tC\t0.5\n'.format(chrom))
+
+        dest_path = str(tmpdir / 'normalized.txt')
+        adopted = processors.adopt_normalized(upload_path, processors.NORMALIZED_PARSER_OPTIONS, dest_path,
+                                              str(tmpdir / 'normalize.log'))
+        assert adopted is False, 'Chromosomes are not grouped, so the file can not be indexed'
+        assert not os.path.exists(dest_path + '.gz'), 'No partial output is left behind'
+
+    def test_does_not_adopt_file_with_bad_row_outside_sample(self, tmpdir):
+        # Many small blocks, so that the sample does not read all of them
+        upload_path = str(tmpdir / 'upload.txt.gz')
+        with open(upload_path, 'wb') as f:
+            f.write(bgzf.compress_block((processors.NORMALIZED_HEADER + '\n1\t1\tA\tC\t0.5\n').encode('utf-8')))
+            for pos in range(2, 201):
+                f.write(bgzf.compress_block('1\t{}\tA\tC\t{}\n'.format(pos, 'NA' if pos == 3 else 0.5).encode('utf-8')))
+            f.write(bgzf.EOF_BLOCK)
+        assert processors.is_normalized(upload_path, processors.NORMALIZED_PARSER_OPTIONS), 'Sample looks normalized'
+
+        dest_path = str(tmpdir / 'normalized.txt')
+        for threads in (1, 2):
+            adopted = processors.adopt_normalized(upload_path, processors.NORMALIZED_PARSER_OPTIONS, dest_path,
+                                                  str(tmpdir / 'normalize.log'), threads=threads)
+            assert adopted is False, 'Every row is checked'
+            assert not os.path.exists(dest_path + '.gz')
+
+    def test_link_or_copy_replaces_destination(self, tmpdir):
+        src_path, dest_path = tmpdir / 'source.json', tmpdir / 'dest.json'
+        src_path.write('new')
+        dest_path.write('old')
+        processors.link_or_copy(str(src_path), str(dest_path))
+        assert dest_path.read() == 'new'
+        assert os.path.samefile(str(src_path), str(dest_path)), 'Contents are shared, rather than copied'
@@ -0,0 +1,56 @@
+from util.ingest import progress
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressReporter:
+    def test_reports_are_throttled(self):
+        clock = FakeClock()
+        reports = []
+        reporter = progress.ProgressReporter(reports.append, min_interval=1.0, clock=clock)
+        reporter.start()
+        assert len(reports) == 1, 'Reports when the step starts'
+
+        reporter.add_rows(5000)
+        assert len(reports) == 1, 'Does not report again until the interval has passed'
+
+        clock.now = 2.0
+        reporter.add_rows(5000)
+        assert len(reports) == 2
+        assert reports[-1]['rows'] == 10_000
+        assert reports[-1]['rows_per_second'] == 5000
+
+        reporter.finish()
+        assert len(reports) == 3, 'The final stats are always reported'
+        assert reports[-1]['done'] is True
+
+    def test_estimates_time_remaining(self):
+        clock = FakeClock()
+        reports = []
+        bytes_read = 0
+        reporter = progress.ProgressReporter(reports.append, clock=clock)
+        reporter.start(total_bytes=1000, get_bytes_read=lambda: bytes_read)
+        assert reports[-1]['eta_seconds'] is None, 'No estimate before any data is read'
+
+        clock.now = 10.0
+        bytes_read = 250
+        reporter.update()
+        assert reports[-1]['bytes_read'] == 250
+        assert reports[-1]['eta_seconds'] == 30.0, 'A quarter of the file took 10 seconds'
+
+        reporter.finish()
+        assert reports[-1]['bytes_read'] == 1000
+        assert reports[-1]['eta_seconds'] == 0
+
+    def test_counts_rows_without_publishing(self):
+        reporter = progress.ProgressReporter()
+        reporter.start()
+        reporter.add_rows(10)
+        reporter.finish()
+        assert reporter.rows == 10
@@ -0,0 +1,27 @@
+from util.ingest import scheduling
+
+OPTIONS = {'heavy_threshold': 100 * 2 ** 20, 'fast_queue': 'fast', 'heavy_queue': 'heavy',
+           'seconds_per_gb': 600, 'minimum': 300, 'grace': 60}
+
+
+class TestTaskOptions:
+    def test_small_upload(self):
+        options = scheduling.get_task_options(10 * 2 ** 20, **OPTIONS)
+        assert options == {'queue': 'fast', 'soft_time_limit': 300, 'time_limit': 360}
+
+    def test_large_upload(self):
+        options = scheduling.get_task_options(5 * scheduling.GB, **OPTIONS)
+        assert options == {'queue': 'heavy', 'soft_time_limit': 3000, 'time_limit': 3060}
+
+    def test_threshold(self):
+        assert scheduling.get_task_options(OPTIONS['heavy_threshold'], **OPTIONS)['queue'] == 'fast'
+        assert scheduling.get_task_options(OPTIONS['heavy_threshold'] + 1, **OPTIONS)['queue'] == 'heavy'
+
+    def test_unknown_size(self):
+        options = scheduling.get_task_options(None, **OPTIONS)
+        assert options['queue'] == 'fast'
+        assert options['soft_time_limit'] == OPTIONS['minimum']
+
+    def test_time_limit_rounds_up(self):
+        soft, hard = scheduling.get_time_limits(scheduling.GB + 1, seconds_per_gb=1000, minimum=0, grace=0)
+        assert soft == hard == 1001
@@ -0,0 +1,66 @@
+import gzip
+import random
+
+import pytest
+
+from util.ingest import processors, sorting, synthetic
+
+
+@pytest.fixture
+def shuffled_file(tmpdir):
+    """A generated file (sorted), and a copy with the rows in random order"""
+    sorted_path = str(tmpdir / 'sorted.txt')
+    synthetic.generate_gwas(sorted_path, 3000, chromosomes=23, missing_pval_rate=0.01)
+    with open(sorted_path, 'r') as f:
+        header, *rows = f.readlines()
+    random.Random(1).shuffle(rows)
+
+    shuffled_path = str(tmpdir / 'shuffled.txt')
+    with open(shuffled_path, 'w') as f:
+        f.write(header)
+        f.writelines(rows)
+    return sorted_path, shuffled_path
+
+
+class TestSorting:
+    def test_detects_unsorted_files(self, shuffled_file):
+        sorted_path, shuffled_path = shuffled_file
+        assert sorting.is_sorted(sorted_path, synthetic.PARSER_OPTIONS)
+        assert not sorting.is_sorted(shuffled_path, synthetic.PARSER_OPTIONS)
+
+    def test_chromosomes_must_be_grouped(self, tmpdir):
+        src_path = tmpdir / 'ungrouped.txt'
+        src_path.write('#chrom\tpos\tref\talt\tpvalue\n1\t1\tA\tC\t0.5\n2\t1\tA\tC\t0.5\n1\t2\tA\tC\t0.5\n')
+        assert not sorting.is_sorted(str(src_path), synthetic.PARSER_OPTIONS)
+
+    def test_sorts_in_several_runs(self, tmpdir, shuffled_file, monkeypatch):
+        sorted_path, shuffled_path = shuffled_file
+        # Use a tiny memory budget, so that there are many runs, which are merged in more than one pass
+        monkeypatch.setattr(sorting, 'MAX_MERGE_FAN_IN', 4)
+        dest_path = str(tmpdir / 'result.txt.gz')
+        assert sorting.sort_gwas(shuffled_path, synthetic.PARSER_OPTIONS, dest_path, memory_budget=20_000,
+                                 scratch_dir=str(tmpdir))
+
+        with gzip.open(dest_path, 'rt') as result, open(sorted_path, 'r') as expected:
+            assert result.read() == expected.read(), 'Same rows as the original file, in the same order'
+        assert sorted(path.basename for path in tmpdir.listdir()) == ['result.txt.gz', 'shuffled.txt', 'sorted.txt'], \
+            'Temporary files are removed'
+
+    def test_chromosome_order(self, tmpdir):
+        src_path = tmpdir / 'unsorted.txt'
+        rows = ['X\t5', 'chr2\t1', '10\t1', 'Y\t1', '2\t3', 'MT\t1', '2\t2', 'chr2\t0', 'GL000192.1\t1', '1\t1']
+        src_path.write('#chrom\tpos\tref\talt\tpvalue\n' + ''.join(row + '\tA\tC\t0.5\n' for row in rows))
+        dest_path = str(tmpdir / 'sorted.txt.gz')
+        sorting.sort_gwas(str(src_path), synthetic.PARSER_OPTIONS, dest_path)
+
+        with gzip.open(dest_path, 'rt') as f:
+            assert [line.rsplit('\tA\tC', 1)[0] for line in f.read().splitlines()[1:]] == [
+                '1\t1', '2\t2', '2\t3', 'chr2\t0', 'chr2\t1', '10\t1', 'X\t5', 'Y\t1', 'MT\t1', 'GL000192.1\t1'
+            ]
+
+    def test_sorted_file_can_be_normalized(self, tmpdir, shuffled_file):
+        _, shuffled_path = shuffled_file
+        dest_path = str(tmpdir / 'result.txt.gz')
+        sorting.sort_gwas(shuffled_path, synthetic.PARSER_OPTIONS, dest_path, memory_budget=50_000)
+        assert processors.normalize_contents(dest_path, synthetic.PARSER_OPTIONS, str(tmpdir / 'normalized.txt'),
+                                             str(tmpdir / 'normalize.log'))
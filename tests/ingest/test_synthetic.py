@@ -0,0 +1,52 @@
+import gzip
+import os
+
+import pytest
+
+from util.ingest import processors, synthetic
+
+
+def _read_rows(path):
+    with gzip.open(path, 'rt') as f:
+        next(f)  # header
+        return [line.rstrip('\n').split('\t') for line in f]
+
+
+class TestSyntheticGwas:
+    def test_same_seed_gives_same_file(self, tmpdir):
+        paths = [str(tmpdir / name) for name in ('a.txt.gz', 'b.txt.gz', 'c.txt.gz')]
+        synthetic.generate_gwas(paths[0], 5000, seed=1)
+        synthetic.generate_gwas(paths[1], 5000, seed=1)
+        synthetic.generate_gwas(paths[2], 5000, seed=2)
+
+        contents = [open(path, 'rb').read() for path in paths]
+        assert contents[0] == contents[1]
+        assert contents[0] != contents[2]
+
+    def test_options(self, tmpdir):
+        path = str(tmpdir / 'options.txt.gz')
+        synthetic.generate_gwas(path, 20000, chromosomes=3, peaks_per_million=500,
+                                zero_pval_rate=0.01, missing_pval_rate=0.05, chunk_size=3000)
+        rows = _read_rows(path)
+
+        assert len(rows) == synthetic.read_gwas_rows(path) == 20000
+        assert [chrom for chrom in synthetic.CHROM_LENGTHS if any(row[0] == chrom for row in rows)] == ['1', '2', '3']
+        assert 0.03 < sum(row[4] == 'NA' for row in rows) / len(rows) < 0.07
+        assert 0.005 < sum(row[4] == '0' for row in rows) / len(rows) < 0.015
+        assert any(row[4] not in ('0', 'NA') and float(row[4]) < 5e-8 for row in rows), 'Peaks have significant hits'
+        assert all(ref != alt for _, _, ref, alt, _ in rows)
+
+        keys = [(int(chrom), int(pos)) for chrom, pos, *_ in rows]
+        assert keys == sorted(keys)
+
+    def test_invalid_chromosomes(self, tmpdir):
+        with pytest.raises(ValueError):
+            synthetic.generate_gwas(str(tmpdir / 'bad.txt'), 10, chromosomes=0)
+
+    def test_can_be_normalized(self, tmpdir):
+        src_path = str(tmpdir / 'synthetic.txt')
+        synthetic.generate_gwas(src_path, 5000, missing_pval_rate=0.01)
+        status = processors.normalize_contents(src_path, synthetic.PARSER_OPTIONS,
+                                               str(tmpdir / 'normalized.txt'), str(tmpdir / 'normalize.log'))
+        assert status is True
+        assert os.path.isfile(str(tmpdir / 'normalized.txt.gz.tbi'))
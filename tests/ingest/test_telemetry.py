@@ -0,0 +1,24 @@
+import os
+
+from util.ingest import progress, telemetry
+
+
+class TestStepTelemetry:
+    def test_measures_step(self, tmpdir):
+        with telemetry.StepTelemetry() as usage:
+            reporter = progress.ProgressReporter()
+            reporter.add_rows(25)
+            (tmpdir / 'out.txt').write('x' * 10_000)
+
+        result = usage.get_result()
+        assert result['rows'] == 25, 'Rows counted by progress reporters are included'
+        assert result['wall_seconds'] >= 0 and result['cpu_seconds'] >= 0
+        if os.path.isfile('/proc/self/io'):
+            assert result['bytes_written'] >= 10_000
+            assert result['peak_rss_bytes'] > 0
+
+    def test_rows_outside_step_are_not_counted(self):
+        progress.ProgressReporter().add_rows(10)
+        with telemetry.StepTelemetry() as usage:
+            pass
+        assert usage.get_result()['rows'] == 0
@@ -43,7 +43,6 @@ class TestStandardGwasValidator:
         with pytest.raises(val_exc.ValidationException):
             validators.standard_gwas_validator._validate_contents(reader)
 
-    @pytest.mark.skip
     def test_chroms_not_sorted(self):
         reader = readers.IterableReader([
             "#chrom\tpos\tref\talt\tpvalue",
@@ -52,7 +51,7 @@ class TestStandardGwasValidator:
             "1\t2\tA\tC\t7.3",
         ], parser=parsers.standard_gwas_parser, skip_rows=1)
 
-        with pytest.raises(val_exc.ValidationException):
+        with pytest.raises(val_exc.SortOrderException):
             validators.standard_gwas_validator._validate_contents(reader)
 
     def test_positions_not_sorted(self):
@@ -0,0 +1,145 @@
+"""
+Command line script to measure the speed of each ingest step on large, generated GWAS files, and compare it to a
+    saved baseline (from the same machine).
+
+usage:
+
+`python3 util/benchmark_ingest.py --rows 1000000 10000000 50000000 --workdir /tmp/lz-bench`
+
+Generated inputs are kept in the work directory, so that later runs do not need to create them again. Use `--save` to
+    record the results as the new baseline. The script exits with an error if any step is slower than the baseline by
+    more than `--tolerance`.
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import typing
+
+sys.path.append(str(Path(__file__).parent.parent.resolve()))
+
+from util.ingest import processors, synthetic, telemetry  # NOQA
+
+DEFAULT_BASELINE = str(Path(__file__).parent / 'benchmark_baseline.json')
+
+# Each step is given (input file, normalized file, work directory), and reads or writes files as the pipeline would
+STEPS: typing.Dict[str, typing.Callable[[str, str, str], typing.Any]] = {
+    'normalize': lambda src, normalized, workdir: processors.normalize_contents(
+        src, synthetic.PARSER_OPTIONS, normalized[:-len('.gz')], os.path.join(workdir, 'normalize.log')),
+    'summarize': lambda src, normalized, workdir: processors.generate_summaries(
+        normalized, os.path.join(workdir, 'manhattan.json'), os.path.join(workdir, 'qq.json')),
+    'manhattan': lambda src, normalized, workdir: processors.generate_manhattan(
+        normalized, os.path.join(workdir, 'manhattan.json')),
+    'qq': lambda src, normalized, workdir: processors.generate_qq(normalized, os.path.join(workdir, 'qq.json')),
+    'qq_streaming': lambda src, normalized, workdir: processors.generate_qq(
+        normalized, os.path.join(workdir, 'qq.json'), streaming=True),
+    'top_hit': lambda src, normalized, workdir: processors.get_top_hit(normalized),
+}
+
+
+def get_input(workdir: str, rows: int, seed: int) -> str:
+    """Generate an input file, or reuse one from a previous run"""
+    path = os.path.join(workdir, f'synthetic-{rows}-{seed}.txt.gz')
+    if not os.path.isfile(path):
+        print(f'Generating {rows:,} rows...')
+        partial_path = path + '.partial'
+        synthetic.generate_gwas(partial_path, rows, seed=seed)
+        os.rename(partial_path, path)
+    return path
+
+
+def run_step(name: str, rows: int, src_path: str, workdir: str) -> dict:
+    normalized_path = os.path.join(workdir, f'normalized-{rows}.txt.gz')
+    if name == 'normalize':
+        for fn in (normalized_path, normalized_path + '.tbi', os.path.join(workdir, 'normalize.log')):
+            if os.path.isfile(fn):
+                os.remove(fn)
+
+    with telemetry.StepTelemetry() as usage:
+        STEPS[name](src_path, normalized_path, workdir)
+    result = usage.get_result()
+    result['rows_per_second'] = round(rows / result['wall_seconds']) if result['wall_seconds'] else None
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> typing.List[str]:
+    """Find the steps that are slower than the baseline by more than `tolerance` (a fraction)"""
+    regressions = []
+    for rows, steps in results.items():
+        for name, result in steps.items():
+            expected = baseline.get(rows, {}).get(name, {}).get('rows_per_second')
+            if not expected or not result['rows_per_second']:
+                continue
+            change = result['rows_per_second'] / expected - 1
+            result['change'] = round(change, 3)
+            if change < -tolerance:
+                regressions.append(f'{name} ({int(rows):,} rows): {change:+.1%}')
+    return regressions
+
+
+def print_results(results: dict):
+    print(f'{"rows":>12}  {"step":<14}{"rows/sec":>12}{"wall (s)":>10}{"peak RSS (MB)":>15}{"vs baseline":>13}')
+    for rows, steps in results.items():
+        for name, result in steps.items():
+            peak = result['peak_rss_bytes']
+            change = result.get('change')
+            print('{:>12,}  {:<14}{:>12,}{:>10.1f}{:>15}{:>13}'.format(
+                int(rows), name, result['rows_per_second'] or 0, result['wall_seconds'],
+                f'{peak / 2 ** 20:.0f}' if peak else '-',
+                f'{change:+.1%}' if change is not None else '-'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure the speed of each ingest step')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 50_000_000],
+                        help='Size(s) of the generated input files')
+    parser.add_argument('--steps', nargs='+', choices=list(STEPS), default=list(STEPS),
+                        help='Steps to run (summary steps need the output of "normalize")')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated files')
+    parser.add_argument('--workdir', help='Where to keep generated files (default: a temporary directory)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the results to compare against')
+    parser.add_argument('--save', action='store_true', help='Save these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Report steps that are slower than the baseline by more than this fraction')
+    return parser.parse_args()
+
+
+def main(args) -> int:
+    results: typing.Dict[str, dict] = {}
+    for rows in args.rows:
+        src_path = get_input(args.workdir, rows, args.seed)
+        results[str(rows)] = {}
+        for name in args.steps:
+            print(f'Running {name} on {rows:,} rows...')
+            results[str(rows)][name] = run_step(name, rows, src_path, args.workdir)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    else:
+        print(f'No baseline found at {args.baseline}; run with --save to create one')
+    regressions = compare(results, baseline, args.tolerance)
+    print_results(results)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+
+    if regressions:
+        print('Slower than baseline:', *regressions, sep='\n  ')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        sys.exit(main(args))
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        sys.exit(main(args))
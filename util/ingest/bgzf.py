@@ -0,0 +1,270 @@
+"""
+Read and write BGZF files: gzip-compatible files made of small, independently compressed blocks, which tabix can index
+
+Unlike most compressed formats, BGZF files can be joined by simple concatenation. The only rule is that the EOF marker
+    block must appear once, at the very end of the combined file.
+
+Because blocks are independent, they can be (de)compressed by several threads at once. zlib releases the GIL while it
+    works, so this uses several cores.
+"""
+import collections
+import concurrent.futures
+import gzip
+import io
+import os
+import shutil
+import struct
+import typing as ty
+import zlib
+
+# Amount of uncompressed data per block (same as htslib), chosen so that a compressed block always fits in 64 KB
+MAX_BLOCK_SIZE = 0xff00
+
+# An empty block, which marks the end of a BGZF file
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# gzip header with the BGZF "extra" field; the last value is the total size of the block, minus 1
+_HEADER = struct.Struct('<4BI2BH2BHH')
+_FOOTER = struct.Struct('<II')
+
+# When using threads, how many blocks (per thread) to work on ahead of the current one
+_READ_AHEAD = 4
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """Compress (up to `MAX_BLOCK_SIZE` bytes of) data into a single BGZF block"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    if len(deflated) + _HEADER.size + _FOOTER.size > 2 ** 16:
+        # Data that does not compress well is stored as-is, to respect the maximum block size
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+
+    block_size = _HEADER.size + len(deflated) + _FOOTER.size
+    header = _HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, block_size - 1)
+    return header + deflated + _FOOTER.pack(zlib.crc32(data), len(data))
+
+
+def decompress_block(block: bytes) -> bytes:
+    """Decompress a single BGZF block (including header and footer)"""
+    data = zlib.decompress(block[_HEADER.size:-_FOOTER.size], -15)
+    crc, size = _FOOTER.unpack(block[-_FOOTER.size:])
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError('BGZF block is corrupt')
+    return data
+
+
+def _is_block_header(header: bytes) -> bool:
+    if len(header) < _HEADER.size:
+        return False
+    fields = _HEADER.unpack(header[:_HEADER.size])
+    # gzip magic numbers and FEXTRA flag, then a single "BC" extra subfield that holds the block size
+    return fields[:2] == (0x1f, 0x8b) and fields[3] & 4 and fields[7:11] == (6, 66, 67, 2)
+
+
+def is_bgzf(path: str) -> bool:
+    """Check whether a file is BGZF compressed (as opposed to plain text, or a regular gzip file)"""
+    with open(path, 'rb') as f:
+        return bool(_is_block_header(f.read(_HEADER.size)))
+
+
+def _read_blocks(f: ty.BinaryIO) -> ty.Iterator[bytes]:
+    while True:
+        header = f.read(_HEADER.size)
+        if not header:
+            return
+        if not _is_block_header(header):
+            raise ValueError('Not a valid BGZF block')
+        block_size = _HEADER.unpack(header)[-1] + 1
+        yield header + f.read(block_size - _HEADER.size)
+
+
+def _read_block_at(f: ty.BinaryIO, offset: int) -> ty.Optional[bytes]:
+    """The (decompressed) block that starts at `offset`, or None if there is no valid block there"""
+    f.seek(offset)
+    try:
+        return decompress_block(next(_read_blocks(f)))
+    except (StopIteration, ValueError, zlib.error):
+        return None
+
+
+def _find_block(f: ty.BinaryIO, offset: int) -> ty.Optional[ty.Tuple[int, bytes]]:
+    """Find the first block that starts at (or soon after) `offset`, and decompress it"""
+    f.seek(offset)
+    data = f.read(2 * MAX_BLOCK_SIZE)
+    start = data.find(EOF_BLOCK[:4])
+    while start != -1:
+        # The same bytes can appear inside compressed data, so a block only counts if it can be decompressed
+        if _is_block_header(data[start:start + _HEADER.size]):
+            block = _read_block_at(f, offset + start)
+            if block is not None:
+                return offset + start, block
+        start = data.find(EOF_BLOCK[:4], start + 1)
+    return None
+
+
+def sample_blocks(path: str, count: int) -> ty.Iterator[ty.Tuple[int, bytes]]:
+    """
+    Decompress `count` blocks, spread evenly through a BGZF file (always starting with the first one), to check what
+        the file contains without reading all of it. Yields `(offset, data)` for each block.
+    """
+    size = os.path.getsize(path)
+    seen = set()
+    with open(path, 'rb') as f:
+        for i in range(count):
+            found = _find_block(f, size * i // count)
+            if found is None:
+                if i == 0:
+                    raise ValueError('Not a valid BGZF file')
+                continue
+            if found[0] not in seen:
+                seen.add(found[0])
+                yield found
+
+
+def _in_order(executor: concurrent.futures.Executor, func, items: ty.Iterable, window: int) -> ty.Iterator:
+    """Like `executor.map`, but only submits `window` items at a time, so that memory use stays bounded"""
+    pending: ty.Deque[concurrent.futures.Future] = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _iter_decompressed(f: ty.BinaryIO, threads: int) -> ty.Iterator[bytes]:
+    if threads <= 1:
+        yield from map(decompress_block, _read_blocks(f))
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        yield from _in_order(executor, decompress_block, _read_blocks(f), threads * _READ_AHEAD)
+
+
+def iter_decompressed(path: str, *, threads: int = 1) -> ty.Iterator[bytes]:
+    """The uncompressed contents of a BGZF file, one block at a time. Blocks are read ahead when using threads."""
+    with open(path, 'rb') as f:
+        yield from _iter_decompressed(f, threads)
+
+
+class _BlockStream(io.RawIOBase):
+    """File-like view of decompressed blocks"""
+    def __init__(self, blocks: ty.Iterator[bytes]):
+        self._blocks = blocks
+        self._current = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._current:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._current = memoryview(block)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self):
+        close = getattr(self._blocks, 'close', None)
+        if close:
+            close()
+        super().close()
+
+
+def open_text(path: str, *, threads: int = 1) -> ty.TextIO:
+    """
+    Open a gzip (or BGZF) file as text. BGZF files are decompressed by several threads, if requested.
+    """
+    if threads <= 1 or not is_bgzf(path):
+        return gzip.open(path, 'rt')
+    stream = _BlockStream(iter_decompressed(path, threads=threads))
+    return io.TextIOWrapper(io.BufferedReader(stream, buffer_size=MAX_BLOCK_SIZE), encoding='utf-8')
+
+
+def wrap_text(f: ty.BinaryIO, *, threads: int = 1) -> ty.TextIO:
+    """
+    Like `open_text`, for a file that is already open (in binary mode). Closing the result does not close `f`, so the
+        caller can check its position (eg, to see how much of the file has been read).
+    """
+    if threads <= 1 or not _is_block_header(f.peek(_HEADER.size)):
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=f, mode='rb'))
+    stream = _BlockStream(_iter_decompressed(f, threads))
+    return io.TextIOWrapper(io.BufferedReader(stream, buffer_size=MAX_BLOCK_SIZE), encoding='utf-8')
+
+
+class BgzfWriter:
+    """
+    Write text to a BGZF file, one block at a time. With `threads`, several blocks are compressed at once.
+
+    Set `write_eof=False` to create part of a file, which will be concatenated with others later.
+    """
+    def __init__(self, path: str, *, level: int = 6, write_eof: bool = True, threads: int = 1):
+        self._file = open(path, 'wb')
+        self._level = level
+        self._write_eof = write_eof
+        self._buffer = bytearray()
+
+        self._threads = threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads) if threads > 1 else None
+        self._pending: ty.Deque[concurrent.futures.Future] = collections.deque()
+
+    def write(self, text: str):
+        self._buffer += text.encode('utf-8')
+        if len(self._buffer) >= MAX_BLOCK_SIZE:
+            num_full = len(self._buffer) // MAX_BLOCK_SIZE * MAX_BLOCK_SIZE
+            for start in range(0, num_full, MAX_BLOCK_SIZE):
+                self._write_block(bytes(self._buffer[start:start + MAX_BLOCK_SIZE]))
+            del self._buffer[:num_full]
+
+    def _write_block(self, data: bytes):
+        if self._executor is None:
+            self._file.write(compress_block(data, self._level))
+            return
+
+        # Blocks are compressed in parallel, but must be written in order
+        self._pending.append(self._executor.submit(compress_block, data, self._level))
+        while len(self._pending) >= self._threads * _READ_AHEAD or (self._pending and self._pending[0].done()):
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self._buffer:
+                self._write_block(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+            if self._write_eof:
+                self._file.write(EOF_BLOCK)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def concatenate(source_paths: ty.Iterable[str], dest_path: str):
+    """Join several BGZF files (or file parts) into one, with a single EOF marker at the end"""
+    with open(dest_path, 'w+b') as dest:
+        for path in source_paths:
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, dest)
+
+            # Remove an EOF block that was copied from the middle of the output
+            end = dest.tell()
+            if end >= len(EOF_BLOCK):
+                dest.seek(end - len(EOF_BLOCK))
+                if dest.read(len(EOF_BLOCK)) == EOF_BLOCK:
+                    dest.truncate(end - len(EOF_BLOCK))
+                dest.seek(0, 2)
+        dest.write(EOF_BLOCK)
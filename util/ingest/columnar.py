@@ -0,0 +1,161 @@
+"""
+Read normalized GWAS files in column-oriented batches, so that summary steps can process many rows per call with
+    NumPy (instead of paying per-row parsing and object creation costs).
+
+Only the normalized file format (as written by `processors.normalize_contents`) is supported.
+"""
+import itertools
+import math
+import os
+import typing as ty
+
+import numpy as np
+import pysam
+from zorp import parsers
+
+from . import bgzf, progress
+
+# Rows per batch. Parsing a batch temporarily uses ~0.7 KB per row, mostly for the split text fields
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Column order used by the normalized file, if no header row is present
+_DEFAULT_COLUMNS = ('chrom', 'pos', 'ref', 'alt', 'neg_log_pvalue')
+
+
+class VariantBatch:
+    """
+    A group of consecutive rows, stored as columns
+
+    - `chrom`: int16 codes; use `chrom_names[code]` to get the chromosome name
+    - `pos`: int64
+    - `neg_log_pvalue`: float64, NaN if missing
+    - `pval`: float64 (NaN if missing). p=0 for "infinitely significant" rows, as well as for any value too small to be
+        represented as a float; this matches the parser. Other values may differ from the parser in the last bit, so
+        code that requires exact agreement with the row-based readers should use `neg_log_pvalue` or `get_variant`.
+    """
+    __slots__ = ('chrom_names', 'chrom', 'pos', 'neg_log_pvalue', 'pval', '_lines')
+
+    def __init__(self, chrom_names: ty.List[str], chrom: np.ndarray, pos: np.ndarray, neg_log_pvalue: np.ndarray,
+                 pval: np.ndarray, lines: ty.List[str]):
+        self.chrom_names = chrom_names
+        self.chrom = chrom
+        self.pos = pos
+        self.neg_log_pvalue = neg_log_pvalue
+        self.pval = pval
+        self._lines = lines
+
+    def __len__(self):
+        return len(self.pos)
+
+    def get_variant(self, index: int) -> parsers._basic_standard_container:
+        """
+        Get a single row, parsed exactly as the row-based readers would. Useful for the (few) rows that need to be
+            reported in full.
+        """
+        return parsers.standard_gwas_parser(self._lines[index].rstrip('\n'))
+
+
+def _parse_floats(values: ty.Sequence[str]) -> np.ndarray:
+    try:
+        return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+    except ValueError:
+        # Missing values are written as `.`, and are rare enough to handle separately
+        return np.array([math.nan if v == '.' else float(v) for v in values], dtype=np.float64)
+
+
+def _get_pvals(neg_log_pvalue: np.ndarray) -> np.ndarray:
+    with np.errstate(under='ignore'):
+        pval = np.power(10.0, -neg_log_pvalue)
+
+    # Make sure that p=0 (as the parser would calculate it) is represented exactly
+    for i in np.flatnonzero(neg_log_pvalue > 300):
+        pval[i] = 10 ** -float(neg_log_pvalue[i])
+    return pval
+
+
+def _get_columns(header: str) -> ty.Tuple[str, ...]:
+    if header.startswith('#'):
+        return tuple(header[1:].rstrip('\n').split('\t'))
+    return _DEFAULT_COLUMNS
+
+
+def read_batches(filename: str, *, chunk_size: int = DEFAULT_CHUNK_SIZE, chrom: str = None,
+                 skip_missing: bool = True, threads: int = 1,
+                 reporter: progress.ProgressReporter = None) -> ty.Iterator[VariantBatch]:
+    """
+    Read a normalized GWAS file in batches of (up to) `chunk_size` rows
+
+    :param filename: Path to a normalized GWAS file
+    :param chunk_size: The max number of rows in each batch
+    :param chrom: Only read rows for this chromosome, using the tabix index
+    :param skip_missing: Exclude rows with no pvalue (like `add_filter('neg_log_pvalue', ...)` in summary steps)
+    :param threads: Decompress the file using several threads (when reading the whole file)
+    :param reporter: Start timing progress (and, when reading the whole file, track how much has been read)
+    """
+    if chrom is None:
+        with open(filename, 'rb') as raw, bgzf.wrap_text(raw, threads=threads) as f:
+            if reporter is not None:
+                reporter.start(total_bytes=os.path.getsize(filename), get_bytes_read=raw.tell)
+            first = f.readline()
+            columns = _get_columns(first)
+            lines = f if first.startswith('#') else itertools.chain([first], f)
+            yield from _read_chunks(lines, columns, chunk_size, skip_missing)
+    else:
+        with pysam.TabixFile(filename) as tabix:
+            if reporter is not None:
+                reporter.start()
+            header = list(tabix.header)
+            columns = _get_columns(header[-1] if header else '')
+            if chrom in tabix.contigs:
+                lines = (line + '\n' for line in tabix.fetch(chrom))
+                yield from _read_chunks(lines, columns, chunk_size, skip_missing)
+
+
+def get_chromosomes(filename: str) -> ty.List[str]:
+    """The chromosomes in a (tabix-indexed) normalized file, in the order that they appear in the file"""
+    with pysam.TabixFile(filename) as tabix:
+        return list(tabix.contigs)
+
+
+def _read_chunks(lines_iter: ty.Iterable[str], columns: ty.Sequence[str], chunk_size: int,
+                 skip_missing: bool) -> ty.Iterator[VariantBatch]:
+    chrom_names: ty.List[str] = []
+    chrom_codes: ty.Dict[str, int] = {}
+
+    num_columns = len(columns)
+    chrom_col = columns.index('chrom')
+    pos_col = columns.index('pos')
+    pval_col = columns.index('neg_log_pvalue')
+
+    while True:
+        lines = list(itertools.islice(lines_iter, chunk_size))
+        if not lines:
+            break
+
+        # Splitting one big string is much faster than splitting each line; every row has the same column count
+        text = ''.join(lines)
+        if not text.endswith('\n'):
+            text += '\n'
+        fields = text.replace('\n', '\t').split('\t')[:-1]
+        if len(fields) != len(lines) * num_columns:
+            raise ValueError('Normalized file has an unexpected number of columns')
+
+        chroms = fields[chrom_col::num_columns]
+        for name in dict.fromkeys(chroms):  # New chromosomes get codes in order of appearance
+            if name not in chrom_codes:
+                chrom_codes[name] = len(chrom_names)
+                chrom_names.append(name)
+
+        chrom = np.fromiter(map(chrom_codes.__getitem__, chroms), dtype=np.int16, count=len(chroms))
+        pos = np.fromiter(map(int, fields[pos_col::num_columns]), dtype=np.int64, count=len(chroms))
+        neg_log_pvalue = _parse_floats(fields[pval_col::num_columns])
+
+        if skip_missing:
+            has_pval = ~np.isnan(neg_log_pvalue)
+            if not has_pval.all():
+                chrom = chrom[has_pval]
+                pos = pos[has_pval]
+                neg_log_pvalue = neg_log_pvalue[has_pval]
+                lines = list(itertools.compress(lines, has_pval))
+
+        yield VariantBatch(chrom_names, chrom, pos, neg_log_pvalue, _get_pvals(neg_log_pvalue), lines)
@@ -0,0 +1,128 @@
+"""
+Record the rows that could not be parsed, without keeping every error in memory
+
+zorp readers append each parse error to a list (`reader.errors`); a badly formatted file can produce millions of them.
+    An `ErrorLog` takes the place of that list: errors are written to the log as they are found, and only counts (by
+    category) plus a few example lines are kept.
+"""
+import collections
+import typing as ty
+
+# Errors listed individually in the log; after this, errors are only counted
+MAX_LOGGED = 1000
+# Rows whose full text is kept (and written at the end of the log), to show what the bad rows look like
+MAX_EXAMPLES = 10
+# Errors with more distinct categories than this are counted together
+MAX_CATEGORIES = 50
+OTHER_CATEGORY = 'other'
+
+
+def get_category(reason: str) -> str:
+    """
+    Group similar errors, eg all the rows where a value is not a number. Error messages generally describe the problem
+        first, and then the value that caused it.
+    """
+    return reason.split(':', 1)[0].strip()
+
+
+class ErrorLog:
+    """
+    Parse errors for one file, in the format used by zorp readers: `(row number, reason, line)`
+
+    If a log file is given, each error is written to it immediately; otherwise (eg, for one shard of a file, which is
+        logged later) the first `max_logged` errors are kept, and can be saved with `to_dict`.
+
+    `len()` counts every error, so that zorp still stops reading after `max_errors`. Iterating returns only examples.
+    """
+    def __init__(self, log_file: ty.TextIO = None, *, max_logged: int = MAX_LOGGED, max_examples: int = MAX_EXAMPLES):
+        self._file = log_file
+        self._max_logged = max_logged
+        self._max_examples = max_examples
+
+        self.counts: ty.Counter[str] = collections.Counter()
+        self.examples: ty.List[ty.Tuple[int, str, str]] = []
+        self.logged: ty.List[ty.Tuple[int, str]] = []
+        self._count = 0
+        self._num_logged = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self) -> ty.Iterator[ty.Tuple[int, str, str]]:
+        return iter(self.examples)
+
+    def append(self, error: ty.Tuple[int, str, str]):
+        n, reason, line = error
+        self.add(n, reason, line)
+
+    def add(self, n: int, reason: str, line: str = None):
+        self._add_count(get_category(reason), 1)
+        if line is not None and len(self.examples) < self._max_examples:
+            self.examples.append((n, reason, line))
+
+        if self._num_logged < self._max_logged:
+            self._num_logged += 1
+            if self._file is None:
+                self.logged.append((n, reason))
+            else:
+                self._file.write('Excluded row {} from output due to parse error: {}\n'.format(n, reason))
+        else:
+            self._stop_listing()
+
+    def _stop_listing(self):
+        if self._num_logged == self._max_logged:
+            self._num_logged += 1
+            if self._file is not None:
+                self._file.write('Further parse errors are not listed; see the counts below.\n')
+
+    def _add_count(self, category: str, count: int):
+        if category not in self.counts and len(self.counts) >= MAX_CATEGORIES:
+            category = OTHER_CATEGORY
+        self.counts[category] += count
+        self._count += count
+
+    def to_dict(self) -> dict:
+        """The errors that were kept (for a log with no file), in a form that can be saved as JSON"""
+        return {'logged': self.logged, 'counts': dict(self.counts), 'examples': self.examples}
+
+    def merge(self, other: dict, *, line_offset: int = 0, limit: int = None):
+        """
+        Add the errors (from `to_dict`) for a later part of the same file, as though they had been found while reading
+            the whole file. Stops after `limit` errors in total. (If that limit falls among errors that were only
+            counted, the total is still exact, but the counts by category may not be.)
+
+        :param other: Errors for a part of the file
+        :param line_offset: The number of lines before this part of the file
+        :param limit: The most errors to record in total (eg, the `max_errors` allowed by the reader)
+        """
+        # Examples are the first errors in that part of the file, so the i-th example is the i-th error
+        for i, (n, reason, line) in enumerate(other['examples']):
+            if len(self.examples) >= self._max_examples or (limit is not None and self._count + i >= limit):
+                break
+            self.examples.append((line_offset + n, reason, line))
+
+        for n, reason in other['logged']:
+            if limit is not None and self._count >= limit:
+                return
+            self.add(line_offset + n, reason)
+
+        # Any errors beyond the ones listed were only counted
+        unlisted = collections.Counter(other['counts'])
+        unlisted.subtract(get_category(reason) for _, reason in other['logged'])
+        for category, count in unlisted.items():
+            if limit is not None:
+                count = min(count, limit - self._count)
+            if count > 0:
+                self._add_count(category, count)
+                self._stop_listing()
+
+    def write_summary(self):
+        """Finish the log with the number of errors in each category, and some example rows"""
+        if self._file is None or not self._count:
+            return
+        self._file.write('Parse errors by category:\n')
+        for category, count in self.counts.most_common():
+            self._file.write('    {}: {}\n'.format(category, count))
+        self._file.write('Example rows:\n')
+        for n, _, line in self.examples:
+            self._file.write('    Row {}: {}\n'.format(n, line))
@@ -22,6 +22,11 @@ class ValidationException(BaseIngestException):
     DEFAULT_MESSAGE = 'Validation failed'
 
 
+class SortOrderException(ValidationException):
+    """The rows are valid, but out of order (they could be sorted; see `util.ingest.sorting`)"""
+    DEFAULT_MESSAGE = 'Positions must be sorted prior to uploading'
+
+
 class ManhattanExeption(BaseIngestException):
     DEFAULT_MESSAGE = 'Could not generate Manhattan plot'
 
@@ -3,9 +3,13 @@ Generic helper methods
 """
 
 import functools
+import io
 import logging
+import typing as ty
 
-from . import exceptions
+from zorp import readers, sniffers
+
+from . import bgzf, errorlog, exceptions
 
 logger = logging.getLogger(__name__)
 
@@ -28,3 +32,76 @@ def capture_errors(func):
             logger.exception('Task failed due to unexpected error')
             raise exceptions.UnexpectedIngestException
     return wrapper
+
+
+class _ErrorLogReader(readers.IterableReader):
+    """Read lines from an iterable, and record parse errors in an `errorlog.ErrorLog` (instead of a list)"""
+    def __init__(self, *args, error_log: errorlog.ErrorLog, **kwargs):
+        self._error_log = error_log
+        super().__init__(*args, **kwargs)
+
+    @property
+    def errors(self) -> errorlog.ErrorLog:
+        return self._error_log
+
+    @errors.setter
+    def errors(self, value):
+        # zorp resets the errors to an empty list before it reads; the log is only used for one read
+        pass
+
+
+def make_line_reader(filename: str, parser, lines: ty.Iterable[str], *, has_headers: bool = True,
+                     error_log: errorlog.ErrorLog = None) -> readers.BaseReader:
+    """
+    Read lines that come from some other source, with the same settings that zorp would use to read `filename`
+
+    This lets part of a file (or a file that is decompressed in some other way) be treated just like the whole file.
+        Parse errors are recorded in `error_log`, if given.
+    """
+    sniffed = sniffers.guess_gwas(filename, parser=parser)
+    options = {
+        'parser': parser,
+        'skip_rows': sniffed._skip_rows if has_headers else 0,
+        'skip_errors': sniffed._skip_errors,
+        'max_errors': sniffed._max_errors,
+    }
+    if error_log is None:
+        return readers.IterableReader(lines, **options)
+    return _ErrorLogReader(lines, error_log=error_log, **options)
+
+
+class SourceLines:
+    """
+    The lines of a text file, which may be (b)gzip compressed, without line endings. These can be passed to
+        `make_line_reader`.
+
+    As the file is read, `bytes_read` tracks how much of the (compressed) file has been used, for progress reports.
+    """
+    def __init__(self, path: str, *, threads: int = 1):
+        self._path = path
+        self._threads = threads
+        self._raw: ty.Optional[ty.BinaryIO] = None
+
+    @property
+    def bytes_read(self) -> int:
+        if self._raw is None or self._raw.closed:
+            return 0
+        return self._raw.tell()
+
+    def __iter__(self) -> ty.Iterator[str]:
+        with open(self._path, 'rb') as raw:
+            self._raw = raw
+            if raw.peek(2)[:2] == b'\x1f\x8b':
+                f = bgzf.wrap_text(raw, threads=self._threads)
+            else:
+                f = io.TextIOWrapper(raw)
+            with f:
+                for line in f:
+                    yield line.rstrip('\n')
+
+
+def guess_gwas(filename: str, parser, *, threads: int = 1) -> readers.BaseReader:
+    """Like `sniffers.guess_gwas`, but BGZF-compressed files can be decompressed by several threads"""
+    if threads > 1 and bgzf.is_bgzf(filename):
+        return make_line_reader(filename, parser, SourceLines(filename, threads=threads))
+    return sniffers.guess_gwas(filename, parser=parser)
@@ -16,8 +16,11 @@ import collections
 import heapq
 import logging
 
+import numpy as np
 from zorp.parsers import _basic_standard_container
 
+from .columnar import VariantBatch
+
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,10 @@ class MaxPriorityQueue:
     def __len__(self):
         return len(self._q)
 
+    def max_priority(self):
+        """The priority of the item that `.pop()` would return"""
+        return -self._q[0][0]
+
     def pop_all(self):
         while self._q:
             yield self.pop()
@@ -199,3 +206,191 @@ class Binner:
             else:
                 rv_qval_extents.append([start, end])
         return (rv_qvals, rv_qval_extents)
+
+
+class CompactBinner(Binner):
+    """
+    Manhattan plot binner that produces the same output as `Binner`, with much less work per row
+
+    Variants are kept as the (immutable) parsed rows, and only converted to dicts if they appear in the final output.
+
+    `process_batch` accepts column batches (see `columnar.read_batches`). Most rows in a GWAS are neither part of a
+        peak, nor stronger than the weakest unbinned variant kept so far; those rows would be binned immediately,
+        without changing any other state, so they are binned all at once with NumPy. The remaining rows go through the
+        usual one-row-at-a-time logic, in file order, so that ties are broken exactly as in `Binner`.
+
+    Binners can be pickled and combined with `merge`, so that different chromosomes can be summarized separately. A
+        merged result can differ from a single pass in two minor ways: the choice and order of unbinned variants with
+        exactly equal pvalues, and the qval bin size used to round variants that are binned during the merge.
+    """
+    # The cutoff for the fast path is set at the start of each chunk of rows. Chunks start small and grow, so that the
+    #   cutoff tightens quickly while the list of unbinned variants is still filling up.
+    _MIN_CHUNK_SIZE = 1024
+
+    # The bin size set by `Binner.__init__`. Once the bin size changes, it never goes back to this value.
+    _INITIAL_QVAL_BIN_SIZE = 0.05
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._bins = {}  # like {<chrom>: {<pos // bin_length>: {rounded qvals}}}
+
+    def process_variant(self, variant: _basic_standard_container):
+        """Same as `Binner.process_variant`, but reads fields from the parsed row instead of making a dict"""
+        pvalue = variant.pvalue
+
+        if pvalue != 0:
+            qval = variant.neg_log_pvalue
+            if qval > 40:
+                self._qval_bin_size = 0.2
+            elif qval > 20:
+                self._qval_bin_size = 0.1
+
+        if pvalue < self._peak_pval_threshold:  # part of a peak
+            if self._peak_best_variant is None:  # open a new peak
+                self._peak_best_variant = variant
+                self._peak_last_chrpos = (variant.chrom, variant.pos)
+            elif (self._peak_last_chrpos[0] == variant.chrom
+                  and self._peak_last_chrpos[1] + self._peak_sprawl_dist > variant.pos):  # extend current peak
+                self._peak_last_chrpos = (variant.chrom, variant.pos)
+                if pvalue >= self._peak_best_variant.pvalue:
+                    self._maybe_bin_variant(variant)
+                else:
+                    self._maybe_bin_variant(self._peak_best_variant)
+                    self._peak_best_variant = variant
+            else:  # close old peak and open new peak
+                self._maybe_peak_variant(self._peak_best_variant)
+                self._peak_best_variant = variant
+                self._peak_last_chrpos = (variant.chrom, variant.pos)
+        else:
+            self._maybe_bin_variant(variant)
+
+    def process_batch(self, batch: VariantBatch):
+        """Process a batch of rows; the result is the same as calling `process_variant` on each row, in order"""
+        size = len(batch)
+        if not size:
+            return
+
+        bin_sizes = self._get_qval_bin_sizes(batch)
+        # Batch pvalues may differ from the parser's in the last bit; rows that are too close to call use the slow path
+        pval = batch.pval / (1 + 1e-9)
+
+        start = 0
+        chunk_size = self._MIN_CHUNK_SIZE
+        while start < size:
+            end = min(start + chunk_size, size)
+            if len(self._unbinned_variant_pq) < self._num_unbinned:
+                cutoff = np.inf
+            else:
+                cutoff = max(self._unbinned_variant_pq.max_priority(), self._peak_pval_threshold)
+
+            is_fast = pval[start:end] >= cutoff
+            fast_rows = np.flatnonzero(is_fast) + start
+            if len(fast_rows):
+                self._bin_batch(batch, fast_rows, bin_sizes[fast_rows])
+
+            for i in np.flatnonzero(~is_fast) + start:
+                # Restore the bin size in effect for this row, as though every row had been processed in order
+                self._qval_bin_size = float(bin_sizes[i])
+                self.process_variant(batch.get_variant(i))
+
+            start = end
+            chunk_size *= 2
+
+        self._qval_bin_size = float(bin_sizes[-1])
+
+    def merge(self, other: 'CompactBinner'):
+        """
+        Combine with a binner that processed the rows after this one (eg, the next chromosome in the file).
+            `other` should not be used afterwards.
+
+        A peak cannot continue from one binner to the next, so shards should not split a chromosome.
+        """
+        if self._peak_best_variant is not None:
+            self._maybe_peak_variant(self._peak_best_variant)
+        self._peak_best_variant = other._peak_best_variant
+        self._peak_last_chrpos = other._peak_last_chrpos
+
+        if other._qval_bin_size != self._INITIAL_QVAL_BIN_SIZE:
+            # The most recent change wins, just as it would in a single pass
+            self._qval_bin_size = other._qval_bin_size
+
+        for variant in other._peak_pq.pop_all():
+            self._maybe_peak_variant(variant)
+        for variant in other._unbinned_variant_pq.pop_all():
+            self._maybe_bin_variant(variant)
+
+        for chrom, chrom_bins in other._bins.items():
+            own_bins = self._bins.setdefault(chrom, {})
+            for pos_bin_id, qvals in chrom_bins.items():
+                own_bins.setdefault(pos_bin_id, set()).update(qvals)
+
+    def _get_qval_bin_sizes(self, batch: VariantBatch) -> np.ndarray:
+        """The value of `_qval_bin_size` after each row in the batch has been processed"""
+        qval = batch.neg_log_pvalue
+        changes = (batch.pval != 0) & (qval > 20)
+        new_sizes = np.where(qval > 40, 0.2, 0.1)
+
+        last_change = np.where(changes, np.arange(len(qval)), -1)
+        np.maximum.accumulate(last_change, out=last_change)
+        return np.where(last_change >= 0, new_sizes[last_change], self._qval_bin_size)
+
+    def _bin_batch(self, batch: VariantBatch, rows: np.ndarray, bin_sizes: np.ndarray):
+        """Bin many rows at once; each row uses the corresponding qval bin size"""
+        qval = batch.neg_log_pvalue[rows]
+        unrounded = qval // bin_sizes * bin_sizes + bin_sizes / 2
+        unique_unrounded, qval_codes = np.unique(unrounded, return_inverse=True)
+        # Python and NumPy round differently, so use the same function as `_rounded`
+        rounded = [round(value, 3) for value in unique_unrounded.tolist()]
+
+        pos_bin_ids = batch.pos[rows] // self._bin_length
+        min_pos_bin = pos_bin_ids.min()
+        num_pos_bins = pos_bin_ids.max() - min_pos_bin + 1
+
+        # Each (chrom, position bin, qval) combination only needs to be added once
+        locations = batch.chrom[rows].astype(np.int64) * num_pos_bins + (pos_bin_ids - min_pos_bin)
+        keys = locations * len(rounded) + qval_codes
+        for key in np.unique(keys).tolist():
+            location, qval_code = divmod(key, len(rounded))
+            chrom_code, pos_bin_offset = divmod(location, int(num_pos_bins))
+            chrom_bins = self._bins.setdefault(batch.chrom_names[chrom_code], {})
+            chrom_bins.setdefault(int(min_pos_bin) + pos_bin_offset, set()).add(rounded[qval_code])
+
+    def _maybe_peak_variant(self, variant: _basic_standard_container):
+        self._peak_pq.add_and_keep_size(variant, variant.pvalue,
+                                        size=self._peak_max_count,
+                                        popped_callback=self._maybe_bin_variant)
+
+    def _maybe_bin_variant(self, variant: _basic_standard_container):
+        self._unbinned_variant_pq.add_and_keep_size(variant, variant.pvalue,
+                                                    size=self._num_unbinned,
+                                                    popped_callback=self._bin_variant)
+
+    def _bin_variant(self, variant: _basic_standard_container):
+        chrom_bins = self._bins.setdefault(variant.chrom, {})
+        chrom_bins.setdefault(variant.pos // self._bin_length, set()).add(self._rounded(variant.neg_log_pvalue))
+
+    def get_result(self):
+        self.get_result = None  # this can only be called once
+
+        if self._peak_best_variant is not None:
+            self._maybe_peak_variant(self._peak_best_variant)
+
+        peaks = [dict(variant.to_dict(), peak=True) for variant in self._peak_pq.pop_all()]
+        unbinned_variants = [variant.to_dict() for variant in self._unbinned_variant_pq.pop_all()]
+        unbinned_variants = sorted(unbinned_variants + peaks, key=(lambda variant: variant['pval']))
+
+        variant_bins = []
+        for chrom in sorted(self._bins.keys()):
+            for pos_bin_id in sorted(self._bins[chrom].keys()):
+                qvals, qval_extents = self._get_qvals_and_qval_extents(self._bins[chrom][pos_bin_id])
+                variant_bins.append({
+                    'chrom': chrom,
+                    'qvals': qvals,
+                    'qval_extents': qval_extents,
+                    'pos': int(pos_bin_id * self._bin_length + self._bin_length / 2),
+                })
+
+        return {
+            'variant_bins': variant_bins,
+            'unbinned_variants': unbinned_variants,
+        }
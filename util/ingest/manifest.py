@@ -0,0 +1,124 @@
+"""
+Step manifests: a record, saved next to the outputs of an ingest step, of what was used to create them
+
+When the pipeline is re-run, a step can be skipped if its manifest shows that the inputs, options, and code version
+    are unchanged, and that the outputs are still what the step wrote.
+
+Outputs are identified by their size and modification time, rather than a hash of their contents: outputs can be
+    many GB, and checking them should not cost a full read of each file. (Outputs are never edited in place; see
+    `clear`.)
+"""
+import json
+import os
+import typing as ty
+
+# The version of the code used by each step. Bump this when a change to a step would alter its output, so that existing
+#   results are regenerated on the next re-run.
+STEP_VERSIONS = {
+    'normalize': 1,
+    'summarize': 1,
+}
+
+
+def _file_stamp(path: str) -> str:
+    stat = os.stat(path)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def _as_json(value):
+    # Compare options as they would be read back from the manifest (eg, tuples become lists)
+    return json.loads(json.dumps(value))
+
+
+def _save(manifest_path: str, manifest: dict):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def write(manifest_path: str, step: str, input_digest: ty.Optional[str], options: dict,
+          output_paths: ty.Iterable[str]):
+    """
+    Record that `step` completed successfully. Call only after all of its outputs are written.
+
+    If the input digest is not known yet (eg, it is still being calculated), it can be added later with `set_input`;
+        until then, the step is never current.
+    """
+    _save(manifest_path, {
+        'step': step,
+        'version': STEP_VERSIONS[step],
+        'input_sha256': input_digest,
+        'options': options,
+        'outputs': {os.path.basename(path): _file_stamp(path) for path in output_paths},
+    })
+
+
+def set_input(manifest_path: str, input_digest: str):
+    """Add the input digest to the manifest of a step that completed before the digest was known"""
+    manifest = read(manifest_path)
+    if manifest is not None and not manifest.get('input_sha256'):
+        _save(manifest_path, {**manifest, 'input_sha256': input_digest})
+
+
+def read(manifest_path: str) -> ty.Optional[dict]:
+    """Read a manifest, or return None if the step has not (successfully) completed"""
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove(manifest_path: str):
+    """Forget that a step was completed (eg, because it is about to overwrite its outputs)"""
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+
+def clear(manifest_path: str):
+    """
+    Remove a step's manifest, and the outputs that it lists, before the step runs again. Outputs may be hardlinks that
+        are shared with another upload (see `processors.link_or_copy`), so they must not be overwritten in place.
+    """
+    manifest = read(manifest_path)
+    remove(manifest_path)
+    if manifest is None:
+        return
+
+    folder = os.path.dirname(manifest_path)
+    for name in manifest.get('outputs', {}):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def get_output_digest(manifest_path: str, output_path: str) -> ty.Optional[str]:
+    """The recorded identity of one output, which can be used as the input digest of the next step"""
+    manifest = read(manifest_path)
+    if manifest is None:
+        return None
+    return manifest['outputs'].get(os.path.basename(output_path))
+
+
+def is_current(manifest_path: str, step: str, input_digest: str, options: dict) -> bool:
+    """
+    Check whether a step can be skipped: it ran with the same input, options, and code version, and its outputs
+        are unchanged since then
+    """
+    manifest = read(manifest_path)
+    if manifest is None or not input_digest:
+        return False
+
+    if (manifest.get('step') != step
+            or manifest.get('version') != STEP_VERSIONS[step]
+            or manifest.get('input_sha256') != input_digest
+            or manifest.get('options') != _as_json(options)):
+        return False
+
+    folder = os.path.dirname(manifest_path)
+    for name, stamp in manifest.get('outputs', {}).items():
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path) or _file_stamp(path) != stamp:
+            return False
+    return True
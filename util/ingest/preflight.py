@@ -0,0 +1,163 @@
+"""
+Check a small sample of an upload before it is processed, so that problems (such as the wrong column options) are found
+    in about a second, instead of after a full pass over the file
+
+The sample is the first rows of the file, plus the rows found at a few points spread through the rest of it. Plain text
+    and BGZF files can be read from any point; other gzip files can only be read from the start, so for those, only
+    the first rows are checked.
+"""
+import collections
+import itertools
+import os
+import time
+import typing as ty
+
+from zorp import (
+    exceptions as z_exc,
+    parsers,
+    sniffers,
+)
+
+from . import bgzf, errorlog, helpers, sorting
+
+# Rows read from the start of the file
+HEAD_ROWS = 1000
+# Other places in the file where rows are checked (each is about one BGZF block of text)
+SEEK_POINTS = 8
+# Uploads where more than this fraction of the sampled rows can't be read are rejected
+MAX_ERROR_RATE = 0.1
+# Rows that could not be read, included in the report to show what went wrong
+MAX_EXAMPLES = 5
+
+
+def _get_compression(src_path: str) -> str:
+    with open(src_path, 'rb') as f:
+        if f.read(2) != b'\x1f\x8b':
+            return 'none'
+    return 'bgzf' if bgzf.is_bgzf(src_path) else 'gzip'
+
+
+def _read_head(src_path: str, skip_rows: int, max_rows: int) -> ty.Tuple[ty.List[str], ty.List[str], int]:
+    """The header lines, the first data rows, and how far (in bytes) into the file those rows were read from"""
+    lines = helpers.SourceLines(src_path)
+    lines_iter = iter(lines)
+    try:
+        headers = list(itertools.islice(lines_iter, skip_rows))
+        rows = [line for line in itertools.islice(lines_iter, max_rows) if line]
+        # Reads are buffered, so this may be past the last row read; rows after it are never checked twice
+        bytes_read = lines.bytes_read
+    finally:
+        lines_iter.close()
+    return headers, rows, bytes_read
+
+
+def _complete_lines(data: bytes) -> ty.List[str]:
+    """The whole lines in a chunk of a file, which (probably) starts and ends partway through a line"""
+    return [line.decode('utf-8').rstrip('\r') for line in data.split(b'\n')[1:-1] if line]
+
+
+def _sample_rows(src_path: str, compression: str, start: int, count: int) -> ty.Iterator[ty.List[str]]:
+    """Rows from up to `count` places spread through the file, after byte `start` (the rows before it were checked)"""
+    if compression == 'bgzf':
+        for offset, data in bgzf.sample_blocks(src_path, count + 1):
+            if offset >= start:
+                yield _complete_lines(data)
+    elif compression == 'none':
+        size = os.path.getsize(src_path)
+        with open(src_path, 'rb') as f:
+            for i in range(1, count + 1):
+                offset = max(start, size * i // (count + 1))
+                if offset >= size:
+                    return
+                f.seek(offset)
+                data = f.read(bgzf.MAX_BLOCK_SIZE)
+                start = offset + len(data)
+                yield _complete_lines(data)
+
+
+@helpers.capture_errors
+def check_sample(src_path: str, parser_options: dict, *, head_rows: int = HEAD_ROWS, seek_points: int = SEEK_POINTS,
+                 max_error_rate: float = MAX_ERROR_RATE, allow_unsorted: bool = False) -> dict:
+    """
+    Parse a sample of a raw GWAS file, and report what was found: the columns, how many rows could not be read (and
+        why), and whether the rows are in order. The report can be saved as JSON.
+
+    The file should not be processed if `report['ok']` is False; `report['problems']` explains why. A sample can only
+        show that a file is bad, not that it is good: the full file is still validated when it is normalized.
+
+    :param src_path: The raw file (plain text or gzip compressed)
+    :param parser_options: How to read the file
+    :param head_rows: Rows checked at the start of the file
+    :param seek_points: Other places in the file where rows are checked (if the file is long enough)
+    :param max_error_rate: The largest fraction of sampled rows that may be unreadable
+    :param allow_unsorted: Whether rows that are out of order are acceptable (eg, because they will be sorted)
+    """
+    started = time.monotonic()
+    delimiter = parser_options.get('delimiter', '\t')
+    parser = parsers.GenericGwasLineParser(**parser_options)
+    skip_rows = sniffers.guess_gwas(src_path, parser=parser)._skip_rows
+    compression = _get_compression(src_path)
+
+    problems = []
+    samples: ty.List[ty.List[str]] = []
+    columns = None
+    try:
+        headers, head, head_bytes = _read_head(src_path, skip_rows, head_rows)
+        columns = headers[-1].split(delimiter) if headers else None
+        samples.append(head)
+        if len(head) == head_rows:
+            samples.extend(_sample_rows(src_path, compression, head_bytes, seek_points))
+    except UnicodeDecodeError:
+        problems.append('The file could not be read as text')
+
+    error_counts: ty.Counter[str] = collections.Counter()
+    examples: ty.List[dict] = []
+    order_check = sorting.OrderCheck()
+    is_sorted = True
+    num_rows = 0
+    num_columns = None
+    for index, rows in enumerate(samples):
+        for n, row in enumerate(rows, start=skip_rows + 1):
+            num_rows += 1
+            num_columns = num_columns or len(row.split(delimiter))
+            try:
+                variant = parser(row)
+            except z_exc.LineParseException as e:
+                error_counts[errorlog.get_category(str(e))] += 1
+                if len(examples) < MAX_EXAMPLES:
+                    # Row numbers are only known for rows at the start of the file
+                    examples.append({'row': n if index == 0 else None, 'reason': str(e), 'line': row})
+                continue
+            is_sorted = order_check.add(variant.chrom, variant.pos) and is_sorted
+
+    num_errors = sum(error_counts.values())
+    error_rate = num_errors / num_rows if num_rows else 0.0
+    for option, column in sorted(parser_options.items()):
+        if option.endswith('_col') and column and num_columns and column > num_columns:
+            problems.append('Column {} ({}) does not exist: rows have {} columns'.format(column, option, num_columns))
+    if not num_rows and not problems:
+        problems.append('The file does not contain any data rows')
+    elif num_rows and num_errors == num_rows:
+        problems.append('None of the sampled rows could be read with these options')
+    elif error_rate > max_error_rate:
+        problems.append('{:.0%} of the sampled rows could not be read with these options'.format(error_rate))
+    if not is_sorted and not allow_unsorted:
+        problems.append('Rows must be grouped by chromosome, and sorted by position')
+
+    return {
+        'ok': not problems,
+        'problems': problems,
+        'compression': compression,
+        'columns': columns,
+        'num_columns': num_columns,
+        'column_names': {option: columns[column - 1] for option, column in parser_options.items()
+                         if option.endswith('_col') and column and columns and column <= len(columns)},
+        'rows_checked': num_rows,
+        'seek_points': max(len(samples) - 1, 0),
+        'parse_errors': num_errors,
+        'error_rate': round(error_rate, 4),
+        'errors_by_category': dict(error_counts),
+        'error_examples': examples,
+        'is_sorted': is_sorted,
+        'seconds': round(time.monotonic() - started, 3),
+    }
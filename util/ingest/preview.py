@@ -0,0 +1,222 @@
+"""
+Suggest how to read a GWAS file, based on only the first part of it
+
+The upload page sends the first few KB of a file before the file itself is uploaded. The user can check the suggested
+    options (and a preview of the rows as they would be read) before waiting for a large upload, instead of finding out
+    afterwards that the columns were wrong.
+"""
+import math
+import os
+import re
+import tempfile
+import typing as ty
+import zlib
+
+from zorp import (
+    exceptions as z_exc,
+    parsers,
+    sniffers,
+)
+
+from . import bgzf, errorlog, exceptions, helpers
+
+# The most data (in bytes) that will be read from the start of a file; this is enough for a few hundred rows
+MAX_HEAD_BYTES = 2 ** 16
+# Rows that are returned, to show how the file would be read
+PREVIEW_ROWS = 10
+# Options that must be known to read a file
+REQUIRED_OPTIONS = ('chr_col', 'pos_col', 'ref_col', 'alt_col', 'pval_col')
+
+# Common names for each column (compared after removing a leading "#", and ignoring case)
+_COLUMN_NAMES = {
+    'chr_col': {'chrom', 'chr', 'chromosome', 'chr_name', 'chr_id'},
+    'pos_col': {'pos', 'position', 'bp', 'begin', 'beg', 'base_pair_location', 'genpos'},
+    'ref_col': {'ref', 'reference', 'ref_allele', 'reference_allele', 'other_allele', 'non_effect_allele', 'nea'},
+    'alt_col': {'alt', 'alternate', 'alt_allele', 'alternate_allele', 'effect_allele', 'ea'},
+    'pval_col': {'p', 'pval', 'pvalue', 'p_value', 'p-value', 'p.value', 'pval_nominal', 'p_wald', 'p_lrt', 'p_score',
+                 'p_bolt_lmm', 'p_bolt_lmm_inf', 'frequentist_add_pvalue'},
+}
+_LOG_PVAL_NAMES = {'log_pvalue', 'log_pval', 'neg_log_pvalue', 'neg_log_pval', 'neg_log10_pvalue', 'mlog10p', 'log10p',
+                   '-log10p', 'logp', 'nlog10p', 'minus_log10_p'}
+_DELIMITERS = ('\t', ',', ' ')
+
+# Values that each column holds, for files whose header does not say
+_CHROM_VALUE = re.compile(r'^(?:chr)?(?:[0-9]{1,2}|X|Y|MT?)$', re.IGNORECASE)
+_POS_VALUE = re.compile(r'^[0-9]+$')
+_ALLELE_VALUE = re.compile(r'^[ACGTN]+$', re.IGNORECASE)
+
+
+def decompress_head(data: bytes) -> bytes:
+    """Decompress as much as possible of the start of a (b)gzip file; other files are returned as-is"""
+    if data[:2] != b'\x1f\x8b':
+        return data
+    result = bytearray()
+    # BGZF files (and some others) are made of several gzip "members", one after another
+    while data[:2] == b'\x1f\x8b':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            result += decompressor.decompress(data)
+        except zlib.error:
+            raise exceptions.ValidationException('The start of the file could not be decompressed')
+        data = decompressor.unused_data
+    return bytes(result)
+
+
+def _get_compression(data: bytes) -> str:
+    if data[:2] != b'\x1f\x8b':
+        return 'none'
+    return 'bgzf' if bgzf._is_block_header(data[:bgzf._HEADER.size]) else 'gzip'
+
+
+def _get_lines(data: bytes) -> ty.List[str]:
+    """The complete lines of text (the last one was probably cut off partway through)"""
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start < len(data) - 4:
+            raise exceptions.ValidationException('The file could not be read as text')
+        # The head ended partway through a character
+        text = data[:e.start].decode('utf-8')
+    return [line.rstrip('\r') for line in text.split('\n')[:-1]]
+
+
+def _guess_delimiter(rows: ty.List[str]) -> str:
+    """The first delimiter that splits every row into the same number (at least 3) of fields"""
+    for delimiter in _DELIMITERS:
+        counts = {len(row.split(delimiter)) for row in rows}
+        if len(counts) == 1 and counts.pop() >= 3:
+            return delimiter
+    return '\t'
+
+
+def _guess_from_names(columns: ty.List[str]) -> dict:
+    options: ty.Dict[str, ty.Any] = {}
+    for index, column in enumerate(columns):
+        name = column.strip().lstrip('#').strip().lower()
+        for option, names in _COLUMN_NAMES.items():
+            if name in names and option not in options:
+                options[option] = index + 1
+        if name in _LOG_PVAL_NAMES and 'pval_col' not in options:
+            options['pval_col'] = index + 1
+            options['is_log_pval'] = True
+    return options
+
+
+def _is_pvalue(value: str) -> bool:
+    try:
+        return 0 <= float(value) <= 1
+    except ValueError:
+        return value in ('NA', '.', '')
+
+
+def _guess_from_values(fields: ty.List[ty.List[str]], options: dict):
+    """Find any columns that were not named in the header, based on the values that they hold"""
+    num_columns = min(len(row) for row in fields)
+    used = {column for option, column in options.items() if option.endswith('_col')}
+
+    def find_column(is_match: ty.Callable[[str], bool], start: int = 0) -> ty.Optional[int]:
+        for index in range(start, num_columns):
+            if index + 1 not in used and all(is_match(row[index]) for row in fields):
+                used.add(index + 1)
+                return index + 1
+        return None
+
+    if 'chr_col' not in options:
+        options['chr_col'] = find_column(lambda value: bool(_CHROM_VALUE.match(value)))
+    if 'pos_col' not in options:
+        # Usually, position comes right after chromosome
+        options['pos_col'] = find_column(lambda value: bool(_POS_VALUE.match(value)), start=options['chr_col'] or 0)
+    for option in ('ref_col', 'alt_col'):
+        if option not in options:
+            options[option] = find_column(lambda value: bool(_ALLELE_VALUE.match(value)))
+    if 'pval_col' not in options:
+        # Other columns (such as allele frequency) can look like p-values, so only guess if there is one choice
+        candidates = [index + 1 for index in range(num_columns)
+                      if index + 1 not in used and all(_is_pvalue(row[index]) for row in fields)]
+        options['pval_col'] = candidates[0] if len(candidates) == 1 else None
+
+
+def suggest_options(headers: ty.List[str], rows: ty.List[str]) -> dict:
+    """
+    Guess the parser options for a file: first from the column names in the header (if any), and then from the values
+        in each column. Options that could not be guessed are None.
+
+    :param headers: The header lines (the last one names the columns)
+    :param rows: Data rows
+    """
+    delimiter = _guess_delimiter(rows)
+    options = _guess_from_names(headers[-1].split(delimiter)) if headers else {}
+    if not headers and rows:
+        # Some headers are not recognized as such (eg, "CHR BP P"), but the column names still help
+        options = _guess_from_names(rows[0].split(delimiter))
+        if sum(option.endswith('_col') for option in options) >= 2:
+            rows = rows[1:]
+        else:
+            options = {}
+    if rows:
+        _guess_from_values([row.split(delimiter) for row in rows], options)
+    options.setdefault('is_log_pval', False)
+    if delimiter != '\t':
+        options['delimiter'] = delimiter
+    # Always include the required options, so that it is clear which ones could not be guessed
+    return {**{option: None for option in REQUIRED_OPTIONS}, **options}
+
+
+def _format_row(variant) -> dict:
+    neg_log_pvalue = variant.neg_log_pvalue
+    if neg_log_pvalue is not None and math.isinf(neg_log_pvalue):
+        neg_log_pvalue = None  # A p-value of 0 (which can't be written as JSON)
+    return {'chrom': variant.chrom, 'pos': variant.pos, 'ref': variant.ref, 'alt': variant.alt,
+            'pvalue': variant.pvalue, 'neg_log_pvalue': neg_log_pvalue}
+
+
+@helpers.capture_errors
+def preview_head(data: bytes, parser_options: dict = None) -> dict:
+    """
+    Read the start of a file (at most `MAX_HEAD_BYTES`), and suggest how to parse it. The result can be saved as JSON.
+
+    :param data: The first bytes of the file (plain text or gzip compressed)
+    :param parser_options: Use these options, instead of guessing
+    """
+    compression = _get_compression(data)
+    lines = _get_lines(decompress_head(data[:MAX_HEAD_BYTES]))
+    if not lines:
+        raise exceptions.ValidationException('The start of the file does not contain any complete lines')
+
+    # Use zorp's rules to find the header rows (which are skipped when the file is parsed)
+    fd, head_path = tempfile.mkstemp(suffix='.txt')
+    try:
+        with open(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        skip_rows = sniffers.guess_gwas(head_path, parser=None)._skip_rows
+        headers, rows = lines[:skip_rows], [line for line in lines[skip_rows:] if line]
+        if parser_options is None:
+            parser_options = suggest_options(headers, rows)
+        is_complete = all(parser_options.get(option) for option in REQUIRED_OPTIONS)
+
+        preview = []
+        num_parsed = 0
+        error_log = errorlog.ErrorLog(max_logged=0, max_examples=PREVIEW_ROWS)
+        if is_complete:
+            parser = parsers.GenericGwasLineParser(**parser_options)
+            try:
+                for variant in helpers.make_line_reader(head_path, parser, lines, error_log=error_log):
+                    num_parsed += 1
+                    if len(preview) < PREVIEW_ROWS:
+                        preview.append(_format_row(variant))
+            except z_exc.TooManyBadLinesException:
+                pass  # The options are clearly wrong, and there are plenty of examples to show why
+    finally:
+        os.remove(head_path)
+
+    delimiter = parser_options.get('delimiter', '\t')
+    return {
+        'compression': compression,
+        'columns': headers[-1].split(delimiter) if headers else None,
+        'parser_options': parser_options,
+        'is_complete': is_complete,
+        'rows_checked': num_parsed + len(error_log),
+        'parse_errors': len(error_log),
+        'error_examples': [{'row': n, 'reason': reason, 'line': line} for n, reason, line in error_log],
+        'preview': preview,
+    }
@@ -4,81 +4,540 @@ Steps used to process a GWAS file for future use
 import hashlib
 import json
 import logging
+import os
+import pickle
+import re
+import shutil
+import typing as ty
 
+import pysam
 from zorp import (
     exceptions as z_exc,
     parsers,
-    readers,
-    sniffers
 )
 # from .exceptions import ManhattanExeption, QQPlotException, UnexpectedIngestException
-from . exceptions import TopHitException
 from . import (
+    bgzf,
+    columnar,
+    errorlog,
+    exceptions,
     helpers,
     manhattan,
-    qq
+    progress,
+    qq,
+    tophit,
+    validators,
 )
 
 logger = logging.getLogger(__name__)
 
+# Don't split files into pieces smaller than this (in bytes) for parallel normalization
+NORMALIZE_MIN_SHARD_SIZE = 64 * 2 ** 20
+
+# Uploads that already look exactly like a normalized file can be used as-is (see `adopt_normalized`)
+NORMALIZED_HEADER = '#chrom\tpos\tref\talt\tneg_log_pvalue'
+NORMALIZED_PARSER_OPTIONS = {'chr_col': 1, 'pos_col': 2, 'ref_col': 3, 'alt_col': 4, 'pval_col': 5, 'is_log_pval': True}
+# BGZF blocks (spread through the file) that are checked before a file is used as-is
+NORMALIZED_SAMPLE_BLOCKS = 32
+# Values as the normalizer writes them; anything else (eg, "chr1" or "NA") is converted in the usual way
+_NORMALIZED_CHROM = re.compile(r'^(?:[1-9]|1[0-9]|2[0-2]|X|Y|MT?)$')
+_NORMALIZED_POS = re.compile(r'^[0-9]+$')
+_NORMALIZED_ALLELE = re.compile(r'^(?:[ACGTN]+|\.)$')
+
+
+class SummaryParts(ty.NamedTuple):
+    """The consumers used by summary steps, which can be saved and merged for each part of a file"""
+    binner: manhattan.CompactBinner
+    qq_accumulator: qq.QQAccumulator
+    top_hit: tophit.TopHitTracker
+
+    @classmethod
+    def create(cls, qq_streaming: bool = False) -> 'SummaryParts':
+        return cls(manhattan.CompactBinner(), qq.QQAccumulator(streaming=qq_streaming), tophit.TopHitTracker())
+
+    def merge(self, other: 'SummaryParts'):
+        """Combine with the parts for the rows after these ones"""
+        for consumer, other_consumer in zip(self, other):
+            consumer.merge(other_consumer)
+
 
 @helpers.capture_errors
-def get_file_sha256(src_path, block_size=2 ** 20) -> bytes:
+def get_file_sha256(src_path, block_size=2 ** 20, reporter: progress.ProgressReporter = None) -> bytes:
     # https://stackoverflow.com/a/1131255/1422268
+    reporter = reporter or progress.ProgressReporter()
     with open(src_path, 'rb') as f:
         shasum_256 = hashlib.sha256()
+        reporter.start(total_bytes=os.path.getsize(src_path), get_bytes_read=f.tell)
 
         while True:
             data = f.read(block_size)
             if not data:
                 break
             shasum_256.update(data)
+            reporter.update()
+        reporter.finish()
         return shasum_256.digest()
 
 
+def link_or_copy(src_path: str, dest_path: str):
+    """
+    Give a new path to the same file contents. A hardlink is used if possible (so no extra disk space is needed),
+        which means that neither path may be modified in place afterwards: replace or remove the file instead.
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        # Eg, the files are on different devices. The modification time is kept, so that a copied manifest (see
+        #   `manifest`) still matches the copied file.
+        shutil.copy2(src_path, dest_path)
+
+
+def _remove_partial_output(dest_path: str):
+    """Remove any files left behind by a failed attempt to write (and tabix-index) normalized data"""
+    for fn in (dest_path, dest_path + '.gz', dest_path + '.gz.tbi'):
+        if os.path.isfile(fn):
+            os.remove(fn)
+
+
+def _remove_old_output(gz_path: str):
+    """An old output may be a hardlink to the upload (see `adopt_normalized`), so it is replaced, never overwritten"""
+    if os.path.lexists(gz_path):
+        os.remove(gz_path)
+
+
+def _compress_and_index(text_path: str, threads: int = 1) -> str:
+    """Compress a normalized text file (as BGZF), and tabix-index it. The text file is removed."""
+    _remove_old_output(text_path + '.gz')
+    with open(text_path, 'r') as src, bgzf.BgzfWriter(text_path + '.gz', threads=threads) as dest:
+        shutil.copyfileobj(src, dest, bgzf.MAX_BLOCK_SIZE * 16)
+    os.remove(text_path)
+    return _make_tabix(text_path + '.gz')
+
+
+def _make_tabix(gz_path: str) -> str:
+    # The same index that zorp writes (`reader.write(make_tabix=True)`). Besides the columns, the vcf preset gives each
+    #   row an end position from the length of the 4th column, so region queries find long alleles that overlap them
+    return pysam.tabix_index(gz_path, force=True, preset='vcf')
+
+
+def _is_normalized_row(fields: ty.List[str]) -> bool:
+    if len(fields) != 5:
+        return False
+    chrom, pos, ref, alt, neg_log_pvalue = fields
+    if not (_NORMALIZED_CHROM.match(chrom) and _NORMALIZED_POS.match(pos)
+            and _NORMALIZED_ALLELE.match(ref) and _NORMALIZED_ALLELE.match(alt)):
+        return False
+    if neg_log_pvalue == '.':
+        return True
+    try:
+        return float(neg_log_pvalue) >= 0  # Also excludes NaN
+    except ValueError:
+        return False
+
+
+def _is_normalized_block(text: str, is_first: bool) -> bool:
+    """Check the complete rows in one block: each must be in the normalized format, and they must be sorted"""
+    lines = text.split('\n')
+    if is_first and (lines[0] != NORMALIZED_HEADER or len(lines) < 3):
+        # The file must start with the header, and at least one complete row
+        return False
+    lines = lines[1:]  # The header, or (probably) part of a row that started in the previous block
+    lines = lines[:-1]  # Part of a row that ends in the next block (or the empty string after the last row)
+    return _is_normalized_lines(lines, validators.standard_gwas_validator.make_row_check())
+
+
+def _is_normalized_lines(lines: ty.Iterable[str], row_check: validators._RowCheck) -> bool:
+    for line in lines:
+        fields = line.split('\t')
+        if not _is_normalized_row(fields):
+            return False
+        try:
+            row_check.check_position(fields[0], int(fields[1]))
+        except exceptions.ValidationException:
+            return False
+    return True
+
+
+def _is_normalized_file(src_path: str, threads: int = 1, reporter: progress.ProgressReporter = None) -> bool:
+    """Check every row of a file that `is_normalized`, in a single pass over the decompressed data"""
+    reporter = reporter or progress.ProgressReporter()
+    row_check = validators.standard_gwas_validator.make_row_check()
+    rest = b''
+    is_first = True
+    for data in bgzf.iter_decompressed(src_path, threads=threads):
+        # Rows are split on "\n" alone (as in the sample), so that other line endings are not accepted
+        complete, _, rest = (rest + data).rpartition(b'\n')
+        lines = complete.decode('utf-8').split('\n') if complete else []
+        if is_first and lines:
+            if lines[0] != NORMALIZED_HEADER:
+                return False
+            lines, is_first = lines[1:], False
+        if not _is_normalized_lines(lines, row_check):
+            return False
+        reporter.add_rows(len(lines))
+    # The sample has already found the header. The last row may not end with a newline.
+    return not rest or _is_normalized_lines([rest.decode('utf-8')], row_check)
+
+
+@helpers.capture_errors
+def is_normalized(src_path: str, parser_options: dict, sample_blocks: int = NORMALIZED_SAMPLE_BLOCKS) -> bool:
+    """
+    Check whether an upload is already in the normalized format: BGZF compressed, with the same columns (and parser
+        options that read them as-is), and with values written the same way.
+
+    This only reads a sample of the file. Every row is checked before the file is used (see `adopt_normalized`).
+    """
+    if parser_options != NORMALIZED_PARSER_OPTIONS or not bgzf.is_bgzf(src_path):
+        return False
+    try:
+        for offset, data in bgzf.sample_blocks(src_path, sample_blocks):
+            if not _is_normalized_block(data.decode('utf-8'), offset == 0):
+                return False
+    except (ValueError, UnicodeDecodeError):
+        return False
+    return True
+
+
 @helpers.capture_errors
-def normalize_contents(src_path: str, parser_options: dict, dest_path: str, log_path: str) -> bool:
+def adopt_normalized(src_path: str, parser_options: dict, dest_path: str, log_path: str, threads: int = 1,
+                     reporter: progress.ProgressReporter = None) -> bool:
+    """
+    Use an upload that is already in the normalized format (see `is_normalized`) as the normalized file, instead of
+        parsing and compressing every row again. The file is shared with the upload (as a hardlink, if possible), and
+        tabix-indexed.
+
+    Every row is checked in one pass over the decompressed file, the same way as the sample: the values must be written
+        as in a normalized file, and positions must be sorted. Indexing then checks that each chromosome is in one
+        block. Returns False (and writes nothing) if any check fails, so that the file is normalized in the usual way
+        (which reports the problems).
+    """
+    if not is_normalized(src_path, parser_options):
+        return False
+
+    reporter = reporter or progress.ProgressReporter()
+    reporter.start(total_bytes=os.path.getsize(src_path))
+    if not _is_normalized_file(src_path, threads=threads, reporter=reporter):
+        logger.info('Not every row of {} is in the normalized format; it will be normalized instead'.format(src_path))
+        return False
+
+    link_or_copy(src_path, dest_path + '.gz')
+    try:
+        dest_fn = _make_tabix(dest_path + '.gz')
+    except OSError:
+        logger.info('Could not index {}; it will be normalized instead'.format(src_path))
+        _remove_partial_output(dest_path)
+        return False
+
+    reporter.finish()
+    with open(log_path, 'a+') as f:
+        f.write('File is already in the normalized format, and was used without being converted.\n')
+        f.write('[success] GWAS file has been converted.\n')
+    logger.info('File was already normalized! Results written to: {}'.format(dest_fn))
+    return True
+
+
+def _check_row(row_check: validators._RowCheck, reporter: progress.ProgressReporter, row) -> bool:
+    reporter.add_rows()
+    return row_check.check_variant(row)
+
+
+@helpers.capture_errors
+def normalize_contents(src_path: str, parser_options: dict, dest_path: str, log_path: str, threads: int = 1,
+                       reporter: progress.ProgressReporter = None) -> bool:
     """
     Initial content ingestion: load the file and write variants in a standardized format
 
+    Data rows are validated as they are written, so that the raw file only needs to be parsed once. If validation
+        fails, writing stops at the first bad row and any partial output is removed.
+
+    With `threads`, BGZF compression (of the output, and of the input if it is bgzipped) uses several cores.
+
     This routine will deliberately exclude lines that could not be handled in a reliable fashion, such as pval=NA
     """
+    reporter = reporter or progress.ProgressReporter()
     parser = parsers.GenericGwasLineParser(**parser_options)
-    reader = sniffers.guess_gwas(src_path, parser=parser)
+    lines = helpers.SourceLines(src_path, threads=threads)
+    with open(log_path, 'a+') as log_file:
+        # Rows that can't be parsed are logged as they are found
+        error_log = errorlog.ErrorLog(log_file)
+        reader = helpers.make_line_reader(src_path, parser, lines, error_log=error_log)
+        row_check = validators.standard_gwas_validator.make_row_check()
+        reader.add_filter('pos', lambda v, row: _check_row(row_check, reporter, row))
+        reporter.start(total_bytes=os.path.getsize(src_path), get_bytes_read=lambda: lines.bytes_read)
 
-    success = False
-    try:
-        dest_fn = reader.write(dest_path, make_tabix=True)
-    except z_exc.TooManyBadLinesException as e:
-        raise e
+        success = False
+        try:
+            reader.write(dest_path)
+            row_check.finish()
+            dest_fn = _compress_and_index(dest_path, threads=threads)
+        except (z_exc.TooManyBadLinesException, exceptions.ValidationException) as e:
+            _remove_partial_output(dest_path)
+            raise e
+        else:
+            success = True
+            reporter.finish()
+            logger.info('Conversion succeeded! Results written to: {}'.format(dest_fn))
+        finally:
+            # Always finish the log, no matter what
+            _finish_normalize_log(log_file, error_log, success)
+    return success
+
+
+def _finish_normalize_log(log_file: ty.TextIO, error_log: errorlog.ErrorLog, success: bool):
+    error_log.write_summary()
+    if success:
+        log_file.write('[success] GWAS file has been converted.\n')
     else:
-        success = True
-        logger.info('Conversion succeeded! Results written to: {}'.format(dest_fn))
+        log_file.write('[failure] Could not create normalized GWAS file.\n')
+
+
+@helpers.capture_errors
+def get_normalize_shards(src_path: str, max_shards: int,
+                         min_shard_size: int = NORMALIZE_MIN_SHARD_SIZE) -> ty.List[ty.Tuple[int, int]]:
+    """
+    Divide a raw GWAS file into (start, end) byte ranges, each made of whole lines, which can be normalized separately
+        (see `normalize_shard`). Returns an empty list if the file should not be split: it is too small, or compressed
+        (which means that it can only be read from the beginning).
+    """
+    with open(src_path, 'rb') as f:
+        head = f.read(2 ** 16)
+        if head[:2] == b'\x1f\x8b' or b'\r' in head.replace(b'\r\n', b''):
+            # Gzip files, or (rare) files that use "\r" alone to end lines
+            return []
+
+        size = os.fstat(f.fileno()).st_size
+        num_shards = min(max_shards, size // min_shard_size)
+        if num_shards < 2:
+            return []
+
+        boundaries = [0]
+        for i in range(1, num_shards):
+            # Each shard starts at the beginning of a line
+            f.seek(size * i // num_shards - 1)
+            f.readline()
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class _LineRange:
+    """Iterate over the lines in one byte range of a text file (without line endings), counting them as they are read"""
+    def __init__(self, path: str, start: int, end: int):
+        self._path = path
+        self._start = start
+        self._end = end
+        self.count = 0
+        self.bytes_read = 0
+
+    def __iter__(self):
+        with open(self._path, 'rb') as f:
+            f.seek(self._start)
+            remaining = self._end - self._start
+            for line in f:
+                if remaining <= 0:
+                    break
+                remaining -= len(line)
+                self.bytes_read += len(line)
+                self.count += 1
+                yield line.decode('utf-8').rstrip('\n').rstrip('\r')
+
+
+@helpers.capture_errors
+def normalize_shard(src_path: str, parser_options: dict, start: int, end: int, shard_path: str,
+                    threads: int = 1, reporter: progress.ProgressReporter = None) -> bool:
+    """
+    Normalize one byte range of a raw file (see `get_normalize_shards`), and write it as part of a BGZF file. The
+        parts are joined by `merge_normalized_shards`.
+
+    Problems are recorded (in `shard_path + '.json'`) instead of raised, so that the merge step can report them in
+        file order, exactly as `normalize_contents` would.
+    """
+    reporter = reporter or progress.ProgressReporter()
+    parser = parsers.GenericGwasLineParser(**parser_options)
+    lines = _LineRange(src_path, start, end)
+    # Only the first shard has headers. Errors are logged (in file order) when the shards are merged.
+    error_log = errorlog.ErrorLog()
+    reader = helpers.make_line_reader(src_path, parser, lines, has_headers=start == 0, error_log=error_log)
+    row_check = validators.standard_gwas_validator.make_row_check()
+    reader.add_filter('pos', lambda v, row: _check_row(row_check, reporter, row))
+    reporter.start(total_bytes=end - start, get_bytes_read=lambda: lines.bytes_read)
+
+    text_path = shard_path + '.txt'
+    result = {'complete': True, 'validation_error': None}
+    try:
+        reader.write(text_path)
+        with open(text_path, 'r') as src, bgzf.BgzfWriter(shard_path, write_eof=False, threads=threads) as dest:
+            header = src.readline()
+            if start == 0:
+                dest.write(header)
+            shutil.copyfileobj(src, dest, bgzf.MAX_BLOCK_SIZE * 16)
+    except z_exc.TooManyBadLinesException:
+        result['complete'] = False
+    except exceptions.ValidationException as e:
+        result['validation_error'] = str(e)
     finally:
-        # Always write a log entry, no matter what
-        with open(log_path, 'a+') as f:
-            for n, reason, _ in reader.errors:
-                f.write('Excluded row {} from output due to parse error: {}\n'.format(n, reason))
-            if success:
-                f.write('[success] GWAS file has been converted.\n')
-                return True
-            else:
-                f.write('[failure] Could not create normalized GWAS file.\n')
-    # In reality a failing task will usually raise an exception rather than returning False
-    return False
+        if os.path.isfile(text_path):
+            os.remove(text_path)
+
+    result.update({
+        'lines': lines.count,
+        'errors': error_log.to_dict(),
+        'max_errors': reader._max_errors,
+        'first': row_check.first,
+        'last': row_check.last,
+    })
+    with open(shard_path + '.json', 'w') as f:
+        json.dump(result, f)
+    reporter.finish()
+    return True
+
+
+@helpers.capture_errors
+def merge_normalized_shards(shard_paths: ty.List[str], dest_path: str, log_path: str) -> bool:
+    """
+    Join the parts written by `normalize_shard` (in file order) into a normalized, tabix-indexed file. The data and the
+        log are the same as `normalize_contents` would write for the whole file.
+    """
+    success = False
+    with open(log_path, 'a+') as log_file:
+        error_log = errorlog.ErrorLog(log_file)
+        try:
+            row_check = validators.standard_gwas_validator.make_row_check()
+            lines_before = 0
+            for path in shard_paths:
+                with open(path + '.json', 'r') as f:
+                    result = json.load(f)
+
+                # Error line numbers are counted from the start of the shard
+                max_errors = result['max_errors']
+                error_log.merge(result['errors'], line_offset=lines_before, limit=max_errors)
+                lines_before += result['lines']
+                if not result['complete'] or len(error_log) >= max_errors:
+                    raise z_exc.TooManyBadLinesException(error_list=error_log)
+                if result['validation_error']:
+                    raise exceptions.ValidationException(result['validation_error'])
+
+                # Check sort order across the boundary between shards
+                if result['first'] is not None:
+                    row_check.check_position(*result['first'])
+                    row_check.check_position(*result['last'])
+            row_check.finish()
+
+            _remove_old_output(dest_path + '.gz')
+            bgzf.concatenate(shard_paths, dest_path + '.gz')
+            dest_fn = _make_tabix(dest_path + '.gz')
+        except (z_exc.TooManyBadLinesException, exceptions.ValidationException) as e:
+            _remove_partial_output(dest_path)
+            raise e
+        else:
+            success = True
+            logger.info('Conversion succeeded! Results written to: {}'.format(dest_fn))
+        finally:
+            _finish_normalize_log(log_file, error_log, success)
+            for path in shard_paths:
+                for fn in (path, path + '.json'):
+                    if os.path.isfile(fn):
+                        os.remove(fn)
+    return success
+
+
+def _read_summary_batches(in_filename: str, chrom: str = None, threads: int = 1,
+                          reporter: progress.ProgressReporter = None):
+    """
+    Read the normalized file in column batches, for use by summary steps
+
+    FIXME: Pheweb loader code does not handle infinity values, so we exclude these from manhattan plots
+      This is almost assuredly not the final desired behavior
+    """
+    return columnar.read_batches(in_filename, chrom=chrom, skip_missing=True, threads=threads, reporter=reporter)
+
+
+def _summarize(in_filename: str, qq_streaming: bool, chrom: str = None, threads: int = 1,
+               reporter: progress.ProgressReporter = None) -> SummaryParts:
+    reporter = reporter or progress.ProgressReporter()
+    parts = SummaryParts.create(qq_streaming)
+    for batch in _read_summary_batches(in_filename, chrom=chrom, threads=threads, reporter=reporter):
+        for consumer in parts:
+            consumer.process_batch(batch)
+        reporter.add_rows(len(batch))
+    reporter.finish()
+    return parts
+
+
+def _write_summaries(parts: SummaryParts, manhattan_path: str, qq_path: str):
+    # Find the top hit first: if there isn't one, there is no point in writing plot data
+    best_row = parts.top_hit.get_result()
+
+    with open(manhattan_path, 'w') as f:
+        json.dump(parts.binner.get_result(), f)
+
+    with open(qq_path, 'w') as f:
+        json.dump(parts.qq_accumulator.get_result(), f)
+
+    return best_row
+
+
+@helpers.capture_errors
+def generate_summaries(in_filename: str, manhattan_path: str, qq_path: str, qq_streaming: bool = False,
+                       threads: int = 1, reporter: progress.ProgressReporter = None):
+    """
+    Generate manhattan and QQ plot data, and find the top hit, in a single pass over the normalized file.
+
+    Each batch of rows is fed to every consumer in turn, so the file is only read and decompressed once. The outputs
+        are the same as running `generate_manhattan`, `generate_qq`, and `get_top_hit` separately.
+    """
+    parts = _summarize(in_filename, qq_streaming, threads=threads, reporter=reporter)
+    return _write_summaries(parts, manhattan_path, qq_path)
+
+
+@helpers.capture_errors
+def get_summary_shards(in_filename: str) -> ty.List[str]:
+    """Divide the normalized file into shards that can be summarized separately (one per chromosome, in file order)"""
+    return columnar.get_chromosomes(in_filename)
+
+
+@helpers.capture_errors
+def summarize_shard(in_filename: str, chrom: str, partial_path: str, qq_streaming: bool = False,
+                    reporter: progress.ProgressReporter = None) -> bool:
+    """
+    Summarize the rows for one chromosome, and save the partial results so that they can be merged later
+
+    Partial results are pickled: they are an internal format, and should never be read from an untrusted source.
+    """
+    parts = _summarize(in_filename, qq_streaming, chrom=chrom, reporter=reporter)
+    with open(partial_path, 'wb') as f:
+        pickle.dump(parts, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return True
+
+
+@helpers.capture_errors
+def merge_summaries(partial_paths: ty.List[str], manhattan_path: str, qq_path: str):
+    """
+    Combine the partial results from `summarize_shard` (in file order), and write the same files as
+        `generate_summaries`. QQ data and the top hit are the same as for a single pass; Manhattan plot data can differ
+        slightly (see `manhattan.CompactBinner`).
+    """
+    merged = None
+    for path in partial_paths:
+        with open(path, 'rb') as f:
+            parts = pickle.load(f)
+        if merged is None:
+            merged = parts
+        else:
+            merged.merge(parts)
+
+    return _write_summaries(merged or SummaryParts.create(), manhattan_path, qq_path)
 
 
 @helpers.capture_errors
 def generate_manhattan(in_filename: str, out_filename: str) -> bool:
     """Generate manhattan plot data for the processed file"""
-    # FIXME: Pheweb loader code does not handle infinity values, so we exclude these from manhattan plots
-    #   This is almost assuredly not the final desired behavior
-    reader = readers.standard_gwas_reader(in_filename)\
-        .add_filter('neg_log_pvalue', lambda v, row: v is not None)
-
-    binner = manhattan.Binner()
-    for variant in reader:
-        binner.process_variant(variant)
+    binner = manhattan.CompactBinner()
+    for batch in _read_summary_batches(in_filename):
+        binner.process_batch(batch)
 
     manhattan_data = binner.get_result()
 
@@ -88,34 +547,23 @@ def generate_manhattan(in_filename: str, out_filename: str) -> bool:
 
 
 @helpers.capture_errors
-def generate_qq(in_filename: str, out_filename) -> bool:
-    """Largely borrowed from PheWeb code (load.qq.make_json_file)"""
+def generate_qq(in_filename: str, out_filename, streaming: bool = False) -> bool:
+    """
+    Largely borrowed from PheWeb code (load.qq.make_json_file)
+
+    The exact calculation loads ALL qvals into memory, because it relies on sorting them. Streaming mode uses bounded
+        memory, at the cost of a small, documented error (see `qq.QQHistogram`)
+    """
     # TODO: Currently the ingest pipeline never stores "af"/"maf" at all, which could affect this calculation
-    # TODO: This step appears to load ALL data into memory (list on generator). This could be a memory hog; not sure if
-    #   there is a way around it as it seems to rely on sorting values
 
     # FIXME: See note above: we will exclude "infinity" values for now, but this is not the desired behavior because it
     #   hides the hits of greatest interest
-    reader = readers.standard_gwas_reader(in_filename)\
-        .add_filter("neg_log_pvalue", lambda v, row: v is not None)
-
-    # TODO: Pheweb QQ code benefits from being passed { num_samples: n }, from metadata stored outside the
-    #   gwas file. This is used when AF/MAF are present (which at the moment ingest pipeline does not support)
-
-    variants = list(qq.augment_variants(reader))
-
-    rv = {}
-    if variants:
-        if variants[0].maf is not None:
-            rv['overall'] = qq.make_qq_unstratified(variants, include_qq=False)
-            rv['by_maf'] = qq.make_qq_stratified(variants)
-            rv['ci'] = list(qq.get_confidence_intervals(len(variants) / len(rv['by_maf'])))
-        else:
-            rv['overall'] = qq.make_qq_unstratified(variants, include_qq=True)
-            rv['ci'] = list(qq.get_confidence_intervals(len(variants)))
+    accumulator = qq.QQAccumulator(streaming=streaming)
+    for batch in _read_summary_batches(in_filename):
+        accumulator.process_batch(batch)
 
     with open(out_filename, 'w') as f:
-        json.dump(rv, f)
+        json.dump(accumulator.get_result(), f)
 
     return True
 
@@ -127,15 +575,7 @@ def get_top_hit(in_filename: str):
 
     Although most of the tasks in our pipeline are written to be ORM-agnostic, this one modifies the database.
     """
-    reader = readers.standard_gwas_reader(in_filename).add_filter("neg_log_pvalue", lambda v, row: v is not None)
-    best_pval = 1
-    best_row = None
-    for row in reader:
-        if row.pval < best_pval:
-            best_pval = row.pval
-            best_row = row
-
-    if best_row is None:
-        raise TopHitException('No usable top hit could be identified. Check that the file has valid p-values.')
-
-    return best_row
+    tracker = tophit.TopHitTracker()
+    for batch in _read_summary_batches(in_filename):
+        tracker.process_batch(batch)
+    return tracker.get_result()
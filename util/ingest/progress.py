@@ -0,0 +1,87 @@
+"""
+Track the progress of a long-running ingest step, and report it (at a limited rate) to anyone who is watching
+"""
+import time
+import typing as ty
+
+from . import telemetry
+
+# Only check the clock this often (in rows), so that counting rows stays cheap
+_CHECK_EVERY = 1000
+
+
+class ProgressReporter:
+    """
+    Count the rows processed by a step, and publish stats no more than once every `min_interval` seconds
+
+    Steps call `start`, then `add_rows` (or `update`) as they work, then `finish`.
+
+    If the step can tell how much of its input has been read (see `start`), the stats also include an estimate of the
+        time remaining. Without a `publish` function, rows are counted but nothing is reported.
+    """
+    def __init__(self, publish: ty.Callable[[dict], None] = None, *, min_interval: float = 1.0,
+                 clock: ty.Callable[[], float] = time.monotonic):
+        self.rows = 0
+        self._publish = publish
+        self._min_interval = min_interval
+        self._clock = clock
+
+        self._total_bytes: ty.Optional[int] = None
+        self._get_bytes_read: ty.Optional[ty.Callable[[], int]] = None
+        self._started = clock()
+        self._last_published: ty.Optional[float] = None
+        self._next_check = _CHECK_EVERY
+
+        # Rows also count towards the resource use of the step (if it is being measured)
+        telemetry.track_rows(self)
+
+    def start(self, *, total_bytes: int = None, get_bytes_read: ty.Callable[[], int] = None):
+        """Begin timing, optionally with a way to tell how much of the input (of size `total_bytes`) has been read"""
+        self._total_bytes = total_bytes
+        self._get_bytes_read = get_bytes_read
+        self._started = self._clock()
+        self._report(done=False)
+
+    def add_rows(self, count: int = 1):
+        self.rows += count
+        if self.rows >= self._next_check:
+            self._next_check = self.rows + _CHECK_EVERY
+            self.update()
+
+    def update(self):
+        """Report the current stats, unless they were reported very recently"""
+        if self._last_published is None or self._clock() - self._last_published >= self._min_interval:
+            self._report(done=False)
+
+    def finish(self):
+        """Always report the final stats, no matter how recently the last report was sent"""
+        self._report(done=True)
+
+    def get_stats(self, *, done: bool = False) -> dict:
+        elapsed = max(self._clock() - self._started, 1e-9)
+        if done and self._total_bytes is not None:
+            bytes_read = self._total_bytes  # The input may already be closed
+        else:
+            bytes_read = self._get_bytes_read() if self._get_bytes_read else None
+
+        eta = None
+        if done:
+            eta = 0.0
+        elif bytes_read and self._total_bytes:
+            eta = max(self._total_bytes - bytes_read, 0) / (bytes_read / elapsed)
+
+        return {
+            'rows': self.rows,
+            'bytes_read': bytes_read,
+            'total_bytes': self._total_bytes,
+            'elapsed_seconds': round(elapsed, 1),
+            'rows_per_second': round(self.rows / elapsed, 1),
+            'eta_seconds': None if eta is None else round(eta, 1),
+            'done': done,
+        }
+
+    def _report(self, *, done: bool):
+        if self._publish is None:
+            return
+        self._last_published = self._clock()
+        self._publish(self.get_stats(done=done))
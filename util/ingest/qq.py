@@ -9,6 +9,7 @@ Extracted from PheWeb: 2cfaa69
 
 # Peter has included some original notes on the processing requirements, as follows::
 # TODO: reduce QQ memory using Counter(v.qval for v in variants).
+#      - (implemented for unstratified plots as `QQHistogram`, aka "streaming mode")
 #      - but we still need to split into 4 strata using MAF. Can that be done efficiently?
 #          a) we could keep balanced lists for the 4 strata, but we can only be confidently start processing variants once we've read 3/4 of all variants
 #          b) we could assume that, since we're sorted by chr-pos-ref-alt, MAF should be pretty randomly ordered.
@@ -18,21 +19,29 @@ Extracted from PheWeb: 2cfaa69
 
 # NOTE: `qval` means `-log10(pvalue)`
 
+import array
 import collections
 import logging
 import math
 import typing as ty
 
-import boltons.iterutils
 import boltons.mathutils
+import numpy as np
 import scipy.stats
 from zorp.parsers import _basic_standard_container
 
+from . import columnar
+
 
 NUM_BINS = 400
 NUM_MAF_RANGES = 4
 MAF_SIGFIGS = 2
 
+# Streaming mode (see `QQHistogram`): most qvals are counted in buckets of this width...
+STREAMING_QVAL_RESOLUTION = 1e-4
+# ...but the rare (and most interesting) qvals at or above this threshold are counted exactly
+STREAMING_EXACT_QVAL = 5
+
 
 logger = logging.getLogger(__name__)
 
@@ -67,17 +76,21 @@ def get_maf(variant, num_samples = None):
 Variant = collections.namedtuple('Variant', ['qval', 'maf'])
 
 
+def augment_variant(variant: _basic_standard_container, num_samples=None) -> Variant:
+    v = variant.to_dict()
+
+    if v['pvalue'] == 0:
+        # FIXME: Why does QQ plot require this stub value?
+        qval = 1000  # TODO(pjvh): make an option "convert_pval0_to = [num|None]"
+    else:
+        qval = v['neg_log_pvalue']
+    maf = get_maf(v, num_samples=num_samples)
+    return Variant(qval=qval, maf=maf)
+
+
 def augment_variants(variants: ty.Iterator[_basic_standard_container], num_samples=None):
     for v in variants:
-        v = v.to_dict()
-
-        if v['pvalue'] == 0:
-            # FIXME: Why does QQ plot require this stub value?
-            qval = 1000  # TODO(pjvh): make an option "convert_pval0_to = [num|None]"
-        else:
-            qval = v['neg_log_pvalue']
-        maf = get_maf(v, num_samples=num_samples)
-        yield Variant(qval=qval, maf=maf)
+        yield augment_variant(v, num_samples=num_samples)
 
 
 def round_sig(x, digits):
@@ -105,27 +118,30 @@ assert approx_equal(42, 42.0000001)
 assert not approx_equal(42, 42.01)
 
 
-def make_qq_stratified(variants):
-    variants = sorted(variants, key=lambda v: v.maf)
+def make_qq_stratified(qvals: np.ndarray, mafs: np.ndarray):
+    # A stable sort keeps variants with the same maf in file order, just like `sorted(variants, key=maf)`
+    order = np.argsort(mafs, kind='stable')
+    qvals = qvals[order]
+    mafs = mafs[order]
 
     def make_strata(idx):
         # Note: slice_indices[1] is the same as slice_indices[0] of the next slice.
-        # But that's not a problem, because range() ignores the last index.
-        slice_indices = (len(variants) * idx // NUM_MAF_RANGES,
-                         len(variants) * (idx + 1) // NUM_MAF_RANGES)
-        qvals = sorted((variants[i].qval for i in range(*slice_indices)), reverse=True)
+        # But that's not a problem, because slices ignore the last index.
+        slice_indices = (len(qvals) * idx // NUM_MAF_RANGES,
+                         len(qvals) * (idx + 1) // NUM_MAF_RANGES)
+        strata_qvals = np.sort(qvals[slice_indices[0]:slice_indices[1]])[::-1]
         return {
-            'maf_range': (variants[slice_indices[0]].maf,
-                          variants[slice_indices[1] - 1].maf),
-            'count': len(qvals),
-            'qq': compute_qq(qvals),
+            'maf_range': (float(mafs[slice_indices[0]]),
+                          float(mafs[slice_indices[1] - 1])),
+            'count': len(strata_qvals),
+            'qq': compute_qq(strata_qvals),
         }
 
     return [make_strata(i) for i in range(NUM_MAF_RANGES)]
 
 
-def make_qq_unstratified(variants, include_qq):
-    qvals = sorted((v.qval for v in variants), reverse=True)
+def make_qq_unstratified(qvals: np.ndarray, include_qq):
+    qvals = np.sort(qvals)[::-1]
     rv = {}
     if include_qq:
         rv['qq'] = compute_qq(qvals)
@@ -140,9 +156,31 @@ def make_qq_unstratified(variants, include_qq):
     return rv
 
 
-def compute_qq(qvals):
+def _assert_decreasing(qvals: np.ndarray):
+    assert np.all(qvals[:-1] >= qvals[1:])
+
+
+def _get_exp_bins(indices: np.ndarray, num_qvals: int, max_exp_qval: float) -> np.ndarray:
+    """
+    The expected bin for each (sorted) qval. Equivalent to `int(-math.log10((i + 0.5) / n) / max_exp_qval * NUM_BINS)`
+
+    NumPy's log10 can differ from `math.log10` in the last bit, which would occasionally put a value that lies almost
+        exactly on a bin edge into the neighboring bin. Those few values are recalculated exactly as in the original
+        (per-variant) code, so that the results are identical.
+    """
+    scaled = -np.log10((indices + 0.5) / num_qvals) / max_exp_qval * NUM_BINS
+    exp_bins = scaled.astype(np.int64)
+
+    fraction = scaled - exp_bins
+    for j in np.flatnonzero((fraction < 1e-9) | (fraction > 1 - 1e-9)):
+        i = int(indices[j])
+        exp_bins[j] = int(-math.log10((i + 0.5) / num_qvals) / max_exp_qval * NUM_BINS)
+    return exp_bins
+
+
+def compute_qq(qvals: np.ndarray):
     # qvals must be in decreasing order.
-    assert all(a >= b for a, b in boltons.iterutils.pairwise(qvals))
+    _assert_decreasing(qvals)
 
     if len(qvals) == 0:
         return []
@@ -157,24 +195,80 @@ def compute_qq(qvals):
 
     # this calculation must avoid dropping points that would be shown by the calculation done in javascript.
     # `max_obs_qval` means the largest observed -log10(pvalue) that will be shown in the plot. It's usually NOT the largest in the data.
-    max_obs_qval = boltons.mathutils.clamp(qvals[0],
+    max_obs_qval = boltons.mathutils.clamp(float(qvals[0]),
                                            lower=max_exp_qval,
                                            upper=math.ceil(2 * max_exp_qval))
     if qvals[0] > max_obs_qval:
-        for qval in qvals:
+        first_shown = int(np.argmax(qvals <= max_obs_qval))
+        if qvals[first_shown] <= max_obs_qval:
+            max_obs_qval = float(qvals[first_shown])
+
+    shown = np.flatnonzero(qvals <= max_obs_qval)
+    exp_bins = _get_exp_bins(shown, len(qvals), max_exp_qval)
+    # TODO(pjvh): it'd be great if the `obs_bin`s started right at the lowest qval in that `exp_bin`.
+    #       that way we could have fewer bins but still get a nice straight diagonal line without that stair-stepping appearance.
+    obs_bins = (qvals[shown] / max_obs_qval * NUM_BINS).astype(np.int64)
+
+    assert np.all((0 <= exp_bins) & (exp_bins <= NUM_BINS)), exp_bins
+    assert np.all((0 <= obs_bins) & (obs_bins <= NUM_BINS)), obs_bins
+
+    # Mark each occupied (exp_bin, obs_bin) pair in a grid. Reading the grid back gives unique pairs in sorted order.
+    occupied = np.zeros((NUM_BINS + 1) ** 2, dtype=bool)
+    occupied[exp_bins * (NUM_BINS + 1) + obs_bins] = True
+    occupied_exp_bins, occupied_obs_bins = np.divmod(np.flatnonzero(occupied), NUM_BINS + 1)
+
+    bins = list(zip(
+        (occupied_exp_bins / NUM_BINS * max_exp_qval).tolist(),
+        (occupied_obs_bins / NUM_BINS * max_obs_qval).tolist()
+    ))
+    return {
+        'bins': bins,
+        'max_exp_qval': max_exp_qval,
+    }
+
+
+def compute_qq_streaming(histogram: 'QQHistogram'):
+    """Equivalent to `compute_qq`, but uses the (approximate) qval counts from a histogram"""
+    qvals = histogram.get_counts()
+    num_qvals = histogram.count
+
+    if num_qvals == 0:
+        return []
+
+    if qvals[0][0] == 0:
+        logger.warning('WARNING: All pvalues are 1! How is that supposed to make a QQ plot?')
+        return []
+
+    max_exp_qval = -math.log10(0.5 / num_qvals)
+    max_obs_qval = boltons.mathutils.clamp(qvals[0][0],
+                                           lower=max_exp_qval,
+                                           upper=math.ceil(2 * max_exp_qval))
+    if qvals[0][0] > max_obs_qval:
+        for qval, _ in qvals:
             if qval <= max_obs_qval:
                 max_obs_qval = qval
                 break
 
+    def get_exp_bin(i):
+        return int(-math.log10((i + 0.5) / num_qvals) / max_exp_qval * NUM_BINS)
+
     occupied_bins = set()
-    for i, obs_qval in enumerate(qvals):
-        if obs_qval > max_obs_qval: continue
-        exp_qval = -math.log10((i + 0.5) / len(qvals))
-        exp_bin = int(exp_qval / max_exp_qval * NUM_BINS)
-        # TODO(pjvh): it'd be great if the `obs_bin`s started right at the lowest qval in that `exp_bin`.
-        #       that way we could have fewer bins but still get a nice straight diagonal line without that stair-stepping appearance.
+    i = 0
+    for obs_qval, count in qvals:
+        start, end = i, i + count
+        i = end
+        if obs_qval > max_obs_qval:
+            continue
         obs_bin = int(obs_qval / max_obs_qval * NUM_BINS)
-        occupied_bins.add((exp_bin, obs_bin))
+
+        # Only the most significant few variants can skip over an expected bin. Once the distance between consecutive
+        #   expected qvals is well under one bin, every bin in a run of identical observed values is occupied.
+        while start < end and math.log10((start + 1.5) / (start + 0.5)) / max_exp_qval * NUM_BINS >= 0.5:
+            occupied_bins.add((get_exp_bin(start), obs_bin))
+            start += 1
+        if start < end:
+            occupied_bins.update((exp_bin, obs_bin)
+                                 for exp_bin in range(get_exp_bin(end - 1), get_exp_bin(start) + 1))
 
     bins = []
     for exp_bin, obs_bin in occupied_bins:
@@ -190,10 +284,27 @@ def compute_qq(qvals):
     }
 
 
-def gc_value_from_list(qvals, quantile=0.5):
+def make_qq_unstratified_streaming(histogram: 'QQHistogram', include_qq):
+    """Equivalent to `make_qq_unstratified`, but uses the (approximate) qval counts from a histogram"""
+    rv = {}
+    if include_qq:
+        rv['qq'] = compute_qq_streaming(histogram)
+    rv['count'] = histogram.count
+    rv['gc_lambda'] = {}
+    for perc in ['0.5', '0.1', '0.01', '0.001']:
+        quantile = float(perc)
+        gc = gc_value(10 ** -histogram.get_value(int(histogram.count * quantile)), quantile)
+        if math.isnan(gc) or abs(gc) == math.inf:
+            logger.warning('WARNING: got gc_value {!r}'.format(gc))
+        else:
+            rv['gc_lambda'][perc] = round_sig(gc, 5)
+    return rv
+
+
+def gc_value_from_list(qvals: np.ndarray, quantile=0.5):
     # qvals must be in decreasing order.
-    assert all(a >= b for a, b in boltons.iterutils.pairwise(qvals))
-    qval = qvals[int(len(qvals) * quantile)]
+    _assert_decreasing(qvals)
+    qval = float(qvals[int(len(qvals) * quantile)])
     pval = 10 ** -qval
     return gc_value(pval, quantile)
 
@@ -221,10 +332,235 @@ def get_confidence_intervals(num_variants, confidence=0.95):
     variant_counts.append(num_variants - 1)
     variant_counts.reverse()
 
-    for variant_count in variant_counts:
-        rv = scipy.stats.beta(variant_count, num_variants - variant_count)
+    # Calculate all the points at once; each call to the scipy distribution has significant overhead
+    counts = np.array(variant_counts, dtype=np.float64)
+    rv = scipy.stats.beta(counts, num_variants - counts)
+    y_mins = rv.ppf(1 - one_sided_doubt).tolist()
+    y_maxes = rv.ppf(one_sided_doubt).tolist()
+
+    for variant_count, y_min, y_max in zip(variant_counts, y_mins, y_maxes):
         yield {
             'x': round(-math.log10((variant_count - 0.5) / num_variants), 2),
-            'y_min': round(-math.log10(rv.ppf(1 - one_sided_doubt)), 2),
-            'y_max': round(-math.log10(rv.ppf(one_sided_doubt)), 2),
+            'y_min': round(-math.log10(y_min), 2),
+            'y_max': round(-math.log10(y_max), 2),
         }
+
+
+class QQHistogram:
+    """
+    Count qvals in fixed-width buckets, so that QQ plot data can be calculated in memory proportional to the number of
+        occupied buckets, rather than the number of variants.
+
+    Error bound, compared to the exact calculation:
+    - The variant count and the expected qvals are exact. So is every observed qval that is 0 (p=1), at least
+        `exact_qval`, or at least the expected qval of the most significant variant (`max_exp_qval`). The largest of
+        the other qvals is also kept exact, because it can set the scale of the plot (eg, when the data also has p=0
+        rows, which are far above the plotted range). Every other observed qval is replaced by the midpoint of its
+        bucket (or the largest value, if that is lower), which is within `resolution / 2` of the true value.
+    - QQ plot: a point can only move to the adjacent observed bin, and only if its true value lies within
+        `resolution / 2` of a bin edge. (with default settings, plot bins are dozens of times wider than the buckets)
+    - GC lambda: the pvalue at each quantile has a relative error of at most `ln(10) * resolution / 2`. With the
+        default resolution, any lambda of about 1 or more changes by a relative error of less than 3e-4.
+    """
+    def __init__(self, *, resolution: float = STREAMING_QVAL_RESOLUTION, exact_qval: float = STREAMING_EXACT_QVAL):
+        self._resolution = resolution
+        self._exact_qval = exact_qval
+
+        self._buckets: ty.Counter[int] = collections.Counter()
+        self._exact: ty.Counter[float] = collections.Counter()
+        # The largest value that would otherwise be bucketed, and how many times it was seen
+        self._top_qval = -math.inf
+        self._top_count = 0
+        self.count = 0
+
+        # The QQ plot is scaled by the largest observed value that is >= max_exp_qval. For small studies that is below
+        #   `exact_qval`, so qvals above max_exp_qval *so far* are also counted exactly. (the threshold only ever grows)
+        self._threshold = 0.0
+        self._next_threshold_update = 1
+
+    def add(self, qval: float):
+        self.count += 1
+        if self.count >= self._next_threshold_update:
+            self._threshold = min(self._exact_qval, -math.log10(0.5 / self.count))
+            self._next_threshold_update *= 2
+
+        if qval == 0 or qval >= self._threshold:
+            self._exact[qval] += 1
+        else:
+            self._add_bucketed(qval, 1)
+
+    def _add_bucketed(self, qval: float, count: int):
+        """Count a value that is below the threshold: in a bucket, unless it is the largest such value so far"""
+        if qval == self._top_qval:
+            self._top_count += count
+            return
+        if qval > self._top_qval:
+            qval, count, self._top_qval, self._top_count = self._top_qval, self._top_count, qval, count
+        if count:
+            self._buckets[math.floor(qval / self._resolution)] += count
+
+    def add_batch(self, qvals: np.ndarray):
+        """Equivalent to calling `add` on each value in turn"""
+        if not len(qvals):
+            return
+
+        # The threshold is updated whenever the count reaches a power of 2. Find which power applies to each value...
+        counts = np.arange(self.count + 1, self.count + len(qvals) + 1)
+        powers = np.frexp(counts.astype(np.float64))[1] - 1
+        thresholds = np.empty(len(qvals), dtype=np.float64)
+        for power in np.unique(powers).tolist():
+            thresholds[powers == power] = min(self._exact_qval, -math.log10(0.5 / 2 ** power))
+
+        is_exact = (qvals == 0) | (qvals >= thresholds)
+        self._exact.update(qvals[is_exact].tolist())
+        bucketed = qvals[~is_exact]
+        if len(bucketed):
+            batch_top = bucketed.max()
+            is_top = bucketed == batch_top
+            self._add_bucketed(float(batch_top), int(np.count_nonzero(is_top)))
+            bucketed = bucketed[~is_top]
+        buckets, bucket_counts = np.unique(np.floor(bucketed / self._resolution), return_counts=True)
+        self._buckets.update(dict(zip(buckets.astype(np.int64).tolist(), bucket_counts.tolist())))
+
+        # ...and leave the threshold in the same state as if values had been added one at a time
+        self.count += len(qvals)
+        last_power = 2 ** int(powers[-1])
+        self._threshold = min(self._exact_qval, -math.log10(0.5 / last_power))
+        self._next_threshold_update = last_power * 2
+
+    def merge(self, other: 'QQHistogram'):
+        """
+        Add the counts from another histogram (with the same settings). The error bound still holds: a value is only
+            bucketed if it was below the threshold for the count at that time, which is never more than the final one.
+        """
+        if (other._resolution, other._exact_qval) != (self._resolution, self._exact_qval):
+            raise ValueError('Cannot merge histograms with different settings')
+
+        self._buckets.update(other._buckets)
+        self._exact.update(other._exact)
+        self._add_bucketed(other._top_qval, other._top_count)
+        self.count += other.count
+
+        if self.count:
+            last_power = 2 ** (self.count.bit_length() - 1)
+            self._threshold = min(self._exact_qval, -math.log10(0.5 / last_power))
+            self._next_threshold_update = last_power * 2
+
+    def get_counts(self) -> ty.List[ty.Tuple[float, int]]:
+        """List of (qval, count) pairs, in decreasing order of qval"""
+        # No bucket is shown above the largest value in it (so no value moves above the scale of the plot)
+        counts = [(min((bucket + 0.5) * self._resolution, self._top_qval), count)
+                  for bucket, count in self._buckets.items()]
+        if self._top_count:
+            counts.append((self._top_qval, self._top_count))
+        counts.extend(self._exact.items())
+        return sorted(counts, reverse=True)
+
+    def get_value(self, index: int) -> float:
+        """The nth largest qval (as if all qvals were stored in a list sorted in decreasing order)"""
+        seen = 0
+        for qval, count in self.get_counts():
+            seen += count
+            if index < seen:
+                return qval
+        raise IndexError('Histogram index out of range')
+
+
+class QQAccumulator:
+    """
+    Collect QQ plot data one variant at a time, so that it can share a single pass over the file with other
+        summary steps (see `processors.generate_summaries`)
+
+    In exact mode, qvals (and mafs, if present) are stored in compact arrays (8 bytes per value). In streaming mode,
+        qvals are counted by a `QQHistogram` instead. This uses bounded memory, but results are approximate (see error
+        bounds in `QQHistogram`). MAF-stratified plots still require the exact calculation; if the first variant has a
+        MAF, this falls back to exact mode.
+    """
+    def __init__(self, num_samples=None, streaming: bool = False):
+        # TODO: Pheweb QQ code benefits from being passed { num_samples: n }, from metadata stored outside the
+        #   gwas file. This is used when AF/MAF are present (which at the moment ingest pipeline does not support)
+        self._num_samples = num_samples
+        self._qvals = array.array('d')
+        self._mafs: ty.Optional[array.array] = None
+        self._histogram = QQHistogram() if streaming else None
+
+    def process_variant(self, variant: _basic_standard_container):
+        augmented = augment_variant(variant, num_samples=self._num_samples)
+        if self._is_empty() and augmented.maf is not None:
+            # Stratified plots are only made if the very first variant has maf information
+            if self._histogram is not None:
+                logger.info('Variants have MAF information; using exact QQ mode for stratified plots')
+                self._histogram = None
+            self._mafs = array.array('d')
+
+        if self._histogram is not None:
+            self._histogram.add(augmented.qval)
+            return
+
+        self._qvals.append(augmented.qval)
+        if self._mafs is not None:
+            self._mafs.append(augmented.maf)
+
+    def process_batch(self, batch: 'columnar.VariantBatch'):
+        """
+        Process many variants at once. Equivalent to calling `process_variant` on each row.
+
+        The normalized file format does not store any MAF information, so batches are never stratified.
+        """
+        # FIXME: Why does QQ plot require this stub value? (see `augment_variant`)
+        qvals = np.where(batch.pval == 0, 1000, batch.neg_log_pvalue)
+        if self._histogram is not None:
+            self._histogram.add_batch(qvals)
+        else:
+            self._qvals.frombytes(qvals.astype(np.float64).tobytes())
+
+    def merge(self, other: 'QQAccumulator'):
+        """
+        Combine with an accumulator that processed the rows after this one (eg, the next chromosome in the file).
+            `other` should not be used afterwards.
+
+        Exact results are the same as for a single pass. In streaming mode, the usual error bound applies.
+        """
+        if other._is_empty():
+            return
+        elif self._is_empty():
+            # The first variant decides whether the plot is stratified, so use the other accumulator as-is
+            self._qvals, self._mafs, self._histogram = other._qvals, other._mafs, other._histogram
+        elif self._histogram is not None:
+            if other._histogram is not None:
+                self._histogram.merge(other._histogram)
+            else:
+                self._histogram.add_batch(np.frombuffer(other._qvals, dtype=np.float64))
+        elif other._histogram is not None or (self._mafs is None) != (other._mafs is None):
+            raise ValueError('Cannot merge QQ data: only some variants have MAF information')
+        else:
+            self._qvals.extend(other._qvals)
+            if self._mafs is not None:
+                self._mafs.extend(other._mafs)
+
+    def _is_empty(self) -> bool:
+        return self._histogram.count == 0 if self._histogram is not None else len(self._qvals) == 0
+
+    def get_result(self) -> dict:
+        if self._histogram is not None:
+            return self._get_streaming_result(self._histogram)
+
+        qvals = np.frombuffer(self._qvals, dtype=np.float64)
+        rv = {}
+        if len(qvals):
+            if self._mafs is not None:
+                mafs = np.frombuffer(self._mafs, dtype=np.float64)
+                rv['overall'] = make_qq_unstratified(qvals, include_qq=False)
+                rv['by_maf'] = make_qq_stratified(qvals, mafs)
+                rv['ci'] = list(get_confidence_intervals(len(qvals) / len(rv['by_maf'])))
+            else:
+                rv['overall'] = make_qq_unstratified(qvals, include_qq=True)
+                rv['ci'] = list(get_confidence_intervals(len(qvals)))
+        return rv
+
+    def _get_streaming_result(self, histogram: QQHistogram) -> dict:
+        rv = {}
+        if histogram.count:
+            rv['overall'] = make_qq_unstratified_streaming(histogram, include_qq=True)
+            rv['ci'] = list(get_confidence_intervals(histogram.count))
+        return rv
@@ -0,0 +1,44 @@
+"""
+Decide which Celery queue each ingest task runs on, and how long it may take, based on the size of the upload
+
+Small uploads go to a "fast" queue, and large ones to a "heavy" queue, so that small uploads are not stuck behind a
+    few very large files. Time limits grow with the size of the file: a single limit is either too short for large
+    uploads, or too long to catch a task that is stuck on a small one.
+"""
+import math
+import typing as ty
+
+GB = 2 ** 30
+
+
+def get_queue(upload_bytes: ty.Optional[int], *, heavy_threshold: int, fast_queue: str, heavy_queue: str) -> str:
+    """The queue for an upload of this size (uploads of unknown size are assumed to be small)"""
+    if upload_bytes is not None and upload_bytes > heavy_threshold:
+        return heavy_queue
+    return fast_queue
+
+
+def get_time_limits(upload_bytes: ty.Optional[int], *, seconds_per_gb: float, minimum: int,
+                    grace: int) -> ty.Tuple[int, int]:
+    """
+    The (soft, hard) time limits (in seconds) for one task that reads an upload of this size
+
+    :param upload_bytes: Size of the data read by the task
+    :param seconds_per_gb: Time allowed for each GB of data
+    :param minimum: The shortest soft time limit, however small the data
+    :param grace: Time between the soft and hard limits, so that a task can clean up after it is interrupted
+    """
+    soft = max(minimum, math.ceil((upload_bytes or 0) / GB * seconds_per_gb))
+    return soft, soft + grace
+
+
+def get_task_options(upload_bytes: ty.Optional[int], *, heavy_threshold: int, fast_queue: str, heavy_queue: str,
+                     seconds_per_gb: float, minimum: int, grace: int) -> dict:
+    """Options for `Signature.set` (or `apply_async`) that route and limit one ingest task"""
+    soft, hard = get_time_limits(upload_bytes, seconds_per_gb=seconds_per_gb, minimum=minimum, grace=grace)
+    return {
+        'queue': get_queue(upload_bytes, heavy_threshold=heavy_threshold,
+                           fast_queue=fast_queue, heavy_queue=heavy_queue),
+        'soft_time_limit': soft,
+        'time_limit': hard,
+    }
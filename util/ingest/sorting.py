@@ -0,0 +1,210 @@
+"""
+Sort a raw GWAS file by chromosome and position, using bounded memory (an external merge sort)
+
+Rows are read in chunks that fit within a memory budget. Each chunk is sorted and written to a temporary "run" file,
+    and the runs are then merged (several at a time) into the sorted output. Memory use depends on the budget, not on
+    the size of the file; the runs need about as much scratch disk space as the (uncompressed) file.
+"""
+import heapq
+import itertools
+import logging
+import os
+import re
+import shutil
+import tempfile
+import typing as ty
+
+from zorp import parsers, sniffers
+
+from . import bgzf, helpers, progress
+
+logger = logging.getLogger(__name__)
+
+# Memory (in bytes) used to hold rows while they are sorted
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+# The most runs merged at once. Each needs an open file (with a read buffer); more runs are merged in several passes.
+MAX_MERGE_FAN_IN = 64
+# Estimated memory used by each row being sorted, in addition to its text (the string object, list entry, and sort key)
+_ROW_OVERHEAD = 200
+# Buffer size (per run) for reading and writing runs
+_RUN_BUFFER_SIZE = 2 ** 16
+# Rows written at a time
+_WRITE_BATCH = 10_000
+
+_CHROM_PREFIX = re.compile(r'^chr', re.IGNORECASE)
+_CHROM_ORDER = {'X': 1, 'Y': 2, 'M': 3, 'MT': 3}
+# Rows with no readable chromosome and position go at the end (the normalizer will report them)
+_UNREADABLE = (5, 0, '', 0)
+
+SortKey = ty.Tuple[int, int, str, int]
+
+
+def _make_key(parser_options: dict) -> ty.Callable[[str], SortKey]:
+    """Sort numbered chromosomes by number, then X, Y, and M, then any others by name; then by position"""
+    chrom_col = parser_options['chr_col'] - 1
+    pos_col = parser_options['pos_col'] - 1
+    delimiter = parser_options.get('delimiter', '\t')
+
+    def get_key(line: str) -> SortKey:
+        fields = line.split(delimiter)
+        try:
+            chrom = fields[chrom_col].strip()
+            pos = int(fields[pos_col])
+        except (IndexError, ValueError):
+            return _UNREADABLE
+        name = _CHROM_PREFIX.sub('', chrom).upper()
+        if name.isdigit():
+            return 0, int(name), chrom, pos
+        # The original name is part of the key, so that (eg) "chr1" and "1" are never mixed together
+        return _CHROM_ORDER.get(name, 4), 0, chrom, pos
+    return get_key
+
+
+def _read_rows(src_path: str, parser_options: dict, lines: ty.Iterable[str]) -> ty.Tuple[ty.List[str], ty.Iterator]:
+    """Split a file into the header lines (as zorp would skip them) and the data rows"""
+    skip_rows = sniffers.guess_gwas(src_path, parser=parsers.GenericGwasLineParser(**parser_options))._skip_rows
+    lines_iter = iter(lines)
+    headers = list(itertools.islice(lines_iter, skip_rows))
+    return headers, (line for line in lines_iter if line)
+
+
+def can_sort(parser_options: dict) -> bool:
+    """Rows can only be sorted if the chromosome and position are in their own columns"""
+    return bool(parser_options.get('chr_col') and parser_options.get('pos_col'))
+
+
+class OrderCheck:
+    """Track whether the rows seen so far are grouped by chromosome, and sorted by position within each one"""
+    def __init__(self):
+        self._seen_chroms: ty.Set[str] = set()
+        self._prev_chrom: ty.Optional[str] = None
+        self._prev_pos = -1
+
+    def add(self, chrom: str, pos: int) -> bool:
+        """Returns False if this row is out of order"""
+        if chrom != self._prev_chrom:
+            if chrom in self._seen_chroms:
+                return False
+            self._seen_chroms.add(chrom)
+            self._prev_chrom = chrom
+        elif pos < self._prev_pos:
+            return False
+        self._prev_pos = pos
+        return True
+
+
+def is_sorted(src_path: str, parser_options: dict) -> bool:
+    """
+    Check whether the rows of a file are grouped by chromosome, and sorted by position within each one. Stops reading
+        at the first row that is out of order.
+    """
+    get_key = _make_key(parser_options)
+    _, rows = _read_rows(src_path, parser_options, helpers.SourceLines(src_path))
+    order_check = OrderCheck()
+    for row in rows:
+        key = get_key(row)
+        if key == _UNREADABLE:
+            continue
+        _, _, chrom, pos = key
+        if not order_check.add(chrom, pos):
+            return False
+    return True
+
+
+def _write_rows(f, rows: ty.Iterable[str]):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, _WRITE_BATCH))
+        if not batch:
+            return
+        batch.append('')  # End the last row too
+        f.write('\n'.join(batch))
+
+
+def _write_run(rows: ty.List[str], get_key: ty.Callable[[str], SortKey], scratch_dir: str) -> str:
+    rows.sort(key=get_key)
+    fd, path = tempfile.mkstemp(suffix='.run', dir=scratch_dir)
+    with open(fd, 'w', buffering=_RUN_BUFFER_SIZE) as f:
+        _write_rows(f, rows)
+    return path
+
+
+def _iter_run(path: str) -> ty.Iterator[str]:
+    with open(path, 'r', buffering=_RUN_BUFFER_SIZE) as f:
+        for line in f:
+            yield line[:-1]
+
+
+def _merge_runs(run_paths: ty.List[str], get_key: ty.Callable[[str], SortKey]) -> ty.Iterator[str]:
+    # Rows with equal keys stay in file order: runs are listed in file order, and `heapq.merge` is stable
+    return heapq.merge(*[_iter_run(path) for path in run_paths], key=get_key)
+
+
+def _reduce_runs(run_paths: ty.List[str], get_key: ty.Callable[[str], SortKey], scratch_dir: str) -> ty.List[str]:
+    """Merge groups of runs into fewer, longer runs, until they can all be merged at once"""
+    while len(run_paths) > MAX_MERGE_FAN_IN:
+        merged_paths = []
+        for start in range(0, len(run_paths), MAX_MERGE_FAN_IN):
+            group = run_paths[start:start + MAX_MERGE_FAN_IN]
+            fd, path = tempfile.mkstemp(suffix='.run', dir=scratch_dir)
+            with open(fd, 'w', buffering=_RUN_BUFFER_SIZE) as f:
+                _write_rows(f, _merge_runs(group, get_key))
+            for old_path in group:
+                os.remove(old_path)
+            merged_paths.append(path)
+        run_paths = merged_paths
+    return run_paths
+
+
+@helpers.capture_errors
+def sort_gwas(src_path: str, parser_options: dict, dest_path: str, *,
+              memory_budget: int = DEFAULT_MEMORY_BUDGET, scratch_dir: str = None, threads: int = 1,
+              reporter: progress.ProgressReporter = None) -> bool:
+    """
+    Write a copy of a raw GWAS file (with the same header lines) whose rows are sorted by chromosome and position. The
+        copy is BGZF compressed. Rows with the same chromosome and position stay in their original order.
+
+    :param src_path: The raw file (plain text or gzip compressed)
+    :param parser_options: How to read the file; must include `chr_col` and `pos_col` (see `can_sort`)
+    :param dest_path: Where to write the sorted file
+    :param memory_budget: Roughly how much memory (in bytes) to use for rows that are being sorted
+    :param scratch_dir: Where to write temporary files (default: the system temporary folder). Local disk is best.
+    :param threads: Threads used to decompress the input and compress the output
+    :param reporter: Tracks progress through the raw file (while the runs are written)
+    """
+    reporter = reporter or progress.ProgressReporter()
+    get_key = _make_key(parser_options)
+    lines = helpers.SourceLines(src_path, threads=threads)
+    reporter.start(total_bytes=os.path.getsize(src_path), get_bytes_read=lambda: lines.bytes_read)
+
+    work_dir = tempfile.mkdtemp(prefix='lz-sort-', dir=scratch_dir)
+    try:
+        headers, rows = _read_rows(src_path, parser_options, lines)
+        run_paths = []
+        chunk: ty.List[str] = []
+        chunk_size = 0
+        for row in rows:
+            chunk.append(row)
+            chunk_size += len(row) + _ROW_OVERHEAD
+            reporter.add_rows()
+            if chunk_size >= memory_budget:
+                run_paths.append(_write_run(chunk, get_key, work_dir))
+                chunk = []
+                chunk_size = 0
+        if chunk or not run_paths:
+            run_paths.append(_write_run(chunk, get_key, work_dir))
+        del chunk
+
+        run_paths = _reduce_runs(run_paths, get_key, work_dir)
+        with bgzf.BgzfWriter(dest_path, threads=threads) as dest:
+            _write_rows(dest, itertools.chain(headers, _merge_runs(run_paths, get_key)))
+    except Exception:
+        if os.path.isfile(dest_path):
+            os.remove(dest_path)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    reporter.finish()
+    logger.info('Sorted {} rows (in {} runs) into {}'.format(reporter.rows, len(run_paths), dest_path))
+    return True
@@ -0,0 +1,132 @@
+"""
+Generate realistic (but fake) GWAS summary statistics, for tests and benchmarks
+
+Files are sorted by chromosome and position, and mostly contain null results, plus a configurable number of peaks (a
+    strong signal that fades with distance from the peak). The same arguments always produce the same file.
+"""
+import gzip
+import typing as ty
+
+import numpy as np
+
+from . import bgzf
+
+# Parser options (see `processors.normalize_contents`) for generated files
+PARSER_OPTIONS = {
+    'chr_col': 1,
+    'pos_col': 2,
+    'ref_col': 3,
+    'alt_col': 4,
+    'pval_col': 5,
+    'is_log_pval': False,
+}
+
+# Approximate chromosome lengths (GRCh37, in Mb), used to spread variants out realistically
+CHROM_LENGTHS = {
+    '1': 249, '2': 243, '3': 198, '4': 191, '5': 181, '6': 171, '7': 159, '8': 146, '9': 141, '10': 136,
+    '11': 135, '12': 134, '13': 115, '14': 107, '15': 103, '16': 90, '17': 81, '18': 78, '19': 59, '20': 63,
+    '21': 48, '22': 51, 'X': 155,
+}
+
+# How strong (-log10 p at the center) and how wide (in bp) each peak is
+_PEAK_STRENGTH = (7.0, 40.0)
+_PEAK_WIDTH = 100_000
+
+_ALLELES = np.array(list('ACGT'))
+
+
+def _get_row_counts(rows: int, chroms: ty.List[str]) -> ty.List[int]:
+    """Split rows between chromosomes, in proportion to their length"""
+    lengths = np.array([CHROM_LENGTHS[chrom] for chrom in chroms], dtype=np.float64)
+    counts = np.floor(rows * lengths / lengths.sum()).astype(np.int64)
+    counts[0] += rows - counts.sum()
+    return counts.tolist()
+
+
+def _format_pvalues(neg_log_pvalue: np.ndarray, is_zero: np.ndarray, is_missing: np.ndarray) -> ty.List[str]:
+    with np.errstate(under='ignore'):
+        pvalues = np.power(10.0, -neg_log_pvalue)
+    text = ['{:.4g}'.format(p) for p in pvalues.tolist()]
+    for i in np.flatnonzero(is_zero).tolist():
+        text[i] = '0'
+    for i in np.flatnonzero(is_missing).tolist():
+        text[i] = 'NA'
+    return text
+
+
+def _iter_chunks(rows: int, chromosomes: int, peaks_per_million: float, zero_pval_rate: float,
+                 missing_pval_rate: float, seed: int, chunk_size: int) -> ty.Iterator[str]:
+    rng = np.random.RandomState(seed)
+    chroms = list(CHROM_LENGTHS)[:chromosomes]
+
+    for chrom, count in zip(chroms, _get_row_counts(rows, chroms)):
+        if not count:
+            continue
+        length = CHROM_LENGTHS[chrom] * 1_000_000
+        num_peaks = rng.poisson(peaks_per_million * count / 1_000_000)
+        peak_positions = np.sort(rng.randint(1, length, size=num_peaks))
+        peak_strengths = rng.uniform(*_PEAK_STRENGTH, size=num_peaks)
+
+        # Positions always increase, with random gaps that (on average) span the chromosome
+        mean_gap = max(length / count, 1.0)
+        last_pos = 0
+        for start in range(0, count, chunk_size):
+            size = min(chunk_size, count - start)
+            pos = last_pos + np.cumsum(rng.geometric(1 / mean_gap, size=size))
+            last_pos = int(pos[-1])
+
+            # Null results are uniform; near a peak, add a signal that fades with distance from the nearest peak
+            neg_log_pvalue = -np.log10(rng.uniform(1e-300, 1.0, size=size))
+            if num_peaks:
+                nearest = np.clip(np.searchsorted(peak_positions, pos), 1, num_peaks) - 1
+                next_peak = np.clip(nearest + 1, 0, num_peaks - 1)
+                closer = np.abs(peak_positions[next_peak] - pos) < np.abs(peak_positions[nearest] - pos)
+                nearest = np.where(closer, next_peak, nearest)
+                distance = np.abs(peak_positions[nearest] - pos) / _PEAK_WIDTH
+                neg_log_pvalue += peak_strengths[nearest] * np.exp(-distance ** 2) * rng.uniform(0.5, 1.0, size=size)
+
+            is_zero = rng.uniform(size=size) < zero_pval_rate
+            is_missing = rng.uniform(size=size) < missing_pval_rate
+
+            ref = rng.randint(0, 4, size=size)
+            alt = (ref + rng.randint(1, 4, size=size)) % 4
+
+            yield ''.join(
+                '{}\t{}\t{}\t{}\t{}\n'.format(chrom, p, r, a, pval)
+                for p, r, a, pval in zip(pos.tolist(), _ALLELES[ref].tolist(), _ALLELES[alt].tolist(),
+                                         _format_pvalues(neg_log_pvalue, is_zero, is_missing))
+            )
+
+
+def generate_gwas(path: str, rows: int, *, chromosomes: int = 22, peaks_per_million: float = 20,
+                  zero_pval_rate: float = 1e-6, missing_pval_rate: float = 1e-3, seed: int = 0,
+                  chunk_size: int = 100_000, threads: int = 1):
+    """
+    Write a sorted, tab-delimited GWAS file (readable with `PARSER_OPTIONS`)
+
+    :param path: Where to write the file. Paths ending in `.gz` are BGZF compressed.
+    :param rows: Total number of variants
+    :param chromosomes: Use the first N chromosomes (1-22, then X)
+    :param peaks_per_million: Average number of peaks per million rows
+    :param zero_pval_rate: Fraction of rows with p=0 (eg, a value too small for the software that wrote the file)
+    :param missing_pval_rate: Fraction of rows with no p-value (NA)
+    :param seed: Random seed; the same arguments always produce the same file
+    :param chunk_size: Rows generated at a time (limits memory use)
+    :param threads: Threads used to compress the output
+    """
+    if not 1 <= chromosomes <= len(CHROM_LENGTHS):
+        raise ValueError(f'Can generate between 1 and {len(CHROM_LENGTHS)} chromosomes')
+
+    chunks = _iter_chunks(rows, chromosomes, peaks_per_million, zero_pval_rate, missing_pval_rate, seed, chunk_size)
+    writer: ty.Any = bgzf.BgzfWriter(path, threads=threads) if path.endswith('.gz') else open(path, 'w')
+    with writer as f:
+        f.write('#chrom\tpos\tref\talt\tpvalue\n')
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def read_gwas_rows(path: str) -> int:
+    """Count the data rows in a generated file"""
+    opener: ty.Any = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return sum(1 for line in f if not line.startswith('#'))
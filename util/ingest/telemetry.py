@@ -0,0 +1,106 @@
+"""
+Measure the resources used by one ingest step: time, memory, I/O, and rows processed
+
+Memory and I/O are read from `/proc` (Linux only); elsewhere, those values are reported as None.
+"""
+import resource
+import threading
+import time
+import typing as ty
+
+# The step being measured (if any) in the current thread, so that progress reporters can contribute their row counts
+_current = threading.local()
+
+
+def _read_proc_fields(path: str) -> ty.Dict[str, int]:
+    """Read the numeric `name: value` fields from a file in /proc"""
+    fields = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                value = value.split()
+                if value and value[0].isdigit():
+                    fields[name] = int(value[0])
+    except OSError:
+        pass
+    return fields
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the "high water mark" of memory use for this process (Linux 4.0+), so that the peak of one step is known"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _get_peak_rss() -> ty.Optional[int]:
+    """Peak memory use, in bytes"""
+    peak_kb = _read_proc_fields('/proc/self/status').get('VmHWM')
+    if peak_kb is None:
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Also kB, on Linux
+    return peak_kb * 1024 if peak_kb else None
+
+
+def _get_io() -> ty.Tuple[ty.Optional[int], ty.Optional[int]]:
+    """Bytes read and written by this process so far (including data that was cached by the OS)"""
+    fields = _read_proc_fields('/proc/self/io')
+    return fields.get('rchar'), fields.get('wchar')
+
+
+def _difference(after: ty.Optional[int], before: ty.Optional[int]) -> ty.Optional[int]:
+    return None if after is None or before is None else after - before
+
+
+def track_rows(counter):
+    """Count the rows of a progress reporter (or anything with a `rows` attribute) as part of the current step"""
+    step = getattr(_current, 'step', None)
+    if step is not None:
+        step.counters.append(counter)
+
+
+class StepTelemetry:
+    """
+    Measure the resources used while a block of code runs in this process, eg:
+
+        with StepTelemetry() as usage:
+            ...
+        usage.get_result()
+
+    Peak memory is for this step alone, if the OS allows the peak to be reset; otherwise it is the peak for the
+        lifetime of the process (which may have run other tasks before).
+    """
+    def __init__(self):
+        self.counters: ty.List[ty.Any] = []
+        self._result: dict = {}
+
+    def __enter__(self):
+        self._peak_is_reset = _reset_peak_rss()
+        self._read_before, self._written_before = _get_io()
+        self._cpu_before = time.process_time()
+        self._wall_before = time.monotonic()
+        self._parent = getattr(_current, 'step', None)
+        _current.step = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current.step = self._parent
+        wall = time.monotonic() - self._wall_before
+        cpu = time.process_time() - self._cpu_before
+        read, written = _get_io()
+
+        self._result = {
+            'wall_seconds': round(wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'peak_rss_bytes': _get_peak_rss(),
+            'peak_rss_is_step': self._peak_is_reset,
+            'bytes_read': _difference(read, self._read_before),
+            'bytes_written': _difference(written, self._written_before),
+            'rows': sum(counter.rows for counter in self.counters),
+        }
+
+    def get_result(self) -> dict:
+        return dict(self._result)
@@ -0,0 +1,41 @@
+"""
+Find the single best (smallest pvalue) variant in a study
+"""
+import numpy as np
+from zorp.parsers import _basic_standard_container
+
+from . import columnar
+from .exceptions import TopHitException
+
+
+class TopHitTracker:
+    """Track the best variant seen so far; can share a single pass over the file with other summary steps"""
+    def __init__(self):
+        self._best_pval = 1
+        self._best_row = None
+
+    def process_variant(self, variant: _basic_standard_container):
+        if variant.pval < self._best_pval:
+            self._best_pval = variant.pval
+            self._best_row = variant
+
+    def process_batch(self, batch: columnar.VariantBatch):
+        """Process many variants at once. Equivalent to calling `process_variant` on each row."""
+        if not len(batch):
+            return
+
+        # Batch pvalues can differ from the parser in the last bit, so check every near-tie exactly, in file order
+        best_pval = batch.pval.min()
+        for i in np.flatnonzero(batch.pval <= best_pval * (1 + 1e-9)):
+            self.process_variant(batch.get_variant(i))
+
+    def merge(self, other: 'TopHitTracker'):
+        """Combine with a tracker that processed the rows after this one. (on ties, the earlier row wins)"""
+        if other._best_row is not None and other._best_pval < self._best_pval:
+            self._best_pval = other._best_pval
+            self._best_row = other._best_row
+
+    def get_result(self) -> _basic_standard_container:
+        if self._best_row is None:
+            raise TopHitException('No usable top hit could be identified. Check that the file has valid p-values.')
+        return self._best_row
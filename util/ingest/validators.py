@@ -1,14 +1,11 @@
 """Perform simple sanity checks to make sure the uploaded file is valid and readable"""
 
-import itertools
 import logging
+import typing as ty
 
 import magic
 
-from zorp import (
-    parsers,
-    sniffers
-)
+from zorp import parsers
 from zorp.readers import BaseReader, standard_gwas_reader
 
 from . import (
@@ -26,18 +23,30 @@ class _GwasValidator:
         self._headers = headers
 
     @helpers.capture_errors
-    def validate(self, filename: str, parser_options: dict) -> bool:
+    def validate(self, filename: str, parser_options: dict, threads: int = 1) -> bool:
         """Perform all checks for a stored file"""
         encoding = self._get_encoding(filename)
 
         # Create a reader than can handle the filetype and header format of whatever the user uploads
         parser = parsers.GenericGwasLineParser(**parser_options)
-        reader = sniffers.guess_gwas(filename, parser=parser)
+        reader = helpers.guess_gwas(filename, parser, threads=threads)
         return all([
             self._validate_mimetype(encoding),
             self._validate_contents(reader),
         ])
 
+    @helpers.capture_errors
+    def validate_file_type(self, filename: str) -> bool:
+        """
+        Check the type of a stored file. This is cheap (it does not read the whole file), and content checks can be
+            deferred until the file is parsed for some other reason (see `make_row_check`)
+        """
+        return self._validate_mimetype(self._get_encoding(filename))
+
+    def make_row_check(self) -> '_RowCheck':
+        """Create a check that validates data rows one at a time, as part of some other pass through the file"""
+        return _RowCheck()
+
     def _get_encoding(self, filename: str) -> str:
         return magic.from_file(filename, mime=True)
 
@@ -52,28 +61,13 @@ class _GwasValidator:
     @helpers.capture_errors
     def _validate_data_rows(self, reader) -> bool:
         """Data must be sorted, all values must be readable, and all chroms must be known"""
-        # Horked from PheWeb's `load.read_input_file.PhenoReader` class
-        cp_groups = itertools.groupby(reader, key=lambda v: (v.chrom, v.pos))
-
-        prev_chrom = None
-        prev_pos = -1
-        for cp, tied_variants in cp_groups:
-            cur_chrom = cp[0]
-            # TODO: Add back "chromosomes are grouped/ordered" validation
-
-            if cur_chrom == prev_chrom and cp[1] < prev_pos:
-                # Positions not in correct order for Pheweb to use
-                raise exceptions.ValidationException('Positions must be sorted prior to uploading')
-
-            prev_chrom = cur_chrom
-            prev_pos = cp[1]
+        row_check = self.make_row_check()
+        for variant in reader:
+            row_check.check_variant(variant)
 
         # Must make it through the entire file without parsing errors, with all chroms in order, and find at least
         #   one row of data
-        if prev_pos != -1:
-            return True
-        else:
-            raise exceptions.ValidationException('File must contain at least one row of data')
+        return row_check.finish()
 
     @helpers.capture_errors
     def _validate_contents(self, reader: BaseReader) -> bool:
@@ -81,4 +75,50 @@ class _GwasValidator:
         return self._validate_data_rows(reader)
 
 
+class _RowCheck:
+    """
+    Validate data rows one at a time. This lets validation share a pass over the file with other work (such as writing
+        the normalized output), instead of parsing the entire file a second time.
+    """
+    def __init__(self):
+        self._prev_chrom = None
+        self._prev_pos = -1
+        self._seen_chroms: ty.Set[str] = set()
+        self.first: ty.Optional[ty.Tuple[str, int]] = None  # (chrom, pos) of the first row seen
+
+    @property
+    def last(self) -> ty.Optional[ty.Tuple[str, int]]:
+        """(chrom, pos) of the last row seen"""
+        return (self._prev_chrom, self._prev_pos) if self.first is not None else None
+
+    def check_variant(self, variant) -> bool:
+        """Raises an error if the variant is out of order; otherwise returns True (so it can be used as a filter)"""
+        return self.check_position(variant.chrom, variant.pos)
+
+    def check_position(self, chrom: str, pos: int) -> bool:
+        # Horked from PheWeb's `load.read_input_file.PhenoReader` class
+        # TODO: Add back "chromosomes are ordered" validation
+        if chrom == self._prev_chrom and pos < self._prev_pos:
+            # Positions not in correct order for Pheweb to use
+            raise exceptions.SortOrderException('Positions must be sorted prior to uploading')
+        if chrom != self._prev_chrom:
+            if chrom in self._seen_chroms:
+                # Each chromosome must be in one block, or the file can't be indexed
+                raise exceptions.SortOrderException('Chromosomes must be grouped prior to uploading')
+            self._seen_chroms.add(chrom)
+
+        if self.first is None:
+            self.first = (chrom, pos)
+        self._prev_chrom = chrom
+        self._prev_pos = pos
+        return True
+
+    def finish(self) -> bool:
+        """Call after the last row has been read"""
+        if self._prev_pos != -1:
+            return True
+        else:
+            raise exceptions.ValidationException('File must contain at least one row of data')
+
+
 standard_gwas_validator = _GwasValidator(delimiter='\t')